@@ -31,6 +31,13 @@ class Augmentation(AlignedVolume):
             data = (self.getInput(bounding_box), self.getLabel(bounding_box))
             return data
 
+    def getInto(self, bounding_box, outs, mode="constant"):
+        result = self.get(bounding_box)
+        for data, out in zip(result, outs):
+            out[...] = data.getArray()
+
+        return result
+
     def setFrequency(self, frequency=1.0):
         self.frequency = frequency
 
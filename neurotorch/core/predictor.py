@@ -1,7 +1,7 @@
 import torch
 from torch.autograd import Variable
 import numpy as np
-from neurotorch.datasets.dataset import Data
+from neurotorch.datasets.dataset import Data, PrefetchIterator, copy_counter
 
 
 class Predictor:
@@ -25,19 +25,61 @@ class Predictor:
     def loadCheckpoint(self, checkpoint):
         self.getNet().load_state_dict(torch.load(checkpoint))
 
-    def run(self, input_volume, output_volume, batch_size=20):
+    def run(self, input_volume, output_volume, batch_size=20,
+            num_workers=0, queue_size=2, sampler=None):
+        """
+        Predicts the output volume from the input volume
+
+        :param input_volume: The volume of network inputs
+        :param output_volume: The volume that predictions are blended into
+        :param batch_size: The number of data samples in each batch
+        :param num_workers: The number of threads reading batches ahead of
+the network, or zero to read each batch when it is needed
+        :param queue_size: The maximum number of batches read ahead
+        :param sampler: A tile sampler that orders the data samples, or None
+to predict them in index order
+        """
         self.setBatchSize(batch_size)
 
         with torch.no_grad():
-            batch_list = [list(range(len(input_volume)))[i:i+self.getBatchSize()]
+            order = (list(sampler) if sampler is not None
+                     else list(range(len(input_volume))))
+            batch_list = [order[i:i+self.getBatchSize()]
                           for i in range(0,
-                                         len(input_volume),
+                                         len(order),
                                          self.getBatchSize())]
 
-            for batch_index in batch_list:
-                batch = [input_volume[i] for i in batch_index]
-
-                self.run_batch(batch, output_volume)
+            # Read the batches into a ring of arrays, where an array is
+            # reused once the batch after it has been retrieved
+            shape = input_volume._indexToBoundingBox(0).getNumpyDim()
+            ring_size = queue_size + 1 if num_workers > 0 else 1
+            ring = [np.empty((self.getBatchSize(), 1, *shape),
+                             dtype=np.float32)
+                    for i in range(ring_size)]
+
+            def read(number):
+                arrays = ring[number % ring_size]
+                bounding_boxes = [input_volume._indexToBoundingBox(i)
+                                  for i in batch_list[number]]
+                for array, bounding_box in zip(arrays, bounding_boxes):
+                    input_volume.getInto(bounding_box, array[0])
+
+                return arrays[:len(bounding_boxes)], bounding_boxes
+
+            if num_workers > 0:
+                batches = PrefetchIterator(read, range(len(batch_list)),
+                                           num_workers=num_workers,
+                                           queue_size=queue_size)
+            else:
+                batches = map(read, range(len(batch_list)))
+
+            try:
+                for arrays, bounding_boxes in batches:
+                    inputs = torch.from_numpy(arrays).to(self.device)
+                    self.run_tensor(inputs, bounding_boxes, output_volume)
+            finally:
+                if num_workers > 0:
+                    batches.close()
 
     def getBatchSize(self):
         return self.batch_size
@@ -47,6 +89,9 @@ class Predictor:
 
     def run_batch(self, batch, output_volume):
         bounding_boxes, arrays = self.toTorch(batch)
+        self.run_tensor(arrays, bounding_boxes, output_volume)
+
+    def run_tensor(self, arrays, bounding_boxes, output_volume):
         inputs = Variable(arrays).float()
 
         outputs = self.getNet()(inputs)
@@ -56,15 +101,21 @@ class Predictor:
             output_volume.blend(data)
 
     def toArray(self, data):
-        torch_data = data.getArray().astype(np.float)
+        torch_data = data.getArray().astype(np.float32)
         torch_data = torch_data.reshape(1, 1, *torch_data.shape)
         return torch_data
 
     def toTorch(self, batch):
         bounding_boxes = [data.getBoundingBox() for data in batch]
-        arrays = [self.toArray(data) for data in batch]
-        arrays = torch.from_numpy(np.concatenate(arrays, axis=0))
-        arrays = arrays.to(self.device)
+
+        # Copy each sample directly into the batch array
+        arrays = np.empty((len(batch), 1, *batch[0].getArray().shape),
+                          dtype=np.float32)
+        for array, data in zip(arrays, batch):
+            array[0] = data.getArray()
+        copy_counter.add(arrays)
+
+        arrays = torch.from_numpy(arrays).to(self.device)
 
         return bounding_boxes, arrays
 
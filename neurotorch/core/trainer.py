@@ -14,15 +14,22 @@ class Trainer(object):
     """
     def __init__(self, net, aligned_volume, checkpoint=None,
                  optimizer=None, criterion=None, max_epochs=10,
-                 gpu_device=None, validation_split=0.2):
+                 gpu_device=None, validation_split=0.2, num_workers=0,
+                 sampler=None):
         """
         Sets up the parameters for training
 
         :param net: A PyTorch neural network
         :param inputs_volume: A PyTorch dataset containing inputs
         :param labels_volume: A PyTorch dataset containing corresponding labels
+        :param num_workers: The number of threads reading training batches
+ahead of the network, or zero to read each batch when it is needed
+        :param sampler: A tile sampler that orders the training samples of
+each epoch, or None to shuffle the batches of training samples
         """
         self.max_epochs = max_epochs
+        self.num_workers = num_workers
+        self.sampler = sampler
 
         self.device = torch.device("cuda:{}".format(gpu_device)
                                    if gpu_device is not None
@@ -54,10 +61,13 @@ class Trainer(object):
         Runs an epoch with a given batch of samples
 
         :param sample_batch: A dictionary containing inputs and labels with the keys 
-"input" and "label", respectively
+"input" and "label", respectively. Any further entries, such as the label
+weights of a NonSimplePointCache, are passed on to the criterion.
         """
         inputs = Variable(sample_batch[0]).float()
         labels = Variable(sample_batch[1]).float()
+        extras = [Variable(batch).float().to(self.device)
+                  for batch in sample_batch[2:]]
 
         inputs, labels = inputs.to(self.device), labels.to(self.device)
 
@@ -65,7 +75,7 @@ class Trainer(object):
 
         outputs = self.net(inputs)
 
-        loss = self.criterion(torch.cat(outputs), labels)
+        loss = self.criterion(torch.cat(outputs), labels, *extras)
         loss_hist = loss.cpu().item()
         loss.backward()
         self.optimizer.step()
@@ -76,12 +86,14 @@ class Trainer(object):
         with torch.no_grad():
             inputs = Variable(batch[0]).float()
             labels = Variable(batch[1]).float()
+            extras = [Variable(extra).float().to(self.device)
+                      for extra in batch[2:]]
 
             inputs, labels = inputs.to(self.device), labels.to(self.device)
 
             outputs = self.net(inputs)
 
-            loss = self.criterion(torch.cat(outputs), labels)
+            loss = self.criterion(torch.cat(outputs), labels, *extras)
             accuracy = torch.sum((torch.cat(outputs) > 0) & labels.byte()).float()
             accuracy /= torch.sum((torch.cat(outputs) > 0) | labels.byte()).float()
 
@@ -103,12 +115,21 @@ class Trainer(object):
         train_idx = train_idx[:(len(train_idx) - len(train_idx) % 16)]
         train_idx = train_idx.reshape((-1, 16))
 
+        sampler = self.getTrainer().sampler
+        if sampler is not None:
+            sampler.setIndexes(train_idx)
+
+        val_buffers = self.getTrainer().volume.createBuffers(1)
+
         while num_epoch <= self.getTrainer().max_epochs:
-            np.random.shuffle(train_idx)
-            for i in range(train_idx.shape[0]):
-                sample_batch = list(zip(*[self.getTrainer().volume[idx] for idx in train_idx[i]]))
-                sample_batch = [np.stack(batch) for batch in sample_batch]
-                sample_batch[1] = sample_batch[1] > 0
+            if sampler is not None:
+                train_idx = sampler.getBatches(16)
+            else:
+                np.random.shuffle(train_idx)
+            batches = self.getTrainer().volume.iterateBatches(train_idx,
+                                                              num_workers=self.getTrainer().num_workers)
+            for sample_batch in batches:
+                np.greater(sample_batch[1], 0, out=sample_batch[1])
                 if num_epoch > self.getTrainer().max_epochs:
                     break
                 if (sample_batch[1] == 0).all():
@@ -118,10 +139,9 @@ class Trainer(object):
                 self.run_epoch([torch.from_numpy(batch) for batch in sample_batch])
 
                 if num_iter % 10 == 0:
-                    val_batch = list(zip(*[self.getTrainer().volume[idx]
-                                           for idx in val_idx[:1]]))
-                    val_batch = [np.stack(batch) for batch in val_batch]
-                    val_batch[1] = val_batch[1] > 0 
+                    val_batch = self.getTrainer().volume.getBatchInto(val_idx[:1],
+                                                                      val_buffers)
+                    np.greater(val_batch[1], 0, out=val_batch[1])
                     loss, accuracy, _ = self.evaluate([torch.from_numpy(batch) for batch in val_batch])
                     print("Iteration: {}".format(num_iter),
                           "Epoch {}/{} ".format(num_epoch,
@@ -172,25 +192,33 @@ class TrainerDecorator(Trainer):
         train_idx = train_idx[:(len(train_idx) - len(train_idx) % 8)]
         train_idx = train_idx.reshape((-1, 8))
 
+        sampler = self.getTrainer().sampler
+        if sampler is not None:
+            sampler.setIndexes(train_idx)
+
+        val_buffers = self.getTrainer().volume.createBuffers(16)
+
         while num_epoch <= self.getTrainer().max_epochs:
-            np.random.shuffle(train_idx)
-            for i in range(train_idx.shape[0]):
-                sample_batch = list(zip(*[self.getTrainer().volume[idx] for idx in train_idx[i]]))
-                sample_batch = [np.stack(batch) for batch in sample_batch]
-                sample_batch[1] = sample_batch[1] > 0
+            if sampler is not None:
+                train_idx = sampler.getBatches(8)
+            else:
+                np.random.shuffle(train_idx)
+            batches = self.getTrainer().volume.iterateBatches(train_idx,
+                                                              num_workers=self.getTrainer().num_workers)
+            for sample_batch in batches:
+                np.greater(sample_batch[1], 0, out=sample_batch[1])
                 if num_epoch > self.getTrainer().max_epochs:
                     break
 
                 print("Iteration: {}".format(num_iter))
-                self.run_epoch([torch.from_numpy(batch.astype(np.float)) for batch in sample_batch])
+                self.run_epoch([torch.from_numpy(batch) for batch in sample_batch])
 
                 if num_iter % 10 == 0:
                     self.getTrainer().volume.getVolume().setAugmentation(False)
-                    val_batch = list(zip(*[self.getTrainer().volume[idx]
-                                           for idx in val_idx[:16]]))
-                    val_batch = [np.stack(batch) for batch in val_batch]
-                    val_batch[1] = val_batch[1] > 0
-                    loss, accuracy, _ = self.evaluate([torch.from_numpy(batch.astype(np.float)) for batch in val_batch])
+                    val_batch = self.getTrainer().volume.getBatchInto(val_idx[:16],
+                                                                      val_buffers)
+                    np.greater(val_batch[1], 0, out=val_batch[1])
+                    loss, accuracy, _ = self.evaluate([torch.from_numpy(batch) for batch in val_batch])
                     print("Iteration: {}".format(num_iter),
                           "Epoch {}/{} ".format(num_epoch,
                                                 self.getTrainer().max_epochs),
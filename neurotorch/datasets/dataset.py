@@ -1,11 +1,142 @@
 from torch.utils.data import Dataset as _Dataset
 import numpy as np
 from abc import abstractmethod
-from neurotorch.datasets.datatypes import BoundingBox, Vector
+from neurotorch.datasets.datatypes import (BoundingBox, BoundingBoxArray,
+                                           PatchGrid, Vector)
+from neurotorch.datasets.spatial import GridIndex, OccupancyIndex
 from numbers import Number
 from numpy import ndarray
-from scipy.spatial import KDTree
-from functools import reduce
+from functools import reduce, lru_cache
+from bisect import bisect_left
+from threading import Lock, RLock
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from collections import OrderedDict, deque
+import os.path
+import time
+
+
+class CopyCounter:
+    """
+    A thread-safe counter of the bytes copied while reading from volumes
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.reset()
+
+    def add(self, array: ndarray) -> ndarray:
+        """
+        Records a newly copied array
+
+        :param array: The copied array
+        :return: The copied array
+        """
+        with self.lock:
+            self.copies += 1
+            self.bytes += array.nbytes
+
+        return array
+
+    def getCopies(self) -> int:
+        """
+        Retrieves the number of copies recorded since the last reset
+
+        :return: The number of copies
+        """
+        return self.copies
+
+    def getBytes(self) -> int:
+        """
+        Retrieves the number of bytes copied since the last reset
+
+        :return: The number of bytes copied
+        """
+        return self.bytes
+
+    def reset(self):
+        with self.lock:
+            self.copies = 0
+            self.bytes = 0
+
+
+copy_counter = CopyCounter()
+
+PAD_MODES = ("constant", "reflect", "edge")
+
+# The largest occupancy index that is built, in blocks. Volumes whose patches
+# only align to smaller blocks are checked patch by patch instead.
+OCCUPANCY_MAX_BLOCKS = 2**24
+
+
+def _padInPlace(array: ndarray, edge1: tuple, edge2: tuple,
+                mode: str="constant"):
+    """
+    Pads an array in place around the filled region between two corners
+
+    :param array: The array to pad
+    :param edge1: The first corner of the filled region in Numpy order
+    :param edge2: The second corner of the filled region in Numpy order
+    :param mode: The padding mode, either "constant" to pad with zeros,
+"reflect" to mirror the region without repeating its edge, or "edge" to repeat
+its edge
+    """
+    if mode not in PAD_MODES:
+        raise ValueError("mode must be one of {} ".format(PAD_MODES) +
+                         "instead it is {}".format(mode))
+
+    for axis, (start, stop) in enumerate(zip(edge1, edge2)):
+        length = array.shape[axis]
+        if start == 0 and stop == length:
+            continue
+
+        # Pad each axis in turn over the full extent of the padded axes
+        region = [slice(None)] * array.ndim
+        region[axis] = slice(start, stop)
+        pad_indexes = np.r_[0:start, stop:length]
+
+        if mode == "constant":
+            region[axis] = pad_indexes
+            array[tuple(region)] = 0
+            continue
+
+        if mode == "edge" or stop - start == 1:
+            source_indexes = np.clip(pad_indexes, start, stop - 1)
+        else:
+            period = 2 * (stop - start - 1)
+            source_indexes = (pad_indexes - start) % period
+            source_indexes = np.where(source_indexes < stop - start,
+                                      source_indexes,
+                                      period - source_indexes) + start
+
+        region[axis] = pad_indexes
+        array[tuple(region)] = np.take(array, source_indexes, axis=axis)
+
+
+def _unionVolume(edges: ndarray) -> int:
+    """
+    Computes the volume of the union of boxes, which may overlap, on the
+grid of their distinct edge coordinates
+
+    :param edges: An array of box edges with shape (N, 2, 3)
+    :return: The number of voxels covered by at least one box
+    """
+    if len(edges) == 0:
+        return 0
+
+    # Split each axis at every edge coordinate and mark the covered cells
+    coordinates = [np.unique(edges[:, :, axis]) for axis in range(3)]
+    covered = np.zeros([len(axis_coordinates) - 1
+                        for axis_coordinates in coordinates], dtype=bool)
+    for box in edges:
+        region = tuple(slice(np.searchsorted(axis_coordinates, box[0, axis]),
+                             np.searchsorted(axis_coordinates, box[1, axis]))
+                       for axis, axis_coordinates in enumerate(coordinates))
+        covered[region] = True
+
+    lengths = [np.diff(axis_coordinates) for axis_coordinates in coordinates]
+    cell_volumes = (lengths[0][:, None, None] * lengths[1][None, :, None] *
+                    lengths[2][None, None, :])
+
+    return int(cell_volumes[covered].sum())
 
 
 class Data:
@@ -51,6 +182,19 @@ location in 3D-space
         """
         return self.array
 
+    def getWritableArray(self) -> ndarray:
+        """
+        Retrieves the data packet's contents for modification. If the
+contents are a read-only view of a volume, they are first copied so that the
+volume is left unchanged.
+
+        :return: A writable Numpy ndarray in row-major order (Z, Y, X)
+        """
+        if not self.array.flags.writeable:
+            self.array = copy_counter.add(self.array.copy())
+
+        return self.array
+
     def _setArray(self, array):
         """
         Sets the data packet's contents
@@ -130,12 +274,15 @@ dataset iterable. The displacement proceeds first from X then to Y then to Z.
                           stride=stride)
         super().__init__()
 
-    def get(self, bounding_box: BoundingBox) -> Data:
+    def get(self, bounding_box: BoundingBox, copy: bool=False) -> Data:
         """
         Requests a data sample from the volume. If the bounding box does
-not exist, then the method raises a ValueError.
+not exist, then the method raises a ValueError. Data samples inside the volume
+are returned as read-only views of the volume without copying, while data
+samples crossing the volume's border are zero-padded copies.
 
         :param bounding_box: The bounding box of the request data sample
+        :param copy: Whether to always return a writable copy
         :return: The data sample requested
         """
         if bounding_box.isDisjoint(self.getBoundingBox()):
@@ -149,16 +296,60 @@ not exist, then the method raises a ValueError.
         sub_bounding_box = bounding_box.intersect(self.getBoundingBox())
         array = self.getArray(sub_bounding_box)
 
-        before_pad = bounding_box.getEdges()[0] - sub_bounding_box.getEdges()[0]
-        after_pad = bounding_box.getEdges()[1] - sub_bounding_box.getEdges()[1]
-
-        if before_pad != Vector(0, 0, 0) or after_pad != Vector(0, 0, 0):
-            pad_size = tuple(zip(before_pad.getNumpyDim(),
-                                 after_pad.getNumpyDim()))
-            array = np.pad(array, pad_width=pad_size, mode="constant")
+        if sub_bounding_box != bounding_box:
+            padded = np.zeros(bounding_box.getNumpyDim(), dtype=array.dtype)
+            x1, y1, z1 = (sub_bounding_box.getEdges()[0] -
+                          bounding_box.getEdges()[0]).getComponents()
+            z2, y2, x2 = (z1 + array.shape[0], y1 + array.shape[1],
+                          x1 + array.shape[2])
+            padded[z1:z2, y1:y2, x1:x2] = array
+            array = copy_counter.add(padded)
+        elif copy:
+            array = copy_counter.add(array.copy())
+        else:
+            array = array.view()
+            array.flags.writeable = False
 
         return Data(array, bounding_box)
 
+    def getInto(self, bounding_box: BoundingBox, out: ndarray,
+                mode: str="constant") -> Data:
+        """
+        Reads a data sample from the volume into a preallocated array. If the
+bounding box does not exist, then the method raises a ValueError.
+
+        :param bounding_box: The bounding box of the request data sample
+        :param out: An array with the shape of the bounding box in Numpy
+order, such as a slot of a batch array. The data is cast to the array's dtype.
+        :param mode: The padding mode for the parts of the bounding box
+outside of the volume, either "constant", "reflect" or "edge"
+        :return: The data sample requested, which is backed by the given array
+        """
+        if out.shape != bounding_box.getNumpyDim():
+            raise ValueError("out must have shape {} ".format(bounding_box.getNumpyDim()) +
+                             "instead it has shape {}".format(out.shape))
+
+        if bounding_box.isDisjoint(self.getBoundingBox()):
+            error_string = ("Bounding box must be inside dataset " +
+                            "dimensions instead bounding box is {} while " +
+                            "the dataset dimensions are {}")
+            error_string = error_string.format(bounding_box,
+                                               self.getBoundingBox())
+            raise ValueError(error_string)
+
+        sub_bounding_box = bounding_box.intersect(self.getBoundingBox())
+        x1, y1, z1 = (sub_bounding_box.getEdges()[0] -
+                      bounding_box.getEdges()[0]).getComponents()
+        x2, y2, z2 = (sub_bounding_box.getEdges()[1] -
+                      bounding_box.getEdges()[0]).getComponents()
+
+        out[z1:z2, y1:y2, x1:x2] = self.getArray(sub_bounding_box)
+
+        if sub_bounding_box != bounding_box:
+            _padInPlace(out, (z1, y1, x1), (z2, y2, x2), mode=mode)
+
+        return Data(out, bounding_box)
+
     def set(self, data: Data):
         """
         Sets a section of the volume within the provided bounding box with the
@@ -224,6 +415,28 @@ If the bounding box is outside of the volume, a ValueError is raised.
     def _setArray(self, array):
         self.array = array
 
+    def getDtype(self):
+        return self.array.dtype
+
+    def flush(self):
+        """
+        Writes changes to the array back to its storage. In-memory arrays
+have no storage to write to.
+        """
+        pass
+
+    def getResidentBytes(self) -> int:
+        """
+        Estimates the memory held by the array. Memory-mapped arrays are
+backed by the page cache and hold none.
+
+        :return: The number of bytes held by the array
+        """
+        if isinstance(self.array, np.memmap):
+            return 0
+
+        return self.array.nbytes
+
     def getBoundingBox(self) -> BoundingBox:
         """
         Retrieves the bounding box of the volume
@@ -274,16 +487,19 @@ origin
         self.setIterationSize(iteration_size)
         self.setStride(stride)
 
-        def ceil(x):
-            return int(round(x))
-
-        self.element_vec = Vector(*map(lambda L, l, s: ceil((L-l)/s+1),
-                                       self.getBoundingBox().getSize().getComponents(),
-                                       self.iteration_size.getSize().getComponents(),
-                                       self.stride.getComponents()))
+        self.grid = PatchGrid.fromVolume(self.getBoundingBox(),
+                                         self.iteration_size, self.stride)
 
         self.index = 0
 
+    def getGrid(self) -> PatchGrid:
+        """
+        Retrieves the patch grid that the volume iterates through
+
+        :return: The patch grid of the volume
+        """
+        return self.grid
+
     def setIterationSize(self, iteration_size):
         self.iteration_size = BoundingBox(Vector(0, 0, 0),
                                           iteration_size.getSize())
@@ -298,7 +514,7 @@ origin
         return self.stride
 
     def __len__(self):
-        return self.element_vec[0]*self.element_vec[1]*self.element_vec[2]
+        return len(self.grid)
 
     def __getitem__(self, idx):
         bounding_box = self._indexToBoundingBox(idx)
@@ -311,22 +527,253 @@ origin
             self.index = 0
             raise StopIteration
 
-        element_vec = np.unravel_index(idx,
-                                       dims=self.element_vec.getComponents())
+        return self.grid[idx]
 
-        element_vec = Vector(*element_vec)
-        bounding_box = self.iteration_size+self.stride*element_vec
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
 
-        return bounding_box
+
+WINDOWS = ("gaussian", "cosine")
+
+
+@lru_cache(maxsize=16)
+def _blendingWindow(shape: tuple, window: str="gaussian") -> ndarray:
+    """
+    Creates a read-only blending window that falls off toward the borders of
+a data sample
+
+    :param shape: The shape of the data sample in Numpy order
+    :param window: Either "gaussian" for a Gaussian with a standard deviation
+of an eighth of the sample size or "cosine" for a Hann window
+    :return: A float32 array of the given shape with a maximum of one
+    """
+    if window not in WINDOWS:
+        raise ValueError("window must be one of {} ".format(WINDOWS) +
+                         "instead it is {}".format(window))
+
+    profiles = []
+    for length in shape:
+        position = np.arange(length) + 0.5
+        if window == "gaussian":
+            sigma = length / 8
+            profile = np.exp(-0.5 * ((position - length / 2) / sigma) ** 2)
+        else:
+            profile = np.sin(np.pi * position / length) ** 2
+        profiles.append(profile / profile.max())
+
+    result = reduce(np.multiply.outer, profiles).astype(np.float32)
+    result.flags.writeable = False
+
+    return result
+
+
+class AccumulatorArray(Array):
+    """
+    An output volume that blends overlapping data samples by their weighted
+average. Each data sample is weighted by a window that falls off toward its
+borders, which removes the seams left by blending with the maximum. Once
+every data sample is blended, such as after Predictor.run, finalize must be
+called to normalize the volume.
+    """
+    def __init__(self, bounding_box: BoundingBox, window: str="gaussian",
+                 iteration_size: BoundingBox=BoundingBox(Vector(0, 0, 0),
+                                                         Vector(128, 128, 32)),
+                 stride: Vector=Vector(64, 64, 16)):
+        """
+        Initializes an empty accumulator
+
+        :param bounding_box: The bounding box encompassing the volume
+        :param window: The blending window, either "gaussian" or "cosine"
+        :param iteration_size: The bounding box of each data sample in the
+dataset iterable
+        :param stride: The stride displacement of each data sample in the
+dataset iterable
+        """
+        if window not in WINDOWS:
+            raise ValueError("window must be one of {} ".format(WINDOWS) +
+                             "instead it is {}".format(window))
+        self.window = window
+
+        shape = bounding_box.getNumpyDim()
+        self.weights = np.zeros(shape, dtype=np.float32)
+        self.scratch = {}
+        super().__init__(np.zeros(shape, dtype=np.float32),
+                         bounding_box=bounding_box,
+                         iteration_size=iteration_size, stride=stride)
+
+    def getWindow(self, shape: tuple) -> ndarray:
+        """
+        Retrieves the blending window for data samples of a shape
+
+        :param shape: The shape of the data samples in Numpy order
+        :return: The read-only blending window
+        """
+        return _blendingWindow(tuple(shape), self.window)
+
+    def blend(self, data: Data):
+        """
+        Adds a data sample weighted by the blending window to the volume
+
+        :param data: The data packet to blend into the volume
+        """
+        if self.isFinalized():
+            raise ValueError("data cannot be blended into a finalized " +
+                             "accumulator")
+
+        data_bounding_box = data.getBoundingBox()
+        if data_bounding_box.isDisjoint(self.getBoundingBox()):
+            raise ValueError("The bounding box must intersect the volume")
+
+        sub_bounding_box = data_bounding_box.intersect(self.getBoundingBox())
+        x1, y1, z1 = (sub_bounding_box.getEdges()[0] -
+                      data_bounding_box.getEdges()[0]).getComponents()
+        x2, y2, z2 = (sub_bounding_box.getEdges()[1] -
+                      data_bounding_box.getEdges()[0]).getComponents()
+        data_region = (slice(z1, z2), slice(y1, y2), slice(x1, x2))
+
+        window = self.getWindow(data.getArray().shape)[data_region]
+
+        if window.shape not in self.scratch:
+            self.scratch[window.shape] = np.empty(window.shape,
+                                                  dtype=np.float32)
+        weighted = self.scratch[window.shape]
+        np.multiply(data.getArray()[data_region], window, out=weighted)
+
+        self.getArray(sub_bounding_box)[...] += weighted
+        self.getWeights(sub_bounding_box)[...] += window
+
+    def getWeights(self, bounding_box: BoundingBox=None) -> ndarray:
+        """
+        Retrieves the accumulated weights of the volume
+
+        :param bounding_box: The bounding box of a subsection of the volume
+        :return: The accumulated weights
+        """
+        if bounding_box is None:
+            return self.weights
+
+        centered_bounding_box = bounding_box - self.getBoundingBox().getEdges()[0]
+        edge1, edge2 = centered_bounding_box.getEdges()
+        x1, y1, z1 = edge1.getComponents()
+        x2, y2, z2 = edge2.getComponents()
+
+        return self.weights[z1:z2, y1:y2, x1:x2]
+
+    def isFinalized(self) -> bool:
+        return self.weights is None
+
+    def finalize(self, block_size: int=None):
+        """
+        Normalizes the accumulated sum by the accumulated weights in place.
+Voxels without any blended data are left at zero.
+
+        :param block_size: The number of Z-slices to normalize at a time to
+bound the size of temporary arrays. By default, the whole volume is
+normalized at once.
+        """
+        if self.isFinalized():
+            return
+
+        array = self.getArray()
+        if block_size is None:
+            block_size = array.shape[0]
+
+        for z in range(0, array.shape[0], block_size):
+            block = array[z:z+block_size]
+            weights = self.weights[z:z+block_size]
+            np.divide(block, weights, out=block, where=weights > 0)
+
+        self.weights = None
+        self.scratch = {}
+
+
+class PrefetchIterator:
+    """
+    An iterator that reads items ahead of time on background threads. Items
+are returned in order, at most queue_size reads are outstanding at once, and
+the threads are shut down when the iterator is exhausted, closed or a read
+fails.
+    """
+    def __init__(self, read, keys, num_workers: int=2, queue_size: int=8):
+        """
+        Starts reading the first items
+
+        :param read: A function that reads the item of a key, such as the
+__getitem__ method of a volume
+        :param keys: An iterable of the keys to read, such as data sample
+indexes
+        :param num_workers: The number of reader threads
+        :param queue_size: The maximum number of items read ahead
+        """
+        if num_workers < 1:
+            raise ValueError("num_workers must be positive")
+        if queue_size < 1:
+            raise ValueError("queue_size must be positive")
+
+        self.read = read
+        self.keys = iter(keys)
+        self.queue_size = queue_size
+        self.futures = deque()
+        self.executor = ThreadPoolExecutor(max_workers=num_workers)
+
+        for i in range(queue_size):
+            if not self._submit():
+                break
+
+    def _submit(self) -> bool:
+        try:
+            key = next(self.keys)
+        except StopIteration:
+            return False
+
+        self.futures.append(self.executor.submit(self.read, key))
+        return True
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self.futures:
+            self.close()
+            raise StopIteration
+
+        future = self.futures.popleft()
+        try:
+            result = future.result()
+        except BaseException:
+            self.close()
+            raise
+
+        self._submit()
+
+        return result
+
+    def close(self):
+        """
+        Cancels the outstanding reads and stops the reader threads
+        """
+        for future in self.futures:
+            future.cancel()
+        self.futures.clear()
+        self.executor.shutdown(wait=True)
 
     def __enter__(self):
-        pass
+        return self
 
-    def __exit__(self):
-        pass
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
 
 class TorchVolume(_Dataset):
+    """
+    A PyTorch dataset of a volume. The worker processes of a data loader
+each receive their own copy of the volume, so every tile that a worker opens
+is decoded into that worker's memory. Give pooled volumes a shared memory
+pool so that the workers map a single decoded copy of each tile.
+    """
     def __init__(self, volume):
         self.setVolume(volume)
         super().__init__()
@@ -341,8 +788,74 @@ class TorchVolume(_Dataset):
         else:
             return self.getVolume()[idx].getArray()
 
+    def createBuffers(self, batch_size: int) -> list:
+        """
+        Allocates the arrays that batches of data samples are read into
+
+        :param batch_size: The number of data samples in each batch
+        :return: A list of float32 arrays with shape (batch_size, 1, Z, Y, X),
+one for each volume
+        """
+        shape = self.getVolume()._indexToBoundingBox(0).getNumpyDim()
+        if isinstance(self.getVolume(), AlignedVolume):
+            count = len(self.getVolume().getVolumes())
+        else:
+            count = 1
+
+        return [np.empty((batch_size, 1, *shape), dtype=np.float32)
+                for i in range(count)]
+
+    def getBatchInto(self, indexes, buffers: list) -> list:
+        """
+        Reads a batch of data samples into arrays from createBuffers
+
+        :param indexes: The indexes of the data samples in the batch
+        :param buffers: The arrays to read the data samples into
+        :return: The filled part of each array
+        """
+        for slot, idx in enumerate(indexes):
+            bounding_box = self.getVolume()._indexToBoundingBox(idx)
+            if isinstance(self.getVolume(), AlignedVolume):
+                self.getVolume().getInto(bounding_box,
+                                         [buffer[slot, 0] for buffer in buffers])
+            else:
+                self.getVolume().getInto(bounding_box, buffers[0][slot, 0])
+
+        return [buffer[:len(indexes)] for buffer in buffers]
+
+    def iterateBatches(self, batches, num_workers: int=0,
+                       queue_size: int=2):
+        """
+        Reads batches of data samples, optionally on background threads while
+the previous batches are used. Each batch is read into one of a ring of arrays
+that is reused once the batch after it has been retrieved.
+
+        :param batches: A list of the data sample indexes of each batch
+        :param num_workers: The number of reader threads, or zero to read
+each batch when it is requested
+        :param queue_size: The maximum number of batches read ahead
+        :return: A generator of the filled arrays of each batch
+        """
+        if len(batches) == 0:
+            return
+
+        batch_size = max(len(indexes) for indexes in batches)
+        ring = [self.createBuffers(batch_size)
+                for i in range(queue_size + 1 if num_workers > 0 else 1)]
+
+        def read(number):
+            return self.getBatchInto(batches[number], ring[number % len(ring)])
+
+        if num_workers > 0:
+            with PrefetchIterator(read, range(len(batches)),
+                                  num_workers=num_workers,
+                                  queue_size=queue_size) as iterator:
+                yield from iterator
+        else:
+            yield from map(read, range(len(batches)))
+
     def toTorch(self, data):
-        torch_data = data.getArray().astype(np.float)
+        torch_data = copy_counter.add(data.getArray().astype(np.float32))
         torch_data = torch_data.reshape(1, *torch_data.shape)
         return torch_data
 
@@ -364,6 +877,8 @@ class Volume:
         self.setBoundingBox(bounding_box)
         self.setIteration(iteration_size, stride)
         self.valid_data = None
+        self.occupancy_file = None
+        self.occupancy_index = None
 
     def setArray(self, array: Array):
         self.array = array
@@ -374,6 +889,44 @@ class Volume:
     def request(self, bounding_box):
         return self.getArray().get(bounding_box)
 
+    def getDtype(self):
+        return self.getArray().getDtype()
+
+    def flush(self):
+        """
+        Writes changes to the volume back to its file, which pools call
+before closing a volume that was written to
+        """
+        array = getattr(self, "array", None)
+        if array is not None:
+            array.flush()
+
+    def getResidentBytes(self) -> int:
+        """
+        Estimates the memory held by the volume while it is open
+
+        :return: The number of bytes held by the volume
+        """
+        array = getattr(self, "array", None)
+        if array is None:
+            return 0
+
+        return array.getResidentBytes()
+
+    def getInto(self, bounding_box: BoundingBox, out: ndarray,
+                mode: str="constant") -> Data:
+        """
+        Reads a data sample from the volume into a preallocated array. If the
+bounding box does not exist, then the method raises a ValueError.
+
+        :param bounding_box: The bounding box of the request data sample
+        :param out: An array with the shape of the bounding box in Numpy order
+        :param mode: The padding mode for the parts of the bounding box
+outside of the volume, either "constant", "reflect" or "edge"
+        :return: The data sample requested, which is backed by the given array
+        """
+        return self.getArray().getInto(bounding_box, out, mode=mode)
+
     def set(self, data: Data):
         self.getArray().set(data)
 
@@ -399,16 +952,19 @@ class Volume:
         self.setIterationSize(iteration_size)
         self.setStride(stride)
 
-        def ceil(x):
-            return int(round(x))
-
-        self.element_vec = Vector(*map(lambda L, l, s: ceil((L-l)/s+1),
-                                       self.getBoundingBox().getSize().getComponents(),
-                                       self.iteration_size.getSize().getComponents(),
-                                       self.stride.getComponents()))
+        self.grid = PatchGrid.fromVolume(self.getBoundingBox(),
+                                         self.iteration_size, self.stride)
 
         self.index = 0
 
+    def getGrid(self) -> PatchGrid:
+        """
+        Retrieves the patch grid that the volume iterates through
+
+        :return: The patch grid of the volume
+        """
+        return self.grid
+
     def setBoundingBox(self, bounding_box):
         if not isinstance(bounding_box, BoundingBox):
             raise ValueError("bounding_box must have type BoundingBox " +
@@ -483,7 +1039,7 @@ given data.
 
         :return: The dataset length
         """
-        return self.element_vec[0]*self.element_vec[1]*self.element_vec[2]
+        return len(self.grid)
 
     def __getitem__(self, idx: int):
         """
@@ -502,6 +1058,19 @@ given data.
         self.index = 0
         return self
 
+    def prefetch(self, num_workers: int=2, queue_size: int=8):
+        """
+        Returns an iterable of the dataset that reads data samples ahead of
+time on background threads
+
+        :param num_workers: The number of reader threads
+        :param queue_size: The maximum number of data samples read ahead
+        :return: The prefetching iterable of the dataset
+        """
+        return PrefetchIterator(self.__getitem__, range(len(self)),
+                                num_workers=num_workers,
+                                queue_size=queue_size)
+
     def __next__(self):
         """
         Retrieves the next data sample from the dataset
@@ -514,12 +1083,87 @@ given data.
         else:
             raise StopIteration
 
+    def setOccupancyFile(self, occupancy_file):
+        """
+        Sets the file that the occupancy index of the volume is saved to, so
+that later runs can load it instead of reading the volume again. The file
+must be deleted if the volume's contents change.
+
+        :param occupancy_file: The filename of a Numpy .npz file
+        """
+        self.occupancy_file = occupancy_file
+        self.occupancy_index = None
+        self.valid_data = None
+
+    def _occupancyFile(self):
+        return self.occupancy_file
+
+    def _occupancyVolume(self):
+        return self
+
+    def _occupancyBlockSize(self) -> Vector:
+        """
+        Returns the blocks of the largest size that every patch is aligned to
+        """
+        bounding_box = self._occupancyVolume().getBoundingBox()
+        grid = self.getGrid()
+        offsets = grid.getOrigins() - bounding_box.toArray()[0]
+        block_size = np.gcd.reduce(np.concatenate((offsets, grid.getSizes())))
+
+        return Vector(*np.maximum(block_size, 1).tolist())
+
+    def getOccupancyIndex(self) -> OccupancyIndex:
+        """
+        Retrieves the index of the nonzero voxels of the volume. The index
+is loaded from the occupancy file if it matches the volume, and otherwise it
+is built in a single pass over the volume and saved to the occupancy file.
+
+        :return: The occupancy index of the volume, or None if the patches
+align to blocks so small that the index would hold more than
+OCCUPANCY_MAX_BLOCKS blocks
+        """
+        if self.occupancy_index is None:
+            volume = self._occupancyVolume()
+            bounding_box = volume.getBoundingBox()
+            block_size = self._occupancyBlockSize()
+
+            blocks = np.prod([-(-size // block) for size, block
+                              in zip(bounding_box.getSize(), block_size)])
+            if blocks > OCCUPANCY_MAX_BLOCKS:
+                return None
+
+            occupancy_file = self._occupancyFile()
+            if occupancy_file is not None and os.path.isfile(occupancy_file):
+                index = OccupancyIndex.load(occupancy_file)
+                if index.getBoundingBox() == bounding_box and \
+                   index.getBlockSize() == block_size:
+                    self.occupancy_index = index
+
+            if self.occupancy_index is None:
+                self.occupancy_index = OccupancyIndex.build(volume,
+                                                            bounding_box,
+                                                            block_size)
+                if occupancy_file is not None:
+                    self.occupancy_index.save(occupancy_file)
+
+        return self.occupancy_index
+
     def getValidData(self):
-        if self.valid_data is not None:
-            self.valid_data = []
-            for i in range(len(self)):
-                if not (self[i].getArray() == 0).all():
-                    self.valid_data.append(i)
+        """
+        Retrieves the indexes of the data samples that contain nonzero voxels
+
+        :return: A list of the indexes of the valid data samples
+        """
+        if self.valid_data is None:
+            grid = self.getGrid()
+            index = self.getOccupancyIndex()
+            if index is None:
+                volume = self._occupancyVolume()
+                self.valid_data = [i for i in range(len(grid))
+                                   if (volume.get(grid[i]).getArray() != 0).any()]
+            else:
+                counts = index.counts(grid.getBoundingBoxes())
+                self.valid_data = np.flatnonzero(counts).tolist()
 
         return self.valid_data
 
@@ -533,6 +1177,8 @@ class AlignedVolume(Volume):
         self.setVolumes(volumes)
         self.setIteration(iteration_size, stride)
         self.valid_data = None
+        self.occupancy_file = None
+        self.occupancy_index = None
 
     def getBoundingBox(self):
         return self.getVolumes()[0].getBoundingBox()
@@ -550,11 +1196,31 @@ class AlignedVolume(Volume):
         for volume in self.getVolumes():
             volume.setIteration(iteration_size, stride)
 
+    def getGrid(self):
+        return self.getVolumes()[0].getGrid()
+
     def get(self, bounding_box):
         result = [volume.get(bounding_box)
                   for volume in self.getVolumes()]
         return result
 
+    def getInto(self, bounding_box, outs, mode="constant"):
+        """
+        Reads a data sample from each volume into a preallocated array
+
+        :param bounding_box: The bounding box of the request data samples
+        :param outs: A list of arrays, one for each volume
+        :param mode: The padding mode for the parts of the bounding box
+outside of the volumes
+        :return: The data samples requested
+        """
+        if len(outs) != len(self.getVolumes()):
+            raise ValueError("outs must contain an array for each volume")
+
+        result = [volume.getInto(bounding_box, out, mode=mode)
+                  for volume, out in zip(self.getVolumes(), outs)]
+        return result
+
     def set(self, array, bounding_box):
         pass
 
@@ -565,14 +1231,14 @@ class AlignedVolume(Volume):
         result = [volume[idx] for volume in self.getVolumes()]
         return result
 
-    def getValidData(self):
-        if self.valid_data is None:
-            self.valid_data = []
-            for i in range(len(self)):
-                if not (self.getVolumes()[1][i].getArray() == 0).all():
-                    self.valid_data.append(i)
+    def _occupancyFile(self):
+        if self.occupancy_file is None:
+            return getattr(self.getVolumes()[1], "occupancy_file", None)
 
-        return self.valid_data
+        return self.occupancy_file
+
+    def _occupancyVolume(self):
+        return self.getVolumes()[1]
 
     def _indexToBoundingBox(self, idx):
         bounding_box = self.getVolumes()[0]._indexToBoundingBox(idx)
@@ -584,118 +1250,787 @@ class PooledVolume(Volume):
     def __init__(self, volumes=None, stack_size: int=5,
                  iteration_size: BoundingBox=BoundingBox(Vector(0, 0, 0),
                                                          Vector(128, 128, 32)),
-                 stride: Vector=Vector(64, 64, 16)):
+                 stride: Vector=Vector(64, 64, 16), cache_bytes: int=None,
+                 num_workers: int=4, lookahead: int=0, shared_pool=None):
+        """
+        Pools volumes that tile a larger volume, keeping the most recently
+used volumes open
+
+        :param volumes: A list of the pooled volumes
+        :param stack_size: The maximum number of open volumes, or None for no
+limit
+        :param iteration_size: The bounding box of each data sample in the
+dataset iterable
+        :param stride: The stride displacement of each data sample in the
+dataset iterable
+        :param cache_bytes: The maximum memory held by the open volumes, or
+None for no limit
+        :param num_workers: The number of threads that read the parts of a
+data sample from different volumes
+        :param lookahead: The number of volumes to open ahead of the
+iteration plan on background threads, or zero to open volumes when they are
+first read
+        :param shared_pool: A shared memory pool that volumes read into
+memory are shared through, so that the worker processes of a data loader map
+each decoded volume once instead of each keeping a copy
+        """
+        self.volumes = []
+        self.spatial_index = GridIndex()
+        self.volumes_overlap = False
+        self.volumes_changed = True
+        self.dtypes = {}
+        self.num_workers = num_workers
+        self.executor = None
+        self.shared_pool = shared_pool
+
         if volumes is not None:
-            self.volumes = volumes
-            self.volumes_changed = True
-        else:
-            self.volumes = []
-            self.volumes_changed = False
+            for volume in volumes:
+                self.add(volume)
 
-        self.volume_list = []
-        self.setStack(stack_size)
+        self.lock = RLock()
+        self.setStack(stack_size, cache_bytes)
+        self.lookahead_executor = None
+        self.setLookahead(lookahead)
 
-        self.setIteration(iteration_size, stride)
+        # The pooled volumes keep the patch grids that they were given
+        self.setIterationSize(iteration_size)
+        self.setStride(stride)
 
         self.valid_data = None
+        self.occupancy_file = None
+        self.occupancy_index = None
+
+    def getBoundingBox(self) -> BoundingBox:
+        """
+        Retrieves the bounding box enclosing every pooled volume
 
-    def setStack(self, stack_size: int=15):
-        self.stack = []
-        self.stack_size = stack_size
+        :return: The bounding box of the pool
+        """
+        if len(self.volumes) == 0:
+            raise ValueError("the pool does not contain any volumes")
 
-    def _pushStack(self, index, volume):
-        if len(self.stack) >= self.stack_size:
-            self.stack[0][1].__exit__(None, None, None)
-            self.stack.pop(0)
+        edges = self.spatial_index.getBoundingBoxes().getArray()
 
-        pos = len(self.stack)
-        self.stack.insert(pos, (index, volume.__enter__()))
+        return BoundingBox.fromArray([edges[:, 0].min(axis=0),
+                                      edges[:, 1].max(axis=0)])
 
-        return pos
+    def setStack(self, stack_size: int=15, cache_bytes: int=None):
+        """
+        Sets the limits of the least recently used cache of open volumes.
+Room is made for a volume before it is opened, from the memory it held the
+last time it was opened or else from the other volumes, and the limits are
+enforced again once it is open. The volume that was just opened is always
+kept.
+
+        :param stack_size: The maximum number of open volumes, or None for no
+limit
+        :param cache_bytes: The maximum memory held by the open volumes, or
+None for no limit
+        """
+        with self.lock:
+            self.stack = OrderedDict()
+            self.stack_size = stack_size
+            self.cache_bytes = cache_bytes
+            self.pins = {}
+            self.loading = {}
+            self.closing = {}
+            self.dirty = set()
+            self.volume_bytes = {}
+            self.prefetched = {}
+
+            self.cache_hits = 0
+            self.cache_misses = 0
+            self.cache_evictions = 0
+            self.cache_flushes = 0
+            self.cache_prefetches = 0
+            self.stall_time = 0.0
+            self.hidden_time = 0.0
+
+    def _evictStack(self, reserve_bytes: int=None) -> list:
+        """
+        Removes the least recently used volumes that are not being read from
+until the cache is within its limits, keeping the volumes that the lookahead
+plan reads soon for as long as possible. The pool's lock must be held, and
+the removed volumes must be closed with _closeEvicted once it is released.
+
+        :param reserve_bytes: The estimated memory of a volume about to be
+opened, to make room for it, or None to only enforce the limits
+        :return: The indexes and volumes that were removed
+        """
+        window = self._lookaheadWindow()
+        candidates = ([index for index in self.stack if index not in window] +
+                      [index for index in self.stack if index in window])
+
+        evicted = []
+        for index in candidates:
+            if not self._isCacheFull(reserve_bytes):
+                break
+            if self.pins.get(index):
+                continue
+
+            # Loading the volume again waits until it is closed
+            evicted.append((index, self.stack.pop(index)))
+            self.closing[index] = Future()
+            self.cache_evictions += 1
+            self.prefetched.pop(index, None)
+
+        return evicted
+
+    def _closeEvicted(self, evicted: list):
+        """
+        Writes back and closes the volumes removed from the cache without
+holding the pool's lock, so that reads from other volumes are not blocked
+        """
+        errors = []
+        for index, volume in evicted:
+            try:
+                self._flushVolume(index, volume)
+                self._closeVolume(index, volume)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                with self.lock:
+                    closing = self.closing.pop(index)
+                closing.set_result(None)
+
+        if errors:
+            raise errors[0]
+
+    def _flushVolume(self, index: int, volume: Volume):
+        """
+        Writes a pooled volume back to its file if it was written to since
+it was opened. The volume is written without holding the pool's lock.
+        """
+        with self.lock:
+            if index not in self.dirty:
+                return
+            self.dirty.discard(index)
 
-    def _rebuildIndexes(self):
-        edge1_list = [volume.getBoundingBox().getEdges()[0].getComponents()
-                      for volume in self.volumes]
+        volume.flush()
+        with self.lock:
+            self.cache_flushes += 1
+
+    def _closeVolume(self, index: int, volume: Volume, evict: bool=True,
+                     exc_type=None, exc_value=None, traceback=None):
+        """
+        Closes a pooled volume and unmaps its shared memory, if any. The
+shared memory of an evicted volume is also removed so that it is freed once
+no other process maps it, while the shared memory of volumes closed with the
+pool is kept for other processes until the shared memory pool is closed.
+        """
+        volume.__exit__(exc_type, exc_value, traceback)
+        if self.shared_pool is not None:
+            self.shared_pool.release(index, unlink=evict)
+
+    def _isCacheFull(self, reserve_bytes: int=None) -> bool:
+        reserved = 0 if reserve_bytes is None else 1
+        if self.stack_size is not None and \
+           len(self.stack) + reserved > self.stack_size:
+            return True
+
+        return (self.cache_bytes is not None and
+                self.getCacheBytes() + (reserve_bytes or 0) > self.cache_bytes)
+
+    def getCacheBytes(self) -> int:
+        """
+        Estimates the memory held by the open volumes
+
+        :return: The number of bytes held by the open volumes
+        """
+        with self.lock:
+            return sum(volume.getResidentBytes()
+                       for volume in self.stack.values())
 
-        self.edge1_list = KDTree(edge1_list)
+    def getCacheStats(self) -> dict:
+        """
+        Retrieves the counters of the cache of open volumes, which can be
+used to size the cache from real traffic
+
+        :return: A dictionary of the number of cache hits, misses,
+evictions, flushes of written volumes and volumes opened ahead of time, the
+number of open volumes and the memory they hold, the seconds that reads
+stalled while volumes were opened, and the seconds of opening volumes that
+were hidden by opening them ahead of time
+        """
+        with self.lock:
+            return {"hits": self.cache_hits,
+                    "misses": self.cache_misses,
+                    "evictions": self.cache_evictions,
+                    "flushes": self.cache_flushes,
+                    "prefetches": self.cache_prefetches,
+                    "volumes": len(self.stack),
+                    "bytes": self.getCacheBytes(),
+                    "stall_time": self.stall_time,
+                    "hidden_time": self.hidden_time}
+
+    def setLookahead(self, lookahead: int, indexes=None):
+        """
+        Sets up opening the volumes that the iteration plan reads next on
+background threads. Whenever a volume is read, the next volumes of the plan
+after it are opened while the cache has room for them.
+
+        :param lookahead: The number of volumes to open ahead, or zero to
+open volumes when they are first read
+        :param indexes: The indexes of the data samples in the order they
+will be read. By default, they are read in index order.
+        """
+        with self.lock:
+            self.lookahead = lookahead
+            self.lookahead_indexes = indexes
+            self.lookahead_plan = None
+            self.lookahead_cursor = 0
+            self.lookahead_pending = set()
+
+    def _lookaheadPlan(self) -> tuple:
+        """
+        Returns the order in which the volumes are read, along with the
+positions of each volume in that order
+        """
+        if self.lookahead_plan is None:
+            if self.lookahead_indexes is None:
+                segments = np.arange(len(self.volumes))
+            else:
+                indexes = np.asarray(self.lookahead_indexes, dtype=np.int64)
+                segments = self.getGrid().getSegment(indexes)
 
-        self.__len__()
+            # Consecutive data samples from the same volume read it once
+            if len(segments) > 0:
+                is_first = np.ones(len(segments), dtype=bool)
+                is_first[1:] = segments[1:] != segments[:-1]
+                segments = segments[is_first]
+
+            plan = segments.tolist()
+            positions = {}
+            for position, index in enumerate(plan):
+                positions.setdefault(index, []).append(position)
+
+            self.lookahead_plan = (plan, positions)
+
+        return self.lookahead_plan
+
+    def _lookaheadWindow(self) -> set:
+        """
+        Returns the indexes of the volume that the plan is reading and the
+volumes that it reads next
+        """
+        if self.lookahead <= 0 or self.lookahead_plan is None:
+            return set()
+
+        plan = self.lookahead_plan[0]
+
+        return set(plan[self.lookahead_cursor:self.lookahead_cursor + self.lookahead + 1])
+
+    def _estimateBytes(self, index: int) -> int:
+        """
+        Estimates the memory a volume holds once it is open from the last
+time it was opened or from the other volumes
+        """
+        if index in self.volume_bytes:
+            return self.volume_bytes[index]
+        if self.volume_bytes:
+            return sum(self.volume_bytes.values()) // len(self.volume_bytes)
+
+        return 0
+
+    def _hasRoom(self, index: int, window: set) -> bool:
+        """
+        Checks whether a volume can be opened ahead of time without evicting
+a volume that is being read or that the plan reads soon. Other open volumes
+are evicted to make room.
+
+        :param index: The index of the volume to open
+        :param window: The indexes of the volumes that the plan reads soon
+        """
+        kept = [i for i in self.stack if self.pins.get(i) or i in window]
+        opening = (set(self.loading) | self.lookahead_pending) - set(kept)
+        if self.stack_size is not None and \
+           len(kept) + len(opening) + 1 > self.stack_size:
+            return False
+
+        if self.cache_bytes is not None:
+            kept_bytes = sum(self.stack[i].getResidentBytes() for i in kept)
+            opening_bytes = sum(self._estimateBytes(i) for i in opening)
+            if (kept_bytes + opening_bytes +
+                    self._estimateBytes(index)) > self.cache_bytes:
+                return False
+
+        return True
+
+    def _scheduleLookahead(self, index: int):
+        """
+        Opens the volumes that the plan reads after a volume on background
+threads. The pool's lock must be held.
+        """
+        if self.lookahead <= 0:
+            return
+
+        plan, positions = self._lookaheadPlan()
+        occurrences = positions.get(index)
+        if not occurrences:
+            return
+
+        # Follow the plan from the first read of the volume at or after the
+        # current position
+        occurrence = bisect_left(occurrences, self.lookahead_cursor)
+        self.lookahead_cursor = occurrences[min(occurrence, len(occurrences) - 1)]
+
+        start = self.lookahead_cursor + 1
+        window = self._lookaheadWindow()
+        for next_index in plan[start:start + self.lookahead]:
+            if next_index in self.stack or next_index in self.loading or \
+               next_index in self.lookahead_pending:
+                continue
+            if not self._hasRoom(next_index, window):
+                break
+
+            if self.lookahead_executor is None:
+                self.lookahead_executor = ThreadPoolExecutor(max_workers=self.lookahead)
+            self.lookahead_pending.add(next_index)
+            self.lookahead_executor.submit(self._prefetchVolume, next_index)
+
+    def _prefetchVolume(self, index: int):
+        try:
+            self._acquireVolume(index, lookahead=True)
+            self._releaseVolume(index)
+        except Exception:
+            # The error is raised again when the volume is read
+            pass
+        finally:
+            with self.lock:
+                self.lookahead_pending.discard(index)
+
+    def _rebuildIndexes(self):
+        self.grid = PatchGrid.concatenate([volume.getGrid()
+                                           for volume in self.volumes])
 
         self.volumes_changed = False
 
-    def _queryBoundingBox(self, bounding_box: BoundingBox) -> Volume:
-        if self.volumes_changed:
-            self._rebuildIndexes()
+    def _queryBoundingBox(self, bounding_box: BoundingBox) -> list:
+        """
+        Finds the pooled volumes that overlap a bounding box
 
-        edge1 = [bounding_box.getEdges()[0].getComponents()]
-        distances, indexes  = self.edge1_list.query(edge1, k=8)
-        indexes = [index for index, dist in zip(indexes[0], distances[0])
-                   if dist < float('Inf')]
-        indexes = filter(lambda index: not bounding_box.isDisjoint(self.volumes[index].getBoundingBox()),
-                         indexes)
+        :param bounding_box: The query bounding box
+        :return: The indexes of the overlapping volumes
+        """
+        indexes = self.spatial_index.query(bounding_box)
         if not indexes:
             raise IndexError("bounding_box is not present in any indexes")
 
-        return list(indexes)
+        return indexes
 
     def add(self, volume: Volume):
         self.volumes_changed = True
         self.volumes.append(volume)
+        if self.spatial_index.query(volume.getBoundingBox()):
+            self.volumes_overlap = True
+        self.spatial_index.add(volume.getBoundingBox())
+        self.lookahead_plan = None
+
+    def _acquireVolume(self, index: int, lookahead: bool=False) -> Volume:
+        """
+        Retrieves a pooled volume, loading it onto the stack if necessary,
+and pins it so that it is not closed until it is released. The volume is
+loaded without holding the pool's lock, so other volumes can be read while it
+loads, and threads that need the same volume wait for a single load.
+
+        :param index: The index of the pooled volume
+        :param lookahead: Whether the volume is opened ahead of time rather
+than to be read
+        :return: The loaded volume
+        """
+        with self.lock:
+            self.pins[index] = self.pins.get(index, 0) + 1
+
+            volume = self.stack.get(index)
+            if volume is not None:
+                self.stack.move_to_end(index)
+                if not lookahead:
+                    self.cache_hits += 1
+                    self.hidden_time += self.prefetched.pop(index, 0.0)
+                    self._scheduleLookahead(index)
+
+                return volume
+
+            loading = self.loading.get(index)
+            is_loader = loading is None
+            evicted = []
+            if is_loader:
+                loading = self.loading[index] = Future()
+                if lookahead:
+                    self.cache_prefetches += 1
+                else:
+                    self.cache_misses += 1
+
+                # Make room for the volume before it is opened
+                evicted = self._evictStack(self._estimateBytes(index))
+            elif not lookahead:
+                self.cache_hits += 1
+
+            if not lookahead:
+                self._scheduleLookahead(index)
+
+        if not is_loader:
+            start = time.perf_counter()
+            try:
+                volume = loading.result()
+            except BaseException:
+                self._releaseVolume(index)
+                raise
+
+            # Only the part of a load that a read waited for is a stall
+            if not lookahead:
+                waited = time.perf_counter() - start
+                with self.lock:
+                    self.stall_time += waited
+                    self.hidden_time += max(self.prefetched.pop(index, 0.0) - waited,
+                                            0.0)
+
+            return volume
+
+        start = time.perf_counter()
+        try:
+            self._closeEvicted(evicted)
+            with self.lock:
+                closing = self.closing.get(index)
+            if closing is not None:
+                closing.result()
+            volume = self._openVolume(index)
+        except BaseException as error:
+            with self.lock:
+                del self.loading[index]
+            self._releaseVolume(index)
+            loading.set_exception(error)
+            raise
+        duration = time.perf_counter() - start
+
+        with self.lock:
+            self.dtypes[index] = volume.getDtype()
+            self.volume_bytes[index] = volume.getResidentBytes()
+            self.stack[index] = volume
+            del self.loading[index]
+            if lookahead:
+                self.prefetched[index] = duration
+            else:
+                self.stall_time += duration
+            evicted = self._evictStack()
+        loading.set_result(volume)
+        self._closeEvicted(evicted)
+
+        return volume
+
+    def _openVolume(self, index: int):
+        """
+        Opens a pooled volume. With a shared memory pool, a volume that
+another process has read is attached to instead of being read again, and a
+volume that is read into memory is moved into shared memory.
+        """
+        volume = self.volumes[index]
+        if self.shared_pool is None or not isinstance(volume, Volume):
+            return volume.__enter__()
+
+        shared = self.shared_pool.attach(index, volume.getIterationSize(),
+                                         volume.getStride())
+        if shared is None:
+            volume.__enter__()
+
+            # Only arrays in private memory are shared
+            array = getattr(volume, "array", None)
+            if array is None or not isinstance(array, Array) or \
+               isinstance(array.getArray(), np.memmap):
+                return volume
+
+            shared = self.shared_pool.share(index, array)
+
+        volume.setArray(shared)
+
+        return volume
+
+    def _releaseVolume(self, index: int):
+        """
+        Unpins a pooled volume after it has been read from, closing volumes
+that were kept open over the cache limits while they were pinned
+        """
+        evicted = []
+        with self.lock:
+            self.pins[index] -= 1
+            if self.pins[index] == 0:
+                del self.pins[index]
+                evicted = self._evictStack()
+
+        self._closeEvicted(evicted)
+
+    def _getExecutor(self) -> ThreadPoolExecutor:
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.num_workers)
+
+            return self.executor
+
+    def _map(self, function, items: list) -> list:
+        if len(items) > 1 and self.num_workers > 1:
+            return list(self._getExecutor().map(function, items))
+
+        return [function(item) for item in items]
+
+    @staticmethod
+    def _isDecoded(volume) -> bool:
+        """
+        Checks whether a pooled volume holds its values in an array, so that
+reading from it only copies memory and is not worth a thread
+        """
+        if isinstance(volume, Array):
+            return True
+
+        return isinstance(getattr(volume, "array", None), Array)
+
+    def _acquireVolumes(self, indexes: list) -> list:
+        """
+        Acquires several pooled volumes, loading them concurrently. If any
+volume fails to load, the others are released.
+
+        :param indexes: The indexes of the pooled volumes
+        :return: The loaded volumes
+        """
+        if len(indexes) > 1 and self.num_workers > 1:
+            futures = [self._getExecutor().submit(self._acquireVolume, index)
+                       for index in indexes]
+            wait(futures)
+
+            errors = [future.exception() for future in futures]
+            if any(error is not None for error in errors):
+                for index, error in zip(indexes, errors):
+                    if error is None:
+                        self._releaseVolume(index)
+                raise next(error for error in errors if error is not None)
+
+            return [future.result() for future in futures]
+
+        volumes = []
+        try:
+            for index in indexes:
+                volumes.append(self._acquireVolume(index))
+        except BaseException:
+            for index in indexes[:len(volumes)]:
+                self._releaseVolume(index)
+            raise
+
+        return volumes
+
+    def getDtype(self, bounding_box: BoundingBox=None):
+        """
+        Retrieves the dtype of the data samples of the pool, which is the
+dtype that the values of every volume can be cast to without loss
+
+        :param bounding_box: The bounding box of a data sample, in which case
+only the volumes that it overlaps are considered
+        :return: The dtype of the data samples
+        """
+        if bounding_box is None:
+            indexes = list(range(len(self.volumes)))
+        else:
+            indexes = self._queryBoundingBox(bounding_box)
+
+        for index in indexes:
+            if index not in self.dtypes:
+                self._acquireVolume(index)
+                self._releaseVolume(index)
+
+        return np.result_type(*[self.dtypes[index] for index in indexes])
 
     def get(self, bounding_box: BoundingBox) -> Data:
+        """
+        Requests a data sample from the pooled volumes, which is assembled in
+a single array with the dtype of the volumes that it overlaps
+
+        :param bounding_box: The bounding box of the request data sample
+        :return: The data sample requested
+        """
         indexes = self._queryBoundingBox(bounding_box)
+        volumes = self._acquireVolumes(indexes)
 
-        data = []
+        try:
+            dtype = np.result_type(*[volume.getDtype() for volume in volumes])
+            array = copy_counter.add(np.empty(bounding_box.getNumpyDim(),
+                                              dtype=dtype))
 
-        stack_volumes = [volume for i, volume in self.stack if i in indexes]
-        stack_disjoint = list(set(indexes) - set([i for i, v in self.stack]))
+            return self._readParts(bounding_box, array, "constant",
+                                   indexes, volumes)
+        finally:
+            for index in indexes:
+                self._releaseVolume(index)
 
-        for volume in stack_volumes:
-            sub_bbox = bounding_box.intersect(volume.getBoundingBox())
-            data.append(volume.get(sub_bbox))
+    def getInto(self, bounding_box: BoundingBox, out: ndarray,
+                mode: str="constant") -> Data:
+        """
+        Reads a data sample from the pooled volumes into a preallocated
+array, writing the part from each volume directly into the array
 
-        for index in stack_disjoint:
-            volume = self.volumes[index]
-            i = self._pushStack(index, volume)
+        :param bounding_box: The bounding box of the request data sample
+        :param out: An array with the shape of the bounding box in Numpy order
+        :param mode: The padding mode for the parts of the bounding box
+outside of the pooled volumes, either "constant", "reflect" or "edge"
+        :return: The data sample requested, which is backed by the given array
+        """
+        if out.shape != bounding_box.getNumpyDim():
+            raise ValueError("out must have shape {} ".format(bounding_box.getNumpyDim()) +
+                             "instead it has shape {}".format(out.shape))
 
-            sub_bbox = bounding_box.intersect(volume.getBoundingBox())
-            data.append(volume.get(sub_bbox))
+        indexes = self._queryBoundingBox(bounding_box)
+        volumes = self._acquireVolumes(indexes)
 
-        shape = bounding_box.getNumpyDim()
-        array = Array(np.zeros(shape).astype(np.uint16),
-                        bounding_box=bounding_box,
-                        iteration_size=BoundingBox(Vector(0, 0, 0),
-                                                    bounding_box.getSize()),
-                        stride=bounding_box.getSize())
-        [array.set(item) for item in data]
-        return Data(array.getArray(), bounding_box)
+        try:
+            return self._readParts(bounding_box, out, mode, indexes, volumes)
+        finally:
+            for index in indexes:
+                self._releaseVolume(index)
 
-    def set(self, data: Data):
-        indexes = self._queryBoundingBox(data.getBoundingBox())
+    def _readParts(self, bounding_box: BoundingBox, out: ndarray, mode: str,
+                   indexes: list, volumes: list) -> Data:
+        """
+        Reads the part of a data sample from each of the acquired volumes
+that it overlaps directly into the array. The parts are read concurrently
+when any of the volumes decodes its values on read.
+        """
+        sub_bounding_boxes = [bounding_box.intersect(self.volumes[index].getBoundingBox())
+                              for index in indexes]
+        sub_edges = BoundingBoxArray(sub_bounding_boxes).getArray()
+        if self.volumes_overlap:
+            covered = _unionVolume(sub_edges)
+        else:
+            covered = np.prod(sub_edges[:, 1] - sub_edges[:, 0], axis=1).sum()
+        is_covered = covered == np.prod(bounding_box.getNumpyDim())
 
-        data = []
-        for index in indexes:
-            for stack_index, stack_volume in self.stack:
-                if stack_index == index:
-                    stack_volume.set(data)
+        if not is_covered and mode == "constant":
+            out[...] = 0
+
+        edge1 = bounding_box.getEdges()[0]
+
+        def readPart(part):
+            volume, sub_bounding_box = part
+            x1, y1, z1 = (sub_bounding_box.getEdges()[0] - edge1).getComponents()
+            x2, y2, z2 = (sub_bounding_box.getEdges()[1] - edge1).getComponents()
+            volume.getInto(sub_bounding_box, out[z1:z2, y1:y2, x1:x2],
+                           mode=mode)
+
+        parts = list(zip(volumes, sub_bounding_boxes))
+        if all(self._isDecoded(volume) for volume in volumes):
+            for part in parts:
+                readPart(part)
+        else:
+            self._map(readPart, parts)
+
+        if not is_covered and mode != "constant":
+            # Pad around the hull of the pooled volumes within the sample
+            hull1 = sub_edges[:, 0].min(axis=0) - edge1.getComponents()
+            hull2 = sub_edges[:, 1].max(axis=0) - edge1.getComponents()
+            _padInPlace(out, tuple(hull1[::-1]), tuple(hull2[::-1]),
+                        mode=mode)
+
+        return Data(out, bounding_box)
+
+    def _write(self, data: Data, blend: bool):
+        """
+        Splits a data sample at the boundaries of the pooled volumes that it
+overlaps and writes each part into its volume, which is marked as dirty so
+that it is written back to its file once, when it is closed
+        """
+        bounding_box = data.getBoundingBox()
+        indexes = self._queryBoundingBox(bounding_box)
+        volumes = self._acquireVolumes(indexes)
+
+        try:
+            with self.lock:
+                self.dirty.update(indexes)
+
+            edge1 = bounding_box.getEdges()[0]
+
+            def writePart(part):
+                index, volume = part
+                sub_bounding_box = bounding_box.intersect(self.volumes[index].getBoundingBox())
+                x1, y1, z1 = (sub_bounding_box.getEdges()[0] - edge1).getComponents()
+                x2, y2, z2 = (sub_bounding_box.getEdges()[1] - edge1).getComponents()
+                sub_data = Data(data.getArray()[z1:z2, y1:y2, x1:x2],
+                                sub_bounding_box)
+
+                if blend:
+                    volume.blend(sub_data)
                 else:
-                    volume = self.volume_list[index].__enter__()
-                    self._pushStack(index, volume)
+                    volume.set(sub_data)
 
-                    volume.set(data)
+            self._map(writePart, list(zip(indexes, volumes)))
+        finally:
+            for index in indexes:
+                self._releaseVolume(index)
+
+    def set(self, data: Data):
+        """
+        Sets a section of the pooled volumes within the provided bounding box
+with the given data. The parts of the data outside of every pooled volume
+are ignored.
+
+        :param data: The data packet to set the volume
+        """
+        self._write(data, blend=False)
+
+    def blend(self, data: Data):
+        """
+        Blends a section of the pooled volumes within the provided bounding
+box with the given data. The parts of the data outside of every pooled
+volume are ignored.
+
+        :param data: The data packet to blend into the volume
+        """
+        self._write(data, blend=True)
+
+    def flush(self):
+        """
+        Writes the open volumes that were written to back to their files.
+The volumes are kept open while they are written, without blocking reads.
+        """
+        with self.lock:
+            indexes = [index for index in self.stack if index in self.dirty]
+            for index in indexes:
+                self.pins[index] = self.pins.get(index, 0) + 1
+            volumes = [self.stack[index] for index in indexes]
+
+        try:
+            for index, volume in zip(indexes, volumes):
+                self._flushVolume(index, volume)
+        finally:
+            for index in indexes:
+                self._releaseVolume(index)
 
     def __exit__(self, exc_type, exc_value, traceback):
-        for index, volume in self.stack:
-            volume.__exit__()
+        # Wait for volumes being opened ahead of time so that they are closed
+        executor, self.lookahead_executor = self.lookahead_executor, None
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+        with self.lock:
+            for index, volume in self.stack.items():
+                self._flushVolume(index, volume)
+                self._closeVolume(index, volume, False, exc_type, exc_value,
+                                  traceback)
+            self.stack.clear()
+
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
+
+    def getGrid(self) -> PatchGrid:
+        """
+        Retrieves the patch grid of the pool, whose segments are the patch
+grids of the pooled volumes
 
-    def __len__(self) -> int:
+        :return: The patch grid of the pool
+        """
         if self.volumes_changed:
-            self.volume_index = [0]
-            for volume in self.volumes:
-                self.volume_index.append(self.volume_index[-1] + len(volume))
-            self.length = self.volume_index[-1]
+            self._rebuildIndexes()
 
-        return self.length
+        return self.grid
+
+    def __len__(self) -> int:
+        return len(self.getGrid())
 
     def __getitem__(self, idx: int) -> Data:
         bounding_box = self._indexToBoundingBox(idx)
@@ -704,39 +2039,23 @@ class PooledVolume(Volume):
         return result
 
     def _indexToBoundingBox(self, idx: int) -> BoundingBox:
-        if self.volumes_changed:
-            len(self)
-
         if idx >= len(self):
             self.index = 0
             raise StopIteration
 
-        index = max(filter(lambda index: self.volume_index[index] <= idx,
-                           range(len(self.volume_index))))
-        volume = self.volumes[index]
-        _idx = idx-self.volume_index[index]
-
-        element_vec = np.unravel_index(_idx,
-                                       dims=volume.element_vec.getComponents())
-
-        element_vec = Vector(*element_vec)
-        bounding_box = volume.iteration_size+volume.stride*element_vec \
-                       + volume.getBoundingBox().getEdges()[0]
-
-        return bounding_box
+        return self.getGrid()[idx]
 
     def setIteration(self, iteration_size: BoundingBox, stride: Vector):
-        for volume in self.volume_list:
+        """
+        Sets the parameters for iterating through the pool, which are set on
+every pooled volume, since the pool iterates through their patch grids
+
+        :param iteration_size: The bounding box of each data sample
+        :param stride: The displacement of each iteration
+        """
+        for volume in self.volumes:
             volume.setIteration(iteration_size, stride)
+        self.volumes_changed = True
 
         self.setIterationSize(iteration_size)
         self.setStride(stride)
-
-    def getValidData(self):
-        if self.valid_data is None:
-            self.valid_data = []
-            for i in range(len(self)):
-                if not (self[i].getArray() == 0).all():
-                    self.valid_data.append(i)
-
-        return self.valid_data
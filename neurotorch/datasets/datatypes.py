@@ -1,29 +1,37 @@
 from numbers import Number
+from operator import add, sub, mul, gt, lt, le, ge
+from bisect import bisect_right
+import numpy as np
 
 
 class Vector:
     """
-    A basic vector data type
+    A basic immutable vector data type
     """
+    __slots__ = ("components",)
+
     def __init__(self, *components: Number):
         """
         Initializes a vector
         :param components: Numbers specifying the components of the vector
         :type components: List of numbers
         """
-        self.setComponents(components)
+        if not all(isinstance(x, Number) for x in components):
+            raise ValueError("components must contain all numbers instead" +
+                             " it contains {}".format(components))
+        object.__setattr__(self, "components", tuple(components))
 
-    def setComponents(self, components: list):
+    @classmethod
+    def _fromComponents(cls, components: tuple):
         """
-        Set the components in a vector
-        :param components: A list of numbers specifying the vector's 
+        Creates a vector without validating its components
+        :param components: A tuple of numbers specifying the vector's
 components
-        :type components: List of numbers
+        :type components: tuple
         """
-        if not all(isinstance(x, Number) for x in components):
-            raise ValueError("components must contain all numbers instead" +
-                             " it contains {}".format(components))
-        self.components = tuple(components)
+        vector = object.__new__(cls)
+        object.__setattr__(vector, "components", components)
+        return vector
 
     def getComponents(self) -> list:
         """
@@ -39,7 +47,7 @@ components
         :return: The vector's dimension
         :rtype: int
         """
-        return len(self.getComponents())
+        return len(self.components)
 
     def getNumpyDim(self) -> list:
         """
@@ -47,7 +55,7 @@ components
         :return: Size of the bounding box in row-major order (Z, Y, X)
         :rtype: list
         """
-        return self.getComponents()[::-1]
+        return self.components[::-1]
 
     def __getitem__(self, idx):
         if not isinstance(idx, int):
@@ -55,36 +63,34 @@ components
         if idx < 0 or idx >= self.getDimension():
             raise IndexError("the index is out-of-bounds")
 
-        return self.getComponents()[idx]
+        return self.components[idx]
 
     def __add__(self, other):
         if not isinstance(other, Vector):
             raise ValueError("other must be a vector instead"
                              " it is {}".format(type(other)))
 
-        if self.getDimension() != other.getDimension():
+        if len(self.components) != len(other.components):
             raise ValueError("other must have the same dimension instead "
                              + "self is {} and other is {}".format(self,
                                                                    other))
 
-        result = tuple(s + o for s, o in zip(self.getComponents(),
-                                             other.getComponents()))
+        result = tuple(map(add, self.components, other.components))
 
-        return Vector(*result)
+        return Vector._fromComponents(result)
 
     def __mul__(self, other):
         if isinstance(other, Number):
-            result = [s * other for s in self.getComponents()]
+            result = tuple(s * other for s in self.components)
 
         elif isinstance(other, Vector):
-            result = [s*o for s, o in zip(self.getComponents(),
-                                          other.getComponents())]
+            result = tuple(map(mul, self.components, other.components))
 
         else:
             raise ValueError("other must be a number or a vector instead"
                              " it is {}".format(type(other)))
 
-        return Vector(*result)
+        return Vector._fromComponents(result)
 
     def __div__(self, other):
         if isinstance(other, Number):
@@ -97,36 +103,61 @@ components
             return result
 
     def __sub__(self, other):
-        return self+(other*-1)
+        if not isinstance(other, Vector):
+            raise ValueError("other must be a vector instead"
+                             " it is {}".format(type(other)))
+
+        if len(self.components) != len(other.components):
+            raise ValueError("other must have the same dimension instead "
+                             + "self is {} and other is {}".format(self,
+                                                                   other))
+
+        result = tuple(map(sub, self.components, other.components))
+
+        return Vector._fromComponents(result)
 
     def __neg__(self):
         return self*-1
 
     def __eq__(self, other):
         if not isinstance(other, Vector):
-            raise ValueError("other must be a vector instead"
-                             " it is {}".format(type(other)))
+            # Vectors hash like tuples, so sets and dicts compare them with
+            # other types
+            return NotImplemented
 
-        if self.getDimension() != other.getDimension():
+        if len(self.components) != len(other.components):
             raise ValueError("other must have the same dimension")
 
-        return all(r1 == r2 for r1, r2 in zip(self.getComponents(),
-                                              other.getComponents()))
+        return self.components == other.components
 
     def __ne__(self, other):
         return not (self == other)
 
+    def __hash__(self):
+        return hash(self.components)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Vector is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("Vector is immutable")
+
+    def __reduce__(self):
+        return (Vector, self.components)
+
     def __str__(self):
-        return "{}".format(self.getComponents())
+        return "{}".format(self.components)
 
     def __iter__(self):
-        return iter(self.getComponents())
+        return iter(self.components)
 
 
 class BoundingBox:
     """
-    A basic data type specifying a cube
+    A basic immutable data type specifying a cube
     """
+    __slots__ = ("edge1", "edge2")
+
     def __init__(self, edge1: Vector, edge2: Vector):
         """
         Initializes a bounding box
@@ -135,16 +166,6 @@ class BoundingBox:
         :param edge2: A vector specifying the second edge of the box
         :type edge2: Vector
         """
-        self.setEdges(edge1, edge2)
-
-    def setEdges(self, edge1: Vector, edge2: Vector):
-        """
-        Sets the edges of the bounding box
-        :param edge1: A vector specifying the first edge of the box
-        :type edge1: Vector
-        :param edge2: A vector specifying the second edge of the box
-        :type edge2: Vector
-        """
         if not isinstance(edge1, Vector) or not isinstance(edge2, Vector):
             raise ValueError("edges must be vectors")
 
@@ -153,8 +174,22 @@ class BoundingBox:
                              + " edge 1 is {} and edge 2 is {}".format(edge1,
                                                                        edge2))
 
-        self.edge1 = edge1
-        self.edge2 = edge2
+        object.__setattr__(self, "edge1", edge1)
+        object.__setattr__(self, "edge2", edge2)
+
+    @classmethod
+    def _fromEdges(cls, edge1: Vector, edge2: Vector):
+        """
+        Creates a bounding box without validating its edges
+        :param edge1: A vector specifying the first edge of the box
+        :type edge1: Vector
+        :param edge2: A vector specifying the second edge of the box
+        :type edge2: Vector
+        """
+        bounding_box = object.__new__(cls)
+        object.__setattr__(bounding_box, "edge1", edge1)
+        object.__setattr__(bounding_box, "edge2", edge2)
+        return bounding_box
 
     def getEdges(self) -> tuple:
         """
@@ -170,7 +205,7 @@ class BoundingBox:
         :return: The dimension of the bounding box
         :rtype: int
         """
-        return self.getEdges()[0].getDimension()
+        return len(self.edge1.components)
 
     def getSize(self) -> Vector:
         """
@@ -178,10 +213,8 @@ class BoundingBox:
         :return: The size of the bounding box
         :rtype: Vector
         """
-        edge1, edge2 = self.getEdges()
-        chunk_size = edge2 - edge1
-
-        return chunk_size
+        return Vector._fromComponents(tuple(map(sub, self.edge2.components,
+                                                self.edge1.components)))
 
     def getNumpyDim(self) -> list:
         """
@@ -189,7 +222,8 @@ class BoundingBox:
         :return: Size of the bounding box in row-major order (Z, Y, X)
         :rtype: list
         """
-        return self.getSize().getComponents()[::-1]
+        return tuple(map(sub, self.edge2.components[::-1],
+                         self.edge1.components[::-1]))
 
     def isDisjoint(self, other) -> bool:
         """
@@ -203,10 +237,8 @@ class BoundingBox:
             raise ValueError("other must be a vector instead other is "
                              "{}".format(type(other)))
 
-        result = any(r1 > r2 for r1, r2 in zip(self.getEdges()[0],
-                                               other.getEdges()[1]))
-        result |= any(r1 < r2 for r1, r2 in zip(self.getEdges()[1],
-                                                other.getEdges()[0]))
+        result = any(map(gt, self.edge1.components, other.edge2.components))
+        result |= any(map(lt, self.edge2.components, other.edge1.components))
 
         return result
 
@@ -225,13 +257,11 @@ class BoundingBox:
 
         # Determines whether the first bounding box's components are
         # less than or equal to the other's components
-        result = any(r1 <= r2 for r1, r2 in zip(self.getEdges()[1],
-                                                other.getEdges()[1]))
+        result = any(map(le, self.edge2.components, other.edge2.components))
 
         # Determines whether the first bounding box's components are
         # greater than or equal to the other's components
-        result &= any(r1 >= r2 for r1, r2 in zip(self.getEdges()[0],
-                                                 other.getEdges()[0]))
+        result &= any(map(ge, self.edge1.components, other.edge1.components))
 
         return result
 
@@ -260,17 +290,37 @@ bounding boxes
 
         # The first edge contains the largest components of the first
         # edge of the two bounding boxes
-        edge1 = Vector(*map(lambda x, y: max(x, y),
-                            self.getEdges()[0].getComponents(),
-                            other.getEdges()[0].getComponents()))
+        edge1 = Vector._fromComponents(tuple(map(max, self.edge1.components,
+                                                 other.edge1.components)))
 
         # The second edge contains the smallest components of the second
         # edge of the two bounding boxes
-        edge2 = Vector(*map(lambda x, y: min(x, y),
-                            self.getEdges()[1].getComponents(),
-                            other.getEdges()[1].getComponents()))
+        edge2 = Vector._fromComponents(tuple(map(min, self.edge2.components,
+                                                 other.edge2.components)))
+
+        return BoundingBox._fromEdges(edge1, edge2)
+
+    def toArray(self) -> np.ndarray:
+        """
+        Returns the edges of the bounding box as an array
+        :return: An array with shape (2, D) containing the two edges
+        :rtype: np.ndarray
+        """
+        edge1, edge2 = self.getEdges()
+        return np.array((edge1.getComponents(), edge2.getComponents()))
 
-        return BoundingBox(edge1, edge2)
+    @classmethod
+    def fromArray(cls, array):
+        """
+        Creates a bounding box from an array of edges
+        :param array: An array with shape (2, D) containing the two edges
+        :type array: np.ndarray
+        :return: The bounding box with the given edges
+        :rtype: BoundingBox
+        """
+        edge1, edge2 = np.asarray(array).tolist()
+        return cls._fromEdges(Vector._fromComponents(tuple(edge1)),
+                              Vector._fromComponents(tuple(edge2)))
 
     def __str__(self):
         edge1, edge2 = self.getEdges()
@@ -281,21 +331,421 @@ bounding boxes
             raise ValueError("other must be a vector instead other is "
                              + "{}".format(type(other)))
 
-        edge1, edge2 = self.getEdges()
-        result = BoundingBox(edge1 + other, edge2 + other)
-        return result
+        return BoundingBox._fromEdges(self.edge1 + other, self.edge2 + other)
 
     def __sub__(self, other):
-        return self.__add__(other*-1)
+        if not isinstance(other, Vector):
+            raise ValueError("other must be a vector instead other is "
+                             + "{}".format(type(other)))
+
+        return BoundingBox._fromEdges(self.edge1 - other, self.edge2 - other)
 
     def __eq__(self, other):
         if not isinstance(other, BoundingBox):
-            raise ValueError("other must be a BoundingBox")
+            return NotImplemented
 
-        s_edge1, s_edge2 = self.getEdges()
-        o_edge1, o_edge2 = other.getEdges()
-
-        return (s_edge1 == o_edge1) and (s_edge2 == o_edge2)
+        return (self.edge1 == other.edge1) and (self.edge2 == other.edge2)
 
     def __ne__(self, other):
         return not (self == other)
+
+    def __hash__(self):
+        return hash((self.edge1.components, self.edge2.components))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("BoundingBox is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("BoundingBox is immutable")
+
+    def __reduce__(self):
+        return (BoundingBox, (self.edge1, self.edge2))
+
+
+class BoundingBoxArray:
+    """
+    A batch of bounding boxes stored as an (N, 2, D) integer array. Its
+operations are vectorized versions of the corresponding BoundingBox
+operations with the same semantics, except that isSubset and isSuperset
+compare every axis where BoundingBox compares any axis.
+    """
+    def __init__(self, boxes):
+        """
+        Initializes a batch of bounding boxes
+        :param boxes: Either an array with shape (N, 2, D) containing the two
+edges of each box or a list of bounding boxes
+        :type boxes: np.ndarray or List of BoundingBox
+        """
+        if isinstance(boxes, BoundingBoxArray):
+            boxes = boxes.getArray()
+        elif not isinstance(boxes, np.ndarray):
+            boxes = [box.toArray() for box in boxes]
+
+        self.setArray(boxes)
+
+    def setArray(self, array):
+        """
+        Sets the edges of the bounding boxes
+        :param array: An array with shape (N, 2, D)
+        :type array: np.ndarray
+        """
+        array = np.asarray(array)
+        if array.size == 0:
+            # Empty arrays keep their dimension, which defaults to three
+            dimension = array.shape[-1] if array.ndim == 3 else 3
+            array = array.reshape(0, 2, dimension)
+        if array.ndim != 3 or array.shape[1] != 2:
+            raise ValueError("array must have shape (N, 2, D) instead it has "
+                             + "shape {}".format(array.shape))
+        if not np.issubdtype(array.dtype, np.integer):
+            array = array.astype(np.int64)
+
+        self.array = array
+
+    def getArray(self) -> np.ndarray:
+        """
+        Returns the edges of the bounding boxes
+        :return: An array with shape (N, 2, D)
+        :rtype: np.ndarray
+        """
+        return self.array
+
+    def getEdges(self) -> tuple:
+        """
+        Returns the two edges of every bounding box
+        :return: A tuple of two arrays with shape (N, D)
+        :rtype: tuple
+        """
+        return (self.array[:, 0], self.array[:, 1])
+
+    def getDimension(self) -> int:
+        """
+        Returns the dimension of the bounding boxes
+        :return: The dimension of the bounding boxes
+        :rtype: int
+        """
+        return self.array.shape[2]
+
+    def getSize(self) -> np.ndarray:
+        """
+        Returns the size of every bounding box
+        :return: An array with shape (N, D) containing the sizes
+        :rtype: np.ndarray
+        """
+        edge1, edge2 = self.getEdges()
+        return edge2 - edge1
+
+    def getNumpyDim(self) -> np.ndarray:
+        """
+        Returns the size of every bounding box in row-major order (Z, Y, X)
+        :return: An array with shape (N, D) containing the sizes
+        :rtype: np.ndarray
+        """
+        return self.getSize()[:, ::-1]
+
+    def _otherEdges(self, other):
+        if isinstance(other, BoundingBox):
+            other = other.toArray()[np.newaxis]
+        elif isinstance(other, BoundingBoxArray):
+            other = other.getArray()
+        else:
+            raise ValueError("other must be a BoundingBox or a " +
+                             "BoundingBoxArray instead it is " +
+                             "{}".format(type(other)))
+
+        return (other[:, 0], other[:, 1])
+
+    def isDisjoint(self, other) -> np.ndarray:
+        """
+        Determines whether each bounding box is disjoint from the other
+        :param other: A bounding box or a batch of bounding boxes of the same
+length for an elementwise comparison
+        :type other: BoundingBox or BoundingBoxArray
+        :return: A boolean array that is true where the boxes are disjoint
+        :rtype: np.ndarray
+        """
+        edge1, edge2 = self.getEdges()
+        other_edge1, other_edge2 = self._otherEdges(other)
+
+        return ((edge1 > other_edge2).any(axis=1) |
+                (edge2 < other_edge1).any(axis=1))
+
+    def isSubset(self, other) -> np.ndarray:
+        """
+        Determines whether each bounding box is contained in the other along
+every axis
+        :param other: A bounding box or a batch of bounding boxes of the same
+length for an elementwise comparison
+        :type other: BoundingBox or BoundingBoxArray
+        :return: A boolean array that is true where the box is a subset
+        :rtype: np.ndarray
+        """
+        edge1, edge2 = self.getEdges()
+        other_edge1, other_edge2 = self._otherEdges(other)
+
+        return ((edge2 <= other_edge2).all(axis=1) &
+                (edge1 >= other_edge1).all(axis=1))
+
+    def isSuperset(self, other) -> np.ndarray:
+        """
+        Determines whether each bounding box contains the other along every
+axis
+        :param other: A bounding box or a batch of bounding boxes of the same
+length for an elementwise comparison
+        :type other: BoundingBox or BoundingBoxArray
+        :return: A boolean array that is true where the box is a super set
+        :rtype: np.ndarray
+        """
+        if isinstance(other, BoundingBox):
+            other = BoundingBoxArray(other.toArray()[np.newaxis])
+
+        return other.isSubset(self)
+
+    def intersect(self, other):
+        """
+        Returns the bounding boxes given by the elementwise intersection
+        :param other: A bounding box or a batch of bounding boxes of the same
+length for an elementwise intersection
+        :type other: BoundingBox or BoundingBoxArray
+        :return: The intersecting bounding boxes
+        :rtype: BoundingBoxArray
+        """
+        if self.isDisjoint(other).any():
+            raise ValueError("The bounding boxes must not be disjoint")
+
+        edge1, edge2 = self.getEdges()
+        other_edge1, other_edge2 = self._otherEdges(other)
+
+        return BoundingBoxArray(np.stack((np.maximum(edge1, other_edge1),
+                                          np.minimum(edge2, other_edge2)),
+                                         axis=1))
+
+    def translate(self, displacement):
+        """
+        Translates every bounding box
+        :param displacement: A vector or an array with shape (N, D) of
+displacements
+        :type displacement: Vector or np.ndarray
+        :return: The translated bounding boxes
+        :rtype: BoundingBoxArray
+        """
+        if isinstance(displacement, Vector):
+            displacement = displacement.getComponents()
+        displacement = np.asarray(displacement)
+
+        return BoundingBoxArray(self.array + displacement[..., np.newaxis, :])
+
+    def toBoundingBoxes(self) -> list:
+        """
+        Converts the batch into a list of bounding boxes
+        :return: A list of bounding boxes
+        :rtype: List of BoundingBox
+        """
+        return [BoundingBox._fromEdges(Vector._fromComponents(tuple(edge1)),
+                                       Vector._fromComponents(tuple(edge2)))
+                for edge1, edge2 in self.array.tolist()]
+
+    def __len__(self):
+        return self.array.shape[0]
+
+    def __getitem__(self, idx):
+        if isinstance(idx, (int, np.integer)):
+            return BoundingBox.fromArray(self.array[idx])
+
+        return BoundingBoxArray(self.array[idx])
+
+    def __iter__(self):
+        return iter(self.toBoundingBoxes())
+
+    def __add__(self, other):
+        return self.translate(other)
+
+    def __sub__(self, other):
+        if isinstance(other, Vector):
+            other = other.getComponents()
+
+        return self.translate(-np.asarray(other))
+
+    def __str__(self):
+        return "BoundingBoxArray({})".format(self.array.tolist())
+
+
+class PatchGrid:
+    """
+    The bounding boxes of the patches that iterate through one or more
+volumes. All patch origins are stored in a single (N, 3) int32 array and the
+patches of each volume form a contiguous segment with a common patch size.
+    """
+    def __init__(self, origins, sizes, offsets):
+        """
+        Initializes a patch grid
+        :param origins: An array with shape (N, 3) of patch origins
+        :type origins: np.ndarray
+        :param sizes: An array with shape (M, 3) of the patch size of each
+segment
+        :type sizes: np.ndarray
+        :param offsets: An array with shape (M+1,) of the first index of each
+segment followed by the number of patches
+        :type offsets: np.ndarray
+        """
+        self.origins = np.asarray(origins, dtype=np.int32).reshape(-1, 3)
+        self.sizes = np.asarray(sizes, dtype=np.int32).reshape(-1, 3)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+
+        if len(self.offsets) != len(self.sizes) + 1 or \
+           self.offsets[-1] != len(self.origins):
+            raise ValueError("offsets must delimit one segment per size")
+
+        self._offsets = self.offsets.tolist()
+        self._sizes = [tuple(size) for size in self.sizes.tolist()]
+
+    @classmethod
+    def fromVolume(cls, bounding_box: BoundingBox,
+                   iteration_size: BoundingBox, stride: Vector):
+        """
+        Creates the patch grid of a volume. The patches are displaced by the
+stride and ordered with the Z component varying fastest.
+        :param bounding_box: The bounding box of the volume
+        :type bounding_box: BoundingBox
+        :param iteration_size: The bounding box of each patch relative to the
+volume's first edge
+        :type iteration_size: BoundingBox
+        :param stride: The displacement between patches
+        :type stride: Vector
+        :return: The patch grid of the volume
+        :rtype: PatchGrid
+        """
+        def ceil(x):
+            return int(round(x))
+
+        counts = [max(ceil((L-l)/s+1), 0)
+                  for L, l, s in zip(bounding_box.getSize(),
+                                     iteration_size.getSize(),
+                                     stride)]
+
+        elements = np.meshgrid(*[np.arange(count) for count in counts],
+                               indexing='ij')
+        elements = np.stack([element.ravel() for element in elements],
+                            axis=1)
+        base = [e + i for e, i in zip(bounding_box.getEdges()[0],
+                                      iteration_size.getEdges()[0])]
+        origins = elements * np.array(stride.getComponents()) + np.array(base)
+
+        return cls(origins, [iteration_size.getSize().getComponents()],
+                   [0, len(origins)])
+
+    @classmethod
+    def concatenate(cls, grids):
+        """
+        Concatenates the patch grids of several volumes into one
+        :param grids: A list of patch grids
+        :type grids: List of PatchGrid
+        :return: The patch grid whose segments are the segments of each grid
+        :rtype: PatchGrid
+        """
+        if not grids:
+            return cls(np.zeros((0, 3)), np.zeros((0, 3)), [0])
+
+        origins = np.concatenate([grid.origins for grid in grids])
+        sizes = np.concatenate([grid.sizes for grid in grids])
+        offsets = [0]
+        for grid in grids:
+            offsets.extend(offsets[-1] + grid.offsets[1:])
+
+        return cls(origins, sizes, offsets)
+
+    def getOrigins(self) -> np.ndarray:
+        """
+        Returns the origins of the patches
+        :return: An array with shape (N, 3) of patch origins
+        :rtype: np.ndarray
+        """
+        return self.origins
+
+    def getSizes(self) -> np.ndarray:
+        """
+        Returns the patch size of each segment
+        :return: An array with shape (M, 3) of patch sizes
+        :rtype: np.ndarray
+        """
+        return self.sizes
+
+    def getSegment(self, idx):
+        """
+        Returns the segment, i.e. the volume, containing the patch at an index
+        :param idx: An index or an array of indexes
+        :return: The segment index or an array of segment indexes
+        """
+        if isinstance(idx, (int, np.integer)):
+            return bisect_right(self._offsets, idx) - 1
+
+        return np.searchsorted(self.offsets, idx, side='right') - 1
+
+    def getSegmentCount(self) -> int:
+        """
+        Returns the number of segments in the patch grid
+        :return: The number of segments
+        :rtype: int
+        """
+        return len(self._sizes)
+
+    def getBoundingBoxes(self, indexes=None) -> BoundingBoxArray:
+        """
+        Returns the bounding boxes of the patches
+        :param indexes: A slice or an array of patch indexes. By default, all
+patches are returned.
+        :return: The bounding boxes of the patches
+        :rtype: BoundingBoxArray
+        """
+        if indexes is None:
+            indexes = slice(None)
+        if isinstance(indexes, slice):
+            indexes = np.arange(len(self))[indexes]
+
+        indexes = np.asarray(indexes)
+        origins = self.origins[indexes]
+        sizes = self.sizes[self.getSegment(indexes)]
+
+        return BoundingBoxArray(np.stack((origins, origins + sizes), axis=1))
+
+    def save(self, filename):
+        """
+        Saves the patch grid to a Numpy archive
+        :param filename: The filename of the archive
+        """
+        np.savez(filename, origins=self.origins, sizes=self.sizes,
+                 offsets=self.offsets)
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Loads a patch grid from a Numpy archive
+        :param filename: The filename of the archive
+        :return: The loaded patch grid
+        :rtype: PatchGrid
+        """
+        with np.load(filename) as archive:
+            return cls(archive["origins"], archive["sizes"],
+                       archive["offsets"])
+
+    def __len__(self):
+        return len(self.origins)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, (int, np.integer)):
+            if idx < 0:
+                idx += len(self)
+            if idx < 0 or idx >= len(self):
+                raise IndexError("the index is out-of-bounds")
+
+            origin = tuple(self.origins[idx].tolist())
+            if len(self._sizes) == 1:
+                size = self._sizes[0]
+            else:
+                size = self._sizes[bisect_right(self._offsets, idx) - 1]
+
+            return BoundingBox._fromEdges(Vector._fromComponents(origin),
+                                          Vector._fromComponents(
+                                              tuple(map(add, origin, size))))
+
+        return self.getBoundingBoxes(idx)
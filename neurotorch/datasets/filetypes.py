@@ -1,27 +1,119 @@
-from neurotorch.datasets.dataset import Volume, Array, Data
+from neurotorch.datasets.dataset import Volume, Array, Data, _padInPlace
 from neurotorch.datasets.datatypes import BoundingBox, Vector
 from abc import abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import product
+from threading import Lock, RLock
 import fnmatch
+import json
+import mmap
 import os.path
+import re
+import tempfile
+import zlib
 import h5py
 import numpy as np
 import tifffile as tif
 
 
+def _naturalSortKey(filename):
+    """
+    Sorts filenames by the numbers within them, so that slice_10.tif comes
+after slice_9.tif
+    """
+    return [int(part) if part.isdigit() else part.lower()
+            for part in re.split(r"(\d+)", filename)]
+
+
+# ImageJ metadata that describes the shape of a stack, which is written again
+IMAGEJ_SHAPE_KEYS = ("ImageJ", "images", "channels", "slices", "frames",
+                     "hyperstack", "mode", "loop")
+
+
+def _tiffWriteOptions(tiff_file) -> dict:
+    """
+    Reads the options that a TIFF file was written with from its first page,
+so that an array written back to the file keeps its compression, photometric
+interpretation, resolution and metadata
+    """
+    with tif.TiffFile(tiff_file) as f:
+        page = f.pages[0]
+        options = {"compression": page.compression,
+                   "photometric": page.photometric}
+        if page.predictor != 1:
+            options["predictor"] = page.predictor
+
+        x_resolution = page.tags.get("XResolution")
+        y_resolution = page.tags.get("YResolution")
+        if x_resolution is not None and y_resolution is not None:
+            options["resolution"] = (x_resolution.value, y_resolution.value)
+            options["resolutionunit"] = page.resolutionunit
+
+        if f.is_imagej:
+            options["imagej"] = True
+            options["metadata"] = {key: value for key, value
+                                   in f.imagej_metadata.items()
+                                   if key not in IMAGEJ_SHAPE_KEYS}
+        elif page.description and not page.description.startswith('{"shape":'):
+            options["description"] = page.description
+
+    return options
+
+
+def _writeTiff(tiff_file, array: np.ndarray):
+    """
+    Writes an array over a TIFF file with the options and permissions that
+the file was written with. The array is written to a temporary file with a
+unique name that replaces the TIFF file, so the file is left unchanged if it
+cannot be encoded.
+    """
+    options = _tiffWriteOptions(tiff_file)
+    descriptor, temporary_file = tempfile.mkstemp(suffix=".tmp",
+                                                  dir=os.path.dirname(os.path.abspath(tiff_file)))
+    os.close(descriptor)
+    try:
+        tif.imwrite(temporary_file, array, **options)
+        os.chmod(temporary_file, os.stat(tiff_file).st_mode & 0o777)
+        os.replace(temporary_file, tiff_file)
+    except BaseException:
+        os.remove(temporary_file)
+        raise
+
+
 class TiffVolume(Volume):
     def __init__(self, tiff_file, bounding_box: BoundingBox,
                  iteration_size: BoundingBox=BoundingBox(Vector(0, 0, 0),
                                                          Vector(128, 128, 32)),
-                 stride: Vector=Vector(64, 64, 16)):
+                 stride: Vector=Vector(64, 64, 16), lazy: bool=False,
+                 cache_size: int=None, num_workers: int=4):
         """
         Loads a TIFF stack file or a directory of TIFF files and creates a
 corresponding three-dimensional volume dataset
         :param tiff_file: Either a TIFF stack file or a directory
-containing TIFF files
+containing TIFF files, which are ordered by the numbers in their filenames
         :param chunk_size: Dimensions of the sample subvolume
+        :param lazy: Whether to read the volume on demand instead of decoding
+it when the volume is opened. Uncompressed, contiguous stacks are
+memory-mapped and otherwise only the pages or files covering a request are
+decoded. Lazy volumes are read-only.
+        :param cache_size: The number of decoded pages that a lazy volume
+keeps in memory. By default, twice the depth of a data sample.
+        :param num_workers: The number of threads decoding pages or files
         """
         # Set TIFF file and bounding box
         self.setFile(tiff_file)
+        self.lazy = lazy
+        self.num_workers = num_workers
+        self.tiff_handle = None
+        self.slice_files = None
+        self.page_dtype = None
+        self.page_cache = OrderedDict()
+        self.cache_size = cache_size
+        self.page_lock = Lock()
+        self.handle_lock = RLock()
+        self.executor = None
+        self.executor_lock = Lock()
         super().__init__(bounding_box, iteration_size, stride)
 
     def setFile(self, tiff_file):
@@ -33,10 +125,204 @@ containing TIFF files
     def getFile(self):
         return self.tiff_file
 
+    def isLazy(self):
+        return self.lazy
+
+    def getDtype(self):
+        if self._isPaged():
+            return self.page_dtype
+
+        return super().getDtype()
+
+    def getResidentBytes(self) -> int:
+        with self.page_lock:
+            page_bytes = sum(page.nbytes for page in self.page_cache.values())
+
+        return super().getResidentBytes() + page_bytes
+
+    def getCacheSize(self) -> int:
+        if self.cache_size is None:
+            return 2 * self.getIterationSize().getSize()[2]
+
+        return self.cache_size
+
+    def _isPaged(self):
+        return self.tiff_handle is not None or self.slice_files is not None
+
     def get(self, bounding_box):
-        return self.getArray().get(bounding_box)
+        if not self._isPaged():
+            return self.getArray().get(bounding_box)
+
+        array = np.empty(bounding_box.getNumpyDim(), dtype=self.page_dtype)
+
+        return self.getInto(bounding_box, array)
+
+    def getInto(self, bounding_box, out, mode="constant"):
+        if not self._isPaged():
+            return self.getArray().getInto(bounding_box, out, mode=mode)
+
+        if out.shape != bounding_box.getNumpyDim():
+            raise ValueError("out must have shape {} ".format(bounding_box.getNumpyDim()) +
+                             "instead it has shape {}".format(out.shape))
+
+        if bounding_box.isDisjoint(self.getBoundingBox()):
+            raise ValueError("Bounding box must be inside dataset " +
+                             "dimensions instead bounding box is " +
+                             "{} while the dataset dimensions are {}".format(bounding_box,
+                                                                             self.getBoundingBox()))
+
+        sub_bounding_box = bounding_box.intersect(self.getBoundingBox())
+        x1, y1, z1 = (sub_bounding_box.getEdges()[0] -
+                      bounding_box.getEdges()[0]).getComponents()
+        x2, y2, z2 = (sub_bounding_box.getEdges()[1] -
+                      bounding_box.getEdges()[0]).getComponents()
+        vx1, vy1, vz1 = (sub_bounding_box.getEdges()[0] -
+                         self.getBoundingBox().getEdges()[0]).getComponents()
+
+        # Decode only the pages covering the bounding box
+        pages = self._map(self._readPage, range(vz1, vz1 + z2 - z1))
+        for z, page in enumerate(pages):
+            out[z1 + z, y1:y2, x1:x2] = page[vy1:vy1 + y2 - y1,
+                                             vx1:vx1 + x2 - x1]
+
+        if sub_bounding_box != bounding_box:
+            _padInPlace(out, (z1, y1, x1), (z2, y2, x2), mode=mode)
+
+        return Data(out, bounding_box)
+
+    def _getExecutor(self) -> ThreadPoolExecutor:
+        with self.executor_lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.num_workers)
+
+            return self.executor
+
+    def _map(self, function, items):
+        items = list(items)
+        if len(items) > 1 and self.num_workers > 1:
+            return list(self._getExecutor().map(function, items))
+
+        return [function(item) for item in items]
+
+    def _readPage(self, z):
+        """
+        Reads a page of a lazy volume from the page cache or decodes it
+
+        :param z: The index of the page in the TIFF stack or directory
+        :return: The decoded page
+        """
+        with self.page_lock:
+            if z in self.page_cache:
+                self.page_cache.move_to_end(z)
+                return self.page_cache[z]
+
+        if self.slice_files is not None:
+            page = tif.imread(self.slice_files[z])
+        else:
+            # Only seeks and reads from the file are serialized, and the page
+            # is decoded outside of the lock
+            with self.handle_lock:
+                tiff_page = self.tiff_handle.pages[z]
+            page = tiff_page.asarray(lock=self.handle_lock, maxworkers=1)
+        page.flags.writeable = False
+
+        with self.page_lock:
+            self.page_cache[z] = page
+            while len(self.page_cache) > self.getCacheSize():
+                self.page_cache.popitem(last=False)
+
+        return page
+
+    def set(self, data):
+        if self.isLazy():
+            raise ValueError("lazy TIFF volumes are read-only")
+        self.getArray().set(data)
+
+    def blend(self, data):
+        if self.isLazy():
+            raise ValueError("lazy TIFF volumes are read-only")
+        self.getArray().blend(data)
+
+    def flush(self):
+        """
+        Writes the array of a volume that was read into memory back to its
+TIFF file or directory. Each file keeps the compression and metadata of its
+first page, and the whole file is rewritten.
+        """
+        array = getattr(self, "array", None)
+        if self.isLazy() or array is None:
+            return
+
+        array = array.getArray()
+        if os.path.isdir(self.getFile()):
+            for slice_file, page in zip(self._listSlices(), array):
+                _writeTiff(slice_file, page)
+        else:
+            _writeTiff(self.getFile(), array)
+
+    def _listSlices(self):
+        """
+        Lists the TIFF files of a directory in natural sort order
+        """
+        tiff_list = [f for f in os.listdir(self.getFile())
+                     if fnmatch.fnmatch(f.lower(), "*.tif") or
+                     fnmatch.fnmatch(f.lower(), "*.tiff")]
+        if not tiff_list:
+            raise IOError("{} does not contain any TIFF "
+                          "files".format(self.getFile()))
+
+        return [os.path.join(self.getFile(), f)
+                for f in sorted(tiff_list, key=_naturalSortKey)]
+
+    def _openLazy(self):
+        """
+        Opens a TIFF stack file or directory for reading on demand
+        """
+        if os.path.isdir(self.getFile()):
+            self.slice_files = self._listSlices()
+            with tif.TiffFile(self.slice_files[0]) as f:
+                self.page_dtype = f.pages[0].dtype
+            self.setArray(None)
+            return self
+
+        try:
+            array = tif.memmap(self.getFile(), mode="r")
+            array = array.reshape(-1, *array.shape[-2:])
+        except ValueError:
+            # Compressed or fragmented stacks are decoded page by page
+            self.tiff_handle = tif.TiffFile(self.getFile())
+            self.page_dtype = self.tiff_handle.pages[0].dtype
+            self.setArray(None)
+            return self
+
+        array = Array(array, bounding_box=self.getBoundingBox(),
+                      iteration_size=self.getIterationSize(),
+                      stride=self.getStride())
+        self.setArray(array)
+
+        return self
+
+    def _readSlices(self):
+        """
+        Decodes the TIFF files of a directory into a single array
+        """
+        slice_files = self._listSlices()
+        with tif.TiffFile(slice_files[0]) as f:
+            shape, dtype = f.pages[0].shape, f.pages[0].dtype
+
+        array = np.empty((len(slice_files), *shape), dtype=dtype)
+
+        def readSlice(z):
+            tif.imread(slice_files[z], out=array[z])
+
+        self._map(readSlice, range(len(slice_files)))
+
+        return array
 
     def __enter__(self):
+        if self.isLazy():
+            return self._openLazy()
+
         if os.path.isfile(self.getFile()):
             try:
                 print("Opening {}".format(self.getFile()))
@@ -47,12 +333,7 @@ containing TIFF files
                               "opened".format(self.getFile()))
 
         elif os.path.isdir(self.getFile()):
-            tiff_list = os.listdir(self.getFile())
-            tiff_list = filter(lambda f: fnmatch.fnmatch(f, '*.tif'),
-                               tiff_list)
-
-            if tiff_list:
-                array = tif.TiffSequence(tiff_list).asarray()
+            array = self._readSlices()
 
         else:
             raise IOError("{} was not found".format(self.getFile()))
@@ -65,27 +346,97 @@ containing TIFF files
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
+        if self.tiff_handle is not None:
+            self.tiff_handle.close()
+            self.tiff_handle = None
+        self.slice_files = None
+
+        with self.page_lock:
+            self.page_cache.clear()
+
+        with self.executor_lock:
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
+
         self.setArray(None)
 
+    def __getitem__(self, idx):
+        return self.get(self._indexToBoundingBox(idx))
+
     def _indexToBoundingBox(self, idx):
-        return self.getArray()._indexToBoundingBox(idx)
+        if idx >= len(self):
+            self.index = 0
+            raise StopIteration
+
+        return self.getGrid()[idx]
+
+
+HDF5_COMPRESSIONS = ("gzip", "lzf")
 
 
 class Hdf5Volume(Volume):
+    MODES = ("r", "w")
+
     def __init__(self, hdf5_file, dataset, bounding_box: BoundingBox,
                  iteration_size: BoundingBox=BoundingBox(Vector(0, 0, 0),
                                                          Vector(128, 128, 20)),
-                 stride: Vector=Vector(64, 64, 10)):
+                 stride: Vector=Vector(64, 64, 10), streaming: bool=False,
+                 rdcc_nbytes: int=None, rdcc_nslots: int=None,
+                 mode: str="r", dtype=np.float32, chunk_size: Vector=None,
+                 compression: str="gzip", level: int=1):
         """
         Loads a HDF5 dataset and creates a corresponding three-dimensional
 volume dataset
 
         :param hdf5_file: A HDF5 file path
         :param dataset: A HDF5 dataset name
-        :param chunk_size: Dimensions of the sample subvolume
+        :param iteration_size: The bounding box of each data sample in the
+dataset iterable
+        :param stride: The stride displacement of each data sample in the
+dataset iterable
+        :param streaming: Whether to keep the file open and read only the
+requested hyperslab of each data sample instead of loading the dataset when
+the volume is opened
+        :param rdcc_nbytes: The size in bytes of the HDF5 raw chunk cache of
+a streaming volume, which should hold the chunks that a data sample overlaps
+        :param rdcc_nslots: The number of hash slots of the HDF5 raw chunk
+cache, ideally a prime about 100 times the number of chunks that fit in it
+        :param mode: Either "r" to read an existing dataset or "w" to create
+the dataset, replacing it if it exists, and write data samples into it
+        :param dtype: The dtype of a created dataset
+        :param chunk_size: The size of each chunk of a created dataset. By
+default, it is the stride, so that chunks are aligned to the patch grid.
+        :param compression: The compression of a created dataset, either
+"gzip" or "lzf"
+        :param level: The gzip compression level of a created dataset
         """
+        if mode not in self.MODES:
+            raise ValueError("mode must be one of {} ".format(self.MODES) +
+                             "instead it is {}".format(mode))
+        if mode == "w" and compression not in HDF5_COMPRESSIONS:
+            raise ValueError("compression must be one of " +
+                             "{} instead it is {}".format(HDF5_COMPRESSIONS,
+                                                          compression))
+
         self.setFile(hdf5_file)
         self.setDataset(dataset)
+        self.streaming = streaming
+        self.rdcc_nbytes = rdcc_nbytes
+        self.rdcc_nslots = rdcc_nslots
+        self.hdf5_handle = None
+        self.hdf5_data = None
+
+        self.mode = mode
+        self.dtype = np.dtype(dtype)
+        self.chunk_size = chunk_size if chunk_size is not None else stride
+        self.compression = compression
+        self.level = level
+        self.chunk_buffers = {}
+        self.chunk_remaining = None
+        self.written_chunks = set()
+        self.chunk_lock = Lock()
+
         super().__init__(bounding_box, iteration_size, stride)
 
     def setFile(self, hdf5_file):
@@ -100,14 +451,819 @@ volume dataset
     def getDataset(self):
         return self.hdf5_dataset
 
+    def isStreaming(self):
+        return self.streaming or self.mode == "w"
+
+    def getChunkSize(self) -> Vector:
+        return self.chunk_size
+
+    def getDtype(self):
+        if self.hdf5_data is not None:
+            return self.hdf5_data.dtype
+
+        return super().getDtype()
+
+    def getResidentBytes(self) -> int:
+        with self.chunk_lock:
+            buffer_bytes = sum(chunk.nbytes for chunk in self.chunk_buffers.values())
+
+        # The raw chunk cache of HDF5 defaults to one megabyte
+        if self.hdf5_handle is not None:
+            buffer_bytes += (self.rdcc_nbytes if self.rdcc_nbytes is not None
+                             else 2**20)
+
+        return super().getResidentBytes() + buffer_bytes
+
+    def _chunkBoundingBox(self, key: tuple) -> BoundingBox:
+        """
+        Returns the bounding box of a chunk, which is clipped to the volume
+
+        :param key: The chunk coordinates along X, Y and Z
+        """
+        edge1 = self.getBoundingBox().getEdges()[0] + self.chunk_size * Vector(*key)
+        edge2 = edge1 + self.chunk_size
+
+        return BoundingBox(edge1, edge2).intersect(self.getBoundingBox())
+
+    def _chunkKeys(self, bounding_box: BoundingBox) -> list:
+        """
+        Returns the coordinates of the chunks that overlap a bounding box
+        """
+        edge1, edge2 = (bounding_box - self.getBoundingBox().getEdges()[0]).getEdges()
+        ranges = [range(e1 // size, (e2 - 1) // size + 1)
+                  for e1, e2, size in zip(edge1, edge2, self.chunk_size)]
+
+        return [(x, y, z) for z, y, x in product(*ranges[::-1])]
+
+    def _chunkCoverage(self) -> np.ndarray:
+        """
+        Counts the data samples of the patch grid that overlap each chunk
+
+        :return: An array of counts indexed by the chunk coordinates in Numpy
+order
+        """
+        size = np.array(self.getBoundingBox().getSize().getComponents())
+        chunk_size = np.array(self.chunk_size.getComponents())
+        edges = (self.getGrid().getBoundingBoxes().getArray() -
+                 np.array(self.getBoundingBox().getEdges()[0].getComponents()))
+
+        first = np.clip(edges[:, 0], 0, size) // chunk_size
+        last = (np.clip(edges[:, 1], 0, size) - 1) // chunk_size + 1
+        inside = (last > first).all(axis=1)
+        first, last = first[inside], last[inside]
+
+        # Add each range of chunks to a difference table whose cumulative
+        # sums are the counts
+        shape = -(-size // chunk_size)
+        difference = np.zeros(tuple(shape[::-1] + 1), dtype=np.int64)
+        for corner in product((0, 1), repeat=3):
+            index = np.where(corner, last, first)
+            np.add.at(difference, (index[:, 2], index[:, 1], index[:, 0]),
+                      (-1) ** sum(corner))
+
+        counts = difference.cumsum(0).cumsum(1).cumsum(2)
+
+        return counts[:-1, :-1, :-1]
+
+    def _chunkSelection(self, key: tuple) -> tuple:
+        chunk_bounding_box = self._chunkBoundingBox(key)
+        x1, y1, z1 = (chunk_bounding_box.getEdges()[0] -
+                      self.getBoundingBox().getEdges()[0]).getComponents()
+        x2, y2, z2 = (chunk_bounding_box.getEdges()[1] -
+                      self.getBoundingBox().getEdges()[0]).getComponents()
+
+        return np.s_[z1:z2, y1:y2, x1:x2]
+
+    def _flushChunk(self, key: tuple):
+        """
+        Compresses and writes a buffered chunk to the dataset
+        """
+        self.hdf5_data[self._chunkSelection(key)] = self.chunk_buffers.pop(key)
+        self.written_chunks.add(key)
+
+    def _write(self, data: Data, blend: bool):
+        """
+        Writes a data sample into the buffers of the chunks that it overlaps.
+A chunk is written to the dataset once every data sample of the patch grid
+that overlaps it has been written.
+        """
+        if self.mode != "w":
+            raise ValueError("{} must be opened with mode ".format(self.getFile()) +
+                             "\"w\" to be written")
+
+        data_bounding_box = data.getBoundingBox()
+        if data_bounding_box.isDisjoint(self.getBoundingBox()):
+            raise ValueError("The bounding box must overlap the volume")
+
+        sub_bounding_box = data_bounding_box.intersect(self.getBoundingBox())
+        edge1 = data_bounding_box.getEdges()[0]
+
+        with self.chunk_lock:
+            for key in self._chunkKeys(sub_bounding_box):
+                chunk_bounding_box = self._chunkBoundingBox(key)
+                overlap = chunk_bounding_box.intersect(sub_bounding_box)
+
+                chunk = self.chunk_buffers.get(key)
+                if chunk is None:
+                    if key in self.written_chunks:
+                        chunk = self.hdf5_data[self._chunkSelection(key)]
+                    else:
+                        chunk = np.zeros(chunk_bounding_box.getNumpyDim(),
+                                         dtype=self.dtype)
+                    self.chunk_buffers[key] = chunk
+
+                x1, y1, z1 = (overlap.getEdges()[0] - edge1).getComponents()
+                x2, y2, z2 = (overlap.getEdges()[1] - edge1).getComponents()
+                cx1, cy1, cz1 = (overlap.getEdges()[0] -
+                                 chunk_bounding_box.getEdges()[0]).getComponents()
+                cx2, cy2, cz2 = (overlap.getEdges()[1] -
+                                 chunk_bounding_box.getEdges()[0]).getComponents()
+                values = data.getArray()[z1:z2, y1:y2, x1:x2]
+                target = chunk[cz1:cz2, cy1:cy2, cx1:cx2]
+
+                if blend:
+                    np.maximum(target, values, out=target, casting="unsafe")
+                else:
+                    target[...] = values
+
+                x, y, z = key
+                self.chunk_remaining[z, y, x] -= 1
+                if self.chunk_remaining[z, y, x] <= 0:
+                    self._flushChunk(key)
+
+    def set(self, data: Data):
+        """
+        Sets a section of the volume within the provided bounding box with the
+given data. The parts of the data outside of the volume are ignored.
+
+        :param data: The data packet to set the volume
+        """
+        if self.mode != "w":
+            return self.getArray().set(data)
+
+        self._write(data, blend=False)
+
+    def blend(self, data: Data):
+        """
+        Blends a section of the volume within the provided bounding box with
+the given data by taking the elementwise maximum value. The parts of the data
+outside of the volume are ignored.
+
+        :param data: The data packet to blend into the volume
+        """
+        if self.mode != "w":
+            return self.getArray().blend(data)
+
+        self._write(data, blend=True)
+
+    def flush(self):
+        """
+        Writes the chunks that are still buffered to the dataset
+        """
+        with self.chunk_lock:
+            for key in list(self.chunk_buffers):
+                self._flushChunk(key)
+
+    def get(self, bounding_box):
+        if self.hdf5_data is None:
+            return self.getArray().get(bounding_box)
+
+        array = np.empty(bounding_box.getNumpyDim(),
+                         dtype=self.hdf5_data.dtype)
+
+        return self.getInto(bounding_box, array)
+
+    def getInto(self, bounding_box, out, mode="constant"):
+        if self.hdf5_data is None:
+            return self.getArray().getInto(bounding_box, out, mode=mode)
+
+        if out.shape != bounding_box.getNumpyDim():
+            raise ValueError("out must have shape {} ".format(bounding_box.getNumpyDim()) +
+                             "instead it has shape {}".format(out.shape))
+
+        if bounding_box.isDisjoint(self.getBoundingBox()):
+            raise ValueError("Bounding box must be inside dataset " +
+                             "dimensions instead bounding box is " +
+                             "{} while the dataset dimensions are {}".format(bounding_box,
+                                                                             self.getBoundingBox()))
+
+        sub_bounding_box = bounding_box.intersect(self.getBoundingBox())
+        x1, y1, z1 = (sub_bounding_box.getEdges()[0] -
+                      bounding_box.getEdges()[0]).getComponents()
+        x2, y2, z2 = (sub_bounding_box.getEdges()[1] -
+                      bounding_box.getEdges()[0]).getComponents()
+        vx1, vy1, vz1 = (sub_bounding_box.getEdges()[0] -
+                         self.getBoundingBox().getEdges()[0]).getComponents()
+        vx2, vy2, vz2 = (sub_bounding_box.getEdges()[1] -
+                         self.getBoundingBox().getEdges()[0]).getComponents()
+
+        source_selection = np.s_[vz1:vz2, vy1:vy2, vx1:vx2]
+        dest_selection = np.s_[z1:z2, y1:y2, x1:x2]
+
+        # Read the hyperslab straight into the array when HDF5 can write to
+        # it, and otherwise through a temporary array
+        if out.flags.c_contiguous and out.flags.writeable:
+            self.hdf5_data.read_direct(out, source_sel=source_selection,
+                                       dest_sel=dest_selection)
+        else:
+            out[dest_selection] = self.hdf5_data[source_selection]
+
+        # Chunks that are still buffered are newer than the dataset
+        if self.chunk_buffers:
+            with self.chunk_lock:
+                for key in self._chunkKeys(sub_bounding_box):
+                    chunk = self.chunk_buffers.get(key)
+                    if chunk is None:
+                        continue
+                    chunk_bounding_box = self._chunkBoundingBox(key)
+                    overlap = chunk_bounding_box.intersect(sub_bounding_box)
+                    ox1, oy1, oz1 = (overlap.getEdges()[0] -
+                                     bounding_box.getEdges()[0]).getComponents()
+                    ox2, oy2, oz2 = (overlap.getEdges()[1] -
+                                     bounding_box.getEdges()[0]).getComponents()
+                    cx1, cy1, cz1 = (overlap.getEdges()[0] -
+                                     chunk_bounding_box.getEdges()[0]).getComponents()
+                    cx2, cy2, cz2 = (overlap.getEdges()[1] -
+                                     chunk_bounding_box.getEdges()[0]).getComponents()
+                    out[oz1:oz2, oy1:oy2, ox1:ox2] = chunk[cz1:cz2, cy1:cy2, cx1:cx2]
+
+        if sub_bounding_box != bounding_box:
+            _padInPlace(out, (z1, y1, x1), (z2, y2, x2), mode=mode)
+
+        return Data(out, bounding_box)
+
     def __enter__(self):
-        if os.path.isfile(self.getFile()):
-            with h5py.File(self.getFile(), 'r') as f:
-                array = f[self.getDataset()].value
-                array = Array(array, bounding_box=self.getBoundingBox(),
-                              iteration_size=self.getIterationSize(),
-                              stride=self.getStride())
-                self.setArray(array)
+        if self.mode == "w":
+            self.hdf5_handle = h5py.File(self.getFile(), 'a',
+                                         rdcc_nbytes=self.rdcc_nbytes,
+                                         rdcc_nslots=self.rdcc_nslots)
+            if self.getDataset() in self.hdf5_handle:
+                del self.hdf5_handle[self.getDataset()]
+
+            shape = self.getBoundingBox().getNumpyDim()
+            chunks = tuple(min(c, s) for c, s in
+                           zip(self.chunk_size.getComponents()[::-1], shape))
+            self.chunk_size = Vector(*chunks[::-1])
+            self.hdf5_data = self.hdf5_handle.create_dataset(
+                self.getDataset(), shape=shape, dtype=self.dtype,
+                chunks=chunks, compression=self.compression,
+                compression_opts=self.level if self.compression == "gzip" else None,
+                fillvalue=0)
+
+            self.chunk_buffers = {}
+            self.chunk_remaining = self._chunkCoverage()
+            self.written_chunks = set()
+            self.setArray(None)
+
+            return self
+
+        if not os.path.isfile(self.getFile()):
+            raise IOError("{} was not found".format(self.getFile()))
+
+        if self.isStreaming():
+            self.hdf5_handle = h5py.File(self.getFile(), 'r',
+                                         rdcc_nbytes=self.rdcc_nbytes,
+                                         rdcc_nslots=self.rdcc_nslots)
+            self.hdf5_data = self.hdf5_handle[self.getDataset()]
+            self.setArray(None)
+
+            return self
+
+        with h5py.File(self.getFile(), 'r') as f:
+            array = f[self.getDataset()][()]
+            array = Array(array, bounding_box=self.getBoundingBox(),
+                          iteration_size=self.getIterationSize(),
+                          stride=self.getStride())
+            self.setArray(array)
+
+        return self
 
     def __exit__(self, exc_type, exc_value, traceback):
+        if self.hdf5_handle is not None:
+            if self.mode == "w":
+                self.flush()
+            self.hdf5_handle.close()
+            self.hdf5_handle = None
+            self.hdf5_data = None
+
         self.setArray(None)
+
+    def __getitem__(self, idx):
+        return self.get(self._indexToBoundingBox(idx))
+
+    def _indexToBoundingBox(self, idx):
+        if idx >= len(self):
+            self.index = 0
+            raise StopIteration
+
+        return self.getGrid()[idx]
+
+
+class MemmapArray(Array):
+    """
+    An array backed by a memory-mapped Numpy file, so that volumes larger
+than memory can be read and written patch by patch. Created files are sparse,
+so only the pages that are written take up disk space. Writes go to the
+shared mapping immediately and are seen by every mapping of the file, and
+flushing only forces them to disk.
+    """
+    ADVICE = {"normal": "MADV_NORMAL", "sequential": "MADV_SEQUENTIAL",
+              "random": "MADV_RANDOM", "willneed": "MADV_WILLNEED",
+              "dontneed": "MADV_DONTNEED"}
+
+    def __init__(self, npy_file, bounding_box: BoundingBox=None,
+                 dtype=np.float32, mode: str=None,
+                 iteration_size: BoundingBox=BoundingBox(Vector(0, 0, 0),
+                                                         Vector(128, 128, 32)),
+                 stride: Vector=Vector(64, 64, 16)):
+        """
+        Creates a memory-mapped Numpy file or reopens an existing one
+
+        :param npy_file: The path of the Numpy file
+        :param bounding_box: The bounding box encompassing the volume, which
+is required to create a file. By default, an existing file's bounding box
+starts at the origin.
+        :param dtype: The dtype of a created file
+        :param mode: Either "w+" to create a file, "r+" to reopen a file for
+reading and writing, or "r" to reopen a file for reading. By default, an
+existing file is reopened with "r+" and otherwise a file is created.
+        :param iteration_size: The bounding box of each data sample in the
+dataset iterable
+        :param stride: The stride displacement of each data sample in the
+dataset iterable
+        """
+        if mode is None:
+            mode = "r+" if os.path.isfile(npy_file) else "w+"
+
+        if mode == "w+":
+            if bounding_box is None:
+                raise ValueError("bounding_box is required to create " +
+                                 "{}".format(npy_file))
+            # Write the header and size the file, which is then mapped below
+            created = np.lib.format.open_memmap(npy_file, mode="w+",
+                                                dtype=dtype,
+                                                shape=bounding_box.getNumpyDim())
+            del created
+        elif mode in ("r", "r+"):
+            if not os.path.isfile(npy_file):
+                raise IOError("{} was not found".format(npy_file))
+        else:
+            raise ValueError("mode must be either w+, r+ or r instead it " +
+                             "is {}".format(mode))
+
+        # The file is mapped by the array itself so that the mapping can be
+        # flushed and advised
+        with open(npy_file, "rb" if mode == "r" else "r+b") as f:
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, file_dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, file_dtype = np.lib.format.read_array_header_2_0(f)
+            self.offset = f.tell()
+            self.mapping = mmap.mmap(f.fileno(), 0,
+                                     access=(mmap.ACCESS_READ if mode == "r"
+                                             else mmap.ACCESS_WRITE))
+
+        array = np.ndarray(shape, dtype=file_dtype, buffer=self.mapping,
+                           offset=self.offset,
+                           order="F" if fortran_order else "C").view(np.memmap)
+        if bounding_box is not None and \
+           array.shape != bounding_box.getNumpyDim():
+            raise ValueError("bounding_box must have the shape " +
+                             "{} of {}".format(array.shape, npy_file))
+
+        self.npy_file = npy_file
+        super().__init__(array, bounding_box=bounding_box,
+                         iteration_size=iteration_size, stride=stride)
+
+    def getFile(self):
+        return self.npy_file
+
+    def flush(self):
+        """
+        Forces the changes in the mapping to be written to the Numpy file on
+disk
+        """
+        if self.getArray().flags.writeable:
+            self.mapping.flush()
+
+    def advise(self, advice: str="sequential", bounding_box: BoundingBox=None):
+        """
+        Advises the operating system how the file will be accessed, such as
+sequentially during prediction. The advice is ignored on platforms without
+madvise.
+
+        :param advice: Either "normal", "sequential", "random", "willneed"
+or "dontneed"
+        :param bounding_box: A bounding box to limit the advice to the
+Z-slices that it covers. By default, the advice applies to the whole file.
+        """
+        if advice not in self.ADVICE:
+            raise ValueError("advice must be one of {} ".format(tuple(self.ADVICE)) +
+                             "instead it is {}".format(advice))
+
+        option = getattr(mmap, self.ADVICE[advice], None)
+        if option is None or not hasattr(self.mapping, "madvise"):
+            return
+
+        # The array starts after the file's header
+        start = self.offset
+        length = self.getArray().nbytes
+        if bounding_box is not None:
+            slice_bytes = self.getArray()[0].nbytes
+            z1 = bounding_box.getEdges()[0][2] - self.getBoundingBox().getEdges()[0][2]
+            z2 = bounding_box.getEdges()[1][2] - self.getBoundingBox().getEdges()[0][2]
+            z1, z2 = max(z1, 0), min(z2, self.getArray().shape[0])
+            start, length = start + z1 * slice_bytes, (z2 - z1) * slice_bytes
+
+        aligned_start = start - start % mmap.PAGESIZE
+        length = length + start - aligned_start
+        if length > 0:
+            self.mapping.madvise(option, aligned_start, length)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+
+COMPRESSIONS = ("zlib", "lz4", "blosc")
+
+# The number of locks that the chunks of a chunked volume are spread over
+CHUNK_LOCKS = 64
+
+
+def _compress(buffer: bytes, compression: str, level: int,
+              itemsize: int) -> bytes:
+    """
+    Compresses a chunk with zlib, or with lz4 or blosc when they are installed
+    """
+    if compression == "zlib":
+        return zlib.compress(buffer, level)
+    elif compression == "lz4":
+        try:
+            import lz4.frame
+        except ImportError:
+            raise ValueError("lz4 compression requires the lz4 package")
+        return lz4.frame.compress(buffer, compression_level=level)
+    elif compression == "blosc":
+        try:
+            import blosc
+        except ImportError:
+            raise ValueError("blosc compression requires the blosc package")
+        return blosc.compress(buffer, typesize=itemsize, clevel=level)
+    else:
+        raise ValueError("compression must be one of {} ".format(COMPRESSIONS) +
+                         "instead it is {}".format(compression))
+
+
+def _decompress(buffer: bytes, compression: str) -> bytes:
+    """
+    Decompresses a chunk compressed by _compress
+    """
+    if compression == "zlib":
+        return zlib.decompress(buffer)
+    elif compression == "lz4":
+        import lz4.frame
+        return lz4.frame.decompress(buffer)
+    elif compression == "blosc":
+        import blosc
+        return blosc.decompress(buffer)
+    else:
+        raise ValueError("compression must be one of {} ".format(COMPRESSIONS) +
+                         "instead it is {}".format(compression))
+
+
+class ChunkedVolume(Volume):
+    """
+    A volume stored as a directory of compressed chunks with a fixed shape
+and a JSON header. Data samples are read and written by decoding only the
+chunks that they overlap, which makes random access to small patches cheap.
+    """
+    HEADER = "header.json"
+
+    def __init__(self, directory, bounding_box: BoundingBox=None,
+                 chunk_size: Vector=Vector(128, 128, 32), dtype=np.uint16,
+                 compression: str="zlib", level: int=1,
+                 cache_size: int=64, num_workers: int=4,
+                 iteration_size: BoundingBox=BoundingBox(Vector(0, 0, 0),
+                                                         Vector(128, 128, 32)),
+                 stride: Vector=Vector(64, 64, 16)):
+        """
+        Opens a chunked volume or creates it if its header does not exist
+
+        :param directory: The directory containing the chunks and the header
+        :param bounding_box: The bounding box encompassing the volume, which
+is required to create a volume
+        :param chunk_size: The size of each chunk of a created volume
+        :param dtype: The dtype of a created volume
+        :param compression: The compression of a created volume, either
+"zlib", "lz4" or "blosc"
+        :param level: The compression level of a created volume
+        :param cache_size: The number of decoded chunks to keep in memory
+        :param num_workers: The number of threads that decode and encode chunks
+        :param iteration_size: The bounding box of each data sample in the
+dataset iterable
+        :param stride: The stride displacement of each data sample in the
+dataset iterable
+        """
+        self.directory = directory
+        header_file = os.path.join(directory, self.HEADER)
+
+        if os.path.isfile(header_file):
+            with open(header_file) as f:
+                header = json.load(f)
+            stored_bounding_box = BoundingBox(Vector(*header["edge1"]),
+                                              Vector(*header["edge2"]))
+            if bounding_box is not None and bounding_box != stored_bounding_box:
+                raise ValueError("bounding_box must match the bounding box " +
+                                 "{} of {}".format(stored_bounding_box,
+                                                   directory))
+            bounding_box = stored_bounding_box
+            chunk_size = Vector(*header["chunk_size"])
+            dtype = header["dtype"]
+            compression = header["compression"]
+            level = header["level"]
+
+        else:
+            if bounding_box is None:
+                raise ValueError("bounding_box is required to create " +
+                                 "{}".format(directory))
+            if compression not in COMPRESSIONS:
+                raise ValueError("compression must be one of " +
+                                 "{} instead it is {}".format(COMPRESSIONS,
+                                                              compression))
+            # Fail before creating the volume if a codec is missing
+            _compress(b"", compression, level, 1)
+
+            os.makedirs(directory, exist_ok=True)
+            header = {"edge1": list(bounding_box.getEdges()[0]),
+                      "edge2": list(bounding_box.getEdges()[1]),
+                      "chunk_size": list(chunk_size),
+                      "dtype": np.dtype(dtype).str,
+                      "compression": compression,
+                      "level": level}
+            with open(header_file, "w") as f:
+                json.dump(header, f)
+
+        # Chunk files are given the permissions of the header
+        self.file_mode = os.stat(header_file).st_mode & 0o777
+        self.chunk_size = chunk_size
+        self.dtype = np.dtype(dtype)
+        self.compression = compression
+        self.level = level
+        self.num_workers = num_workers
+        self.executor = None
+        self.executor_lock = Lock()
+
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.cache_lock = Lock()
+        self.chunk_locks = [Lock() for i in range(CHUNK_LOCKS)]
+
+        super().__init__(bounding_box, iteration_size, stride)
+
+    def getDirectory(self):
+        return self.directory
+
+    def getChunkSize(self) -> Vector:
+        return self.chunk_size
+
+    def getDtype(self):
+        return self.dtype
+
+    def getResidentBytes(self) -> int:
+        with self.cache_lock:
+            return sum(chunk.nbytes for chunk in self.cache.values())
+
+    def _getExecutor(self) -> ThreadPoolExecutor:
+        with self.executor_lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.num_workers)
+
+            return self.executor
+
+    def _chunkBoundingBox(self, key: tuple) -> BoundingBox:
+        """
+        Returns the bounding box of a chunk, which is clipped to the volume
+
+        :param key: The chunk coordinates along X, Y and Z
+        """
+        edge1 = self.getBoundingBox().getEdges()[0] + self.chunk_size * Vector(*key)
+        edge2 = edge1 + self.chunk_size
+
+        return BoundingBox(edge1, edge2).intersect(self.getBoundingBox())
+
+    def _chunkKeys(self, bounding_box: BoundingBox) -> list:
+        """
+        Returns the coordinates of the chunks that overlap a bounding box
+        """
+        edge1, edge2 = (bounding_box - self.getBoundingBox().getEdges()[0]).getEdges()
+        ranges = [range(e1 // size, (e2 - 1) // size + 1)
+                  for e1, e2, size in zip(edge1, edge2, self.chunk_size)]
+
+        return [(x, y, z) for z, y, x in product(*ranges[::-1])]
+
+    def _chunkFile(self, key: tuple) -> str:
+        return os.path.join(self.directory, "{}_{}_{}".format(*key))
+
+    def _chunkLock(self, key: tuple) -> Lock:
+        """
+        Returns the lock that serializes writes to a chunk
+        """
+        return self.chunk_locks[hash(key) % len(self.chunk_locks)]
+
+    def _readChunk(self, key: tuple) -> np.ndarray:
+        """
+        Reads a chunk from the cache or decodes it from its file. Chunks that
+were never written are zero.
+        """
+        with self.cache_lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+
+        shape = self._chunkBoundingBox(key).getNumpyDim()
+        try:
+            with open(self._chunkFile(key), "rb") as f:
+                buffer = _decompress(f.read(), self.compression)
+            chunk = np.frombuffer(buffer, dtype=self.dtype).reshape(shape)
+        except FileNotFoundError:
+            chunk = np.zeros(shape, dtype=self.dtype)
+        chunk.flags.writeable = False
+
+        self._cacheChunk(key, chunk)
+
+        return chunk
+
+    def _writeChunk(self, key: tuple, chunk: np.ndarray):
+        """
+        Encodes a chunk and replaces its file
+        """
+        chunk = np.array(chunk, dtype=self.dtype, copy=True)
+        buffer = _compress(chunk.tobytes(), self.compression, self.level,
+                           self.dtype.itemsize)
+
+        # Write to a temporary file first so readers never see partial chunks
+        descriptor, temporary_file = tempfile.mkstemp(suffix=".tmp",
+                                                      dir=self.directory)
+        try:
+            with os.fdopen(descriptor, "wb") as f:
+                f.write(buffer)
+            os.chmod(temporary_file, self.file_mode)
+            os.replace(temporary_file, self._chunkFile(key))
+        except BaseException:
+            os.remove(temporary_file)
+            raise
+
+        chunk.flags.writeable = False
+        self._cacheChunk(key, chunk)
+
+    def _cacheChunk(self, key: tuple, chunk: np.ndarray):
+        with self.cache_lock:
+            self.cache[key] = chunk
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def _map(self, function, keys: list) -> list:
+        if len(keys) > 1 and self.num_workers > 1:
+            return list(self._getExecutor().map(function, keys))
+
+        return [function(key) for key in keys]
+
+    def get(self, bounding_box: BoundingBox) -> Data:
+        """
+        Requests a data sample from the volume. If the bounding box does
+not exist, then the method raises a ValueError.
+
+        :param bounding_box: The bounding box of the request data sample
+        :return: The data sample requested
+        """
+        array = np.empty(bounding_box.getNumpyDim(), dtype=self.dtype)
+
+        return self.getInto(bounding_box, array)
+
+    def getInto(self, bounding_box: BoundingBox, out: np.ndarray,
+                mode: str="constant") -> Data:
+        """
+        Reads a data sample from the volume into a preallocated array,
+decoding the chunks that it overlaps in parallel
+
+        :param bounding_box: The bounding box of the request data sample
+        :param out: An array with the shape of the bounding box in Numpy order
+        :param mode: The padding mode for the parts of the bounding box
+outside of the volume, either "constant", "reflect" or "edge"
+        :return: The data sample requested, which is backed by the given array
+        """
+        if out.shape != bounding_box.getNumpyDim():
+            raise ValueError("out must have shape {} ".format(bounding_box.getNumpyDim()) +
+                             "instead it has shape {}".format(out.shape))
+
+        if bounding_box.isDisjoint(self.getBoundingBox()):
+            raise ValueError("Bounding box must be inside dataset " +
+                             "dimensions instead bounding box is " +
+                             "{} while the dataset dimensions are {}".format(bounding_box,
+                                                                             self.getBoundingBox()))
+
+        sub_bounding_box = bounding_box.intersect(self.getBoundingBox())
+        keys = self._chunkKeys(sub_bounding_box)
+        chunks = self._map(self._readChunk, keys)
+
+        edge1 = bounding_box.getEdges()[0]
+        for key, chunk in zip(keys, chunks):
+            chunk_bounding_box = self._chunkBoundingBox(key)
+            overlap = chunk_bounding_box.intersect(sub_bounding_box)
+
+            x1, y1, z1 = (overlap.getEdges()[0] - edge1).getComponents()
+            x2, y2, z2 = (overlap.getEdges()[1] - edge1).getComponents()
+            cx1, cy1, cz1 = (overlap.getEdges()[0] -
+                             chunk_bounding_box.getEdges()[0]).getComponents()
+            cx2, cy2, cz2 = (overlap.getEdges()[1] -
+                             chunk_bounding_box.getEdges()[0]).getComponents()
+            out[z1:z2, y1:y2, x1:x2] = chunk[cz1:cz2, cy1:cy2, cx1:cx2]
+
+        if sub_bounding_box != bounding_box:
+            x1, y1, z1 = (sub_bounding_box.getEdges()[0] - edge1).getComponents()
+            x2, y2, z2 = (sub_bounding_box.getEdges()[1] - edge1).getComponents()
+            _padInPlace(out, (z1, y1, x1), (z2, y2, x2), mode=mode)
+
+        return Data(out, bounding_box)
+
+    def _write(self, data: Data, blend: bool):
+        """
+        Writes a data sample into the chunks that it overlaps. Chunks that
+are partly covered or blended are read, updated and rewritten while holding
+the chunk's lock, so concurrent writes to a chunk are not lost.
+        """
+        data_bounding_box = data.getBoundingBox()
+        if not data_bounding_box.isSubset(self.getBoundingBox()):
+            raise ValueError("The bounding box must be a subset of the " +
+                             "volume")
+
+        edge1 = data_bounding_box.getEdges()[0]
+
+        def writeChunk(key):
+            chunk_bounding_box = self._chunkBoundingBox(key)
+            overlap = chunk_bounding_box.intersect(data_bounding_box)
+
+            x1, y1, z1 = (overlap.getEdges()[0] - edge1).getComponents()
+            x2, y2, z2 = (overlap.getEdges()[1] - edge1).getComponents()
+            values = data.getArray()[z1:z2, y1:y2, x1:x2]
+
+            with self._chunkLock(key):
+                if overlap == chunk_bounding_box and not blend:
+                    self._writeChunk(key, values)
+                    return
+
+                chunk = self._readChunk(key).copy()
+                cx1, cy1, cz1 = (overlap.getEdges()[0] -
+                                 chunk_bounding_box.getEdges()[0]).getComponents()
+                cx2, cy2, cz2 = (overlap.getEdges()[1] -
+                                 chunk_bounding_box.getEdges()[0]).getComponents()
+                target = chunk[cz1:cz2, cy1:cy2, cx1:cx2]
+                if blend:
+                    np.maximum(target, values, out=target, casting="unsafe")
+                else:
+                    target[...] = values
+                self._writeChunk(key, chunk)
+
+        self._map(writeChunk, self._chunkKeys(data_bounding_box))
+
+    def set(self, data: Data):
+        """
+        Sets a section of the volume within the provided bounding box with the
+given data. Chunks that are partly covered are read, updated and rewritten.
+
+        :param data: The data packet to set the volume
+        """
+        self._write(data, blend=False)
+
+    def blend(self, data: Data):
+        """
+        Blends a section of the volume within the provided bounding box with
+the given data by taking the elementwise maximum value.
+
+        :param data: The data packet to blend into the volume
+        """
+        self._write(data, blend=True)
+
+    def __getitem__(self, idx):
+        return self.get(self._indexToBoundingBox(idx))
+
+    def _indexToBoundingBox(self, idx):
+        if idx >= len(self):
+            self.index = 0
+            raise StopIteration
+
+        return self.getGrid()[idx]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        with self.executor_lock:
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
+
+        with self.cache_lock:
+            self.cache.clear()
@@ -0,0 +1,159 @@
+from neurotorch.datasets.dataset import Volume, Array, Data
+from neurotorch.loss.SimplePointWeighting import nonsimple_labeled_points
+from scipy.ndimage import label
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import json
+import os.path
+
+
+class NonSimplePointCache(Volume):
+    """
+    A memory-mapped sidecar volume holding the non-simple points of a label
+volume in the label volume's coordinates. Any bounding box of the label
+volume can be requested, so the cache can be aligned with its label volume in
+an AlignedVolume to feed SimplePointBCEWithLogitsLoss without recomputing the
+label weights.
+    """
+    def __init__(self, label_volume, filename=None, threshold=0.5):
+        """
+        Opens the cache of a label volume. The cache must be built before its
+patches can be requested.
+
+        :param label_volume: The label volume whose non-simple points are
+cached
+        :param filename: The base filename of the sidecar files. By default,
+the files are placed next to the label volume's file.
+        :param threshold: The threshold to binarize the labels, which must
+match the threshold of the loss
+        """
+        self.setLabelVolume(label_volume)
+        if filename is None:
+            filename = label_volume.getFile() + ".nonsimple"
+        self.setFile(filename)
+        self.threshold = threshold
+
+        super().__init__(label_volume.getBoundingBox(),
+                         label_volume.getIterationSize(),
+                         label_volume.getStride())
+        self.array = None
+
+    def setLabelVolume(self, label_volume):
+        self.label_volume = label_volume
+
+    def getLabelVolume(self):
+        return self.label_volume
+
+    def setFile(self, filename):
+        self.filename = filename
+
+    def getFile(self):
+        return self.filename
+
+    def _getArrayFile(self):
+        return self.getFile() + ".npy"
+
+    def _getHeaderFile(self):
+        return self.getFile() + ".json"
+
+    def _getHeader(self) -> dict:
+        edge1, edge2 = self.getBoundingBox().getEdges()
+        return {"threshold": self.threshold,
+                "edge1": list(edge1.getComponents()),
+                "edge2": list(edge2.getComponents())}
+
+    def isBuilt(self) -> bool:
+        """
+        Determines whether the sidecar files match the label volume's
+bounding box and the threshold
+
+        :return: True if the cache is built, false otherwise
+        """
+        if not os.path.isfile(self._getHeaderFile()):
+            return False
+
+        with open(self._getHeaderFile(), 'r') as f:
+            header = json.load(f)
+
+        return header == self._getHeader()
+
+    def build(self, num_workers=4, block_size=16):
+        """
+        Computes the non-simple points of the label volume and writes them to
+the sidecar files. The connected components of the binarized labels are
+labeled over the whole volume, which is read into memory once, and the
+non-simple points are then found in slabs by a pool of worker threads. The
+label volume must be open.
+
+        :param num_workers: The number of worker threads
+        :param block_size: The number of Z slices in each slab
+        """
+        bounding_box = self.getBoundingBox()
+        labels = self.getLabelVolume().get(bounding_box).getArray()
+        structure = np.array([[[0, 0, 0], [0, 1, 0], [0, 0, 0]],
+                              [[0, 1, 0], [1, 1, 1], [0, 1, 0]],
+                              [[0, 0, 0], [0, 1, 0], [0, 0, 0]]])
+        labeled_array, num_features = label(labels > self.threshold,
+                                            structure=structure)
+        del labels
+
+        array = np.lib.format.open_memmap(self._getArrayFile(), mode='w+',
+                                          dtype=np.uint8,
+                                          shape=labeled_array.shape)
+        depth = labeled_array.shape[0]
+
+        def build_slab(z1):
+            # Slabs see the slices next to them, and the faces of the volume
+            # are padded with their own labels
+            z2 = min(z1 + block_size, depth)
+            slab = labeled_array[max(z1 - 1, 0):min(z2 + 1, depth)]
+            slab = np.pad(slab, ((int(z1 == 0), int(z2 == depth)), (1, 1),
+                                 (1, 1)), 'edge')
+            array[z1:z2] = nonsimple_labeled_points(slab)
+
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            list(executor.map(build_slab, range(0, depth, block_size)))
+
+        array.flush()
+        del array
+
+        # The header is written last so that partial builds are not reused
+        with open(self._getHeaderFile(), 'w') as f:
+            json.dump(self._getHeader(), f)
+
+    def get(self, bounding_box) -> Data:
+        """
+        Requests the non-simple points within a bounding box of the label
+volume
+
+        :param bounding_box: The bounding box of the request data sample
+        :return: The non-simple points within the bounding box
+        """
+        return self.getArray().get(bounding_box)
+
+    def set(self, data):
+        raise ValueError("non-simple point caches are read-only")
+
+    def __getitem__(self, idx):
+        bounding_box = self._indexToBoundingBox(idx)
+        return self.get(bounding_box)
+
+    def _indexToBoundingBox(self, idx):
+        return self.getLabelVolume()._indexToBoundingBox(idx)
+
+    def __len__(self):
+        return len(self.getLabelVolume())
+
+    def __enter__(self):
+        if not self.isBuilt():
+            raise IOError("{} has not been built".format(self.getFile()))
+
+        array = np.load(self._getArrayFile(), mmap_mode='r')
+        self.setArray(Array(array, bounding_box=self.getBoundingBox(),
+                            iteration_size=self.getIterationSize(),
+                            stride=self.getStride()))
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.setArray(None)
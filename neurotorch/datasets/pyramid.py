@@ -0,0 +1,322 @@
+from neurotorch.datasets.dataset import Volume, Data
+from neurotorch.datasets.datatypes import BoundingBox, Vector
+from neurotorch.datasets.filetypes import ChunkedVolume
+from concurrent.futures import ThreadPoolExecutor
+from itertools import product
+import json
+import os.path
+import numpy as np
+
+METHODS = ("mean", "max", "mode")
+
+
+def downsample(array: np.ndarray, factor: tuple,
+               method: str="mean") -> np.ndarray:
+    """
+    Downsamples an array by reducing each block of voxels to a single voxel
+
+    :param array: An array whose shape is a multiple of the factor
+    :param factor: The downsampling factor along each axis in Numpy order
+    :param method: Either "mean" for raw images, or "max" or "mode" for labels
+    :return: The downsampled array with the dtype of the given array
+    """
+    if method not in METHODS:
+        raise ValueError("method must be one of {} ".format(METHODS) +
+                         "instead it is {}".format(method))
+
+    shape = [length // f for length, f in zip(array.shape, factor)]
+    blocks = array.reshape(shape[0], factor[0], shape[1], factor[1],
+                           shape[2], factor[2])
+    blocks = blocks.transpose(0, 2, 4, 1, 3, 5).reshape(*shape, -1)
+
+    if method == "mean":
+        result = blocks.mean(axis=-1, dtype=np.float64)
+        if np.issubdtype(array.dtype, np.integer):
+            result = np.rint(result)
+        return result.astype(array.dtype)
+
+    elif method == "max":
+        return blocks.max(axis=-1)
+
+    else:
+        # Count the occurrences of each value within its block, breaking ties
+        # toward the smallest value
+        blocks = np.sort(blocks, axis=-1)
+        counts = np.stack([(blocks == blocks[..., i:i+1]).sum(axis=-1)
+                           for i in range(blocks.shape[-1])], axis=-1)
+        indexes = counts.argmax(axis=-1)[..., np.newaxis]
+        return np.take_along_axis(blocks, indexes, axis=-1)[..., 0]
+
+
+def scaleBoundingBox(bounding_box: BoundingBox, factor: Vector,
+                     level: int) -> BoundingBox:
+    """
+    Converts a bounding box to the coordinates of a pyramid level, rounding
+outward so that the scaled bounding box covers the original one
+
+    :param bounding_box: A bounding box in full resolution coordinates
+    :param factor: The downsampling factor between consecutive levels
+    :param level: The pyramid level
+    :return: The bounding box in the coordinates of the pyramid level
+    """
+    scale = [f ** level for f in factor]
+    edge1, edge2 = bounding_box.getEdges()
+    edge1 = Vector(*[e // s for e, s in zip(edge1, scale)])
+    edge2 = Vector(*[-(-e // s) for e, s in zip(edge2, scale)])
+
+    return BoundingBox(edge1, edge2)
+
+
+def _wholeIteration(bounding_box: BoundingBox) -> dict:
+    """
+    Returns iteration parameters with a single data sample spanning the
+bounding box, which avoids building a patch grid for each pyramid level
+    """
+    return {"iteration_size": BoundingBox(Vector(0, 0, 0),
+                                          bounding_box.getSize()),
+            "stride": bounding_box.getSize()}
+
+
+class PyramidBuilder:
+    """
+    Builds a multi-resolution pyramid of a volume by streaming it block by
+block. Each level is downsampled from the previous one and stored as a
+ChunkedVolume.
+    """
+    HEADER = "pyramid.json"
+
+    def __init__(self, volume: Volume, directory, levels: int=4,
+                 method: str="mean", factor: Vector=Vector(2, 2, 2),
+                 chunk_size: Vector=Vector(128, 128, 32),
+                 block_size: Vector=Vector(256, 256, 64),
+                 num_workers: int=4):
+        """
+        Sets up the parameters for building a pyramid
+
+        :param volume: The full resolution volume, which must already be
+opened. Any volume implementing getInto that can be read from several threads
+at once is supported, including a PooledVolume. The volumes of this package
+guard their own state.
+        :param directory: The directory to store the pyramid levels in
+        :param levels: The number of downsampled levels
+        :param method: The downsampling method, either "mean" for raw images,
+or "max" or "mode" for labels
+        :param factor: The downsampling factor between consecutive levels
+        :param chunk_size: The chunk size of each level
+        :param block_size: The size of the blocks that each level is written
+in, which must be a multiple of the chunk size
+        :param num_workers: The number of blocks to read and downsample in
+parallel
+        """
+        if method not in METHODS:
+            raise ValueError("method must be one of {} ".format(METHODS) +
+                             "instead it is {}".format(method))
+        if any(b % c != 0 for b, c in zip(block_size, chunk_size)):
+            raise ValueError("block_size must be a multiple of chunk_size")
+
+        self.volume = volume
+        self.directory = directory
+        self.levels = levels
+        self.method = method
+        self.factor = factor
+        self.chunk_size = chunk_size
+        self.block_size = block_size
+        self.num_workers = num_workers
+
+    def _blocks(self, bounding_box: BoundingBox) -> list:
+        """
+        Splits a bounding box into blocks aligned to the block size
+        """
+        edge1, edge2 = bounding_box.getEdges()
+        ranges = [range(e1, e2, size) for e1, e2, size
+                  in zip(edge1, edge2, self.block_size)]
+
+        return [BoundingBox(Vector(x, y, z),
+                            Vector(x, y, z) + self.block_size).intersect(bounding_box)
+                for z, y, x in product(*ranges[::-1])]
+
+    def build(self, iteration_size: BoundingBox=BoundingBox(Vector(0, 0, 0),
+                                                            Vector(128, 128, 32)),
+              stride: Vector=Vector(64, 64, 16)):
+        """
+        Builds every level of the pyramid
+
+        :param iteration_size: The bounding box of each data sample in the
+iterable of the returned pyramid
+        :param stride: The stride displacement of each data sample in the
+iterable of the returned pyramid
+        :return: A PyramidVolume of the built levels
+        """
+        bounding_box = self.volume.getBoundingBox()
+        probe = BoundingBox(bounding_box.getEdges()[0],
+                            bounding_box.getEdges()[0] + Vector(1, 1, 1))
+        dtype = self.volume.get(probe).getArray().dtype
+
+        os.makedirs(self.directory, exist_ok=True)
+        source = self.volume
+        factor = self.factor.getNumpyDim()
+
+        with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+            for level in range(1, self.levels + 1):
+                level_bounding_box = scaleBoundingBox(bounding_box,
+                                                      self.factor, level)
+                level_volume = ChunkedVolume(os.path.join(self.directory,
+                                                          str(level)),
+                                             level_bounding_box,
+                                             chunk_size=self.chunk_size,
+                                             dtype=dtype,
+                                             num_workers=1,
+                                             **_wholeIteration(level_bounding_box))
+
+                def buildBlock(block, source=source, level_volume=level_volume):
+                    edge1, edge2 = block.getEdges()
+                    source_bounding_box = BoundingBox(edge1 * self.factor,
+                                                      edge2 * self.factor)
+
+                    # Edge padding keeps the borders from darkening
+                    array = np.empty(source_bounding_box.getNumpyDim(),
+                                     dtype=dtype)
+                    source.getInto(source_bounding_box, array, mode="edge")
+
+                    level_volume.set(Data(downsample(array, factor,
+                                                     self.method), block))
+
+                list(executor.map(buildBlock,
+                                  self._blocks(level_bounding_box)))
+
+                if source is not self.volume:
+                    source.__exit__(None, None, None)
+                source = level_volume
+
+        if source is not self.volume:
+            source.__exit__(None, None, None)
+
+        with open(os.path.join(self.directory, self.HEADER), "w") as f:
+            json.dump({"levels": self.levels,
+                       "method": self.method,
+                       "factor": list(self.factor)}, f)
+
+        return PyramidVolume(self.volume, self.directory,
+                             iteration_size=iteration_size, stride=stride)
+
+
+class PyramidVolume(Volume):
+    """
+    A volume with downsampled levels built by a PyramidBuilder. Level 0 is
+the full resolution volume and level k is downsampled by factor ** k.
+    """
+    def __init__(self, volume: Volume, directory,
+                 iteration_size: BoundingBox=BoundingBox(Vector(0, 0, 0),
+                                                         Vector(128, 128, 32)),
+                 stride: Vector=Vector(64, 64, 16)):
+        """
+        Opens the levels of a built pyramid
+
+        :param volume: The full resolution volume
+        :param directory: The directory of the pyramid levels
+        :param iteration_size: The bounding box of each data sample of the
+full resolution volume in the dataset iterable
+        :param stride: The stride displacement of each data sample in the
+dataset iterable
+        """
+        header_file = os.path.join(directory, PyramidBuilder.HEADER)
+        if not os.path.isfile(header_file):
+            raise IOError("{} was not found".format(header_file))
+
+        with open(header_file) as f:
+            header = json.load(f)
+
+        self.factor = Vector(*header["factor"])
+        self.method = header["method"]
+        self.directory = directory
+        self.levels = [volume]
+        for level in range(1, header["levels"] + 1):
+            level_bounding_box = scaleBoundingBox(volume.getBoundingBox(),
+                                                  self.factor, level)
+            self.levels.append(ChunkedVolume(os.path.join(directory, str(level)),
+                                             level_bounding_box,
+                                             **_wholeIteration(level_bounding_box)))
+
+        super().__init__(volume.getBoundingBox(), iteration_size, stride)
+
+    def getFactor(self) -> Vector:
+        return self.factor
+
+    def getDtype(self):
+        return self.levels[0].getDtype()
+
+    def getResidentBytes(self) -> int:
+        return sum(level.getResidentBytes() for level in self.levels)
+
+    def getLevelCount(self) -> int:
+        """
+        Returns the number of levels including the full resolution volume
+        """
+        return len(self.levels)
+
+    def getLevel(self, level: int) -> Volume:
+        """
+        Returns the volume of a pyramid level
+
+        :param level: The pyramid level
+        """
+        if not 0 <= level < len(self.levels):
+            raise ValueError("level must be between 0 and " +
+                             "{} instead it is {}".format(len(self.levels) - 1,
+                                                          level))
+
+        return self.levels[level]
+
+    def scaleBoundingBox(self, bounding_box: BoundingBox,
+                         level: int) -> BoundingBox:
+        """
+        Converts a full resolution bounding box to the coordinates of a level
+
+        :param bounding_box: A bounding box in full resolution coordinates
+        :param level: The pyramid level
+        :return: The bounding box in the coordinates of the level
+        """
+        return scaleBoundingBox(bounding_box, self.factor, level)
+
+    def get(self, bounding_box: BoundingBox, level: int=0) -> Data:
+        """
+        Requests a data sample from a pyramid level
+
+        :param bounding_box: The bounding box of the request data sample in
+the coordinates of the level
+        :param level: The pyramid level
+        :return: The data sample requested
+        """
+        return self.getLevel(level).get(bounding_box)
+
+    def getInto(self, bounding_box: BoundingBox, out: np.ndarray,
+                mode: str="constant", level: int=0) -> Data:
+        """
+        Reads a data sample from a pyramid level into a preallocated array
+
+        :param bounding_box: The bounding box of the request data sample in
+the coordinates of the level
+        :param out: An array with the shape of the bounding box in Numpy order
+        :param mode: The padding mode for the parts of the bounding box
+outside of the volume
+        :param level: The pyramid level
+        :return: The data sample requested, which is backed by the given array
+        """
+        return self.getLevel(level).getInto(bounding_box, out, mode=mode)
+
+    def __getitem__(self, idx):
+        return self.get(self._indexToBoundingBox(idx))
+
+    def _indexToBoundingBox(self, idx):
+        if idx >= len(self):
+            self.index = 0
+            raise StopIteration
+
+        return self.getGrid()[idx]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for level in self.levels[1:]:
+            level.__exit__(exc_type, exc_value, traceback)
@@ -0,0 +1,156 @@
+from torch.utils.data import Sampler
+from neurotorch.datasets.dataset import (AlignedVolume, PooledVolume,
+                                         TorchVolume)
+import numpy as np
+
+
+class TileSampler(Sampler):
+    """
+    Samples the data samples of a tiled volume in an order that keeps few
+tiles open at a time. The order of the tiles, or of groups of adjacent
+tiles, is shuffled first, and then the data samples within each window of
+consecutive tiles are shuffled together. A larger window makes the order more
+random, while a smaller window makes the cache of open tiles hit more often.
+Tiles are grouped along a Z-order curve through their positions, so the tiles
+of a group are close together whatever order they were added in.
+    """
+    def __init__(self, volume, indexes=None, window_size: int=2,
+                 group_size: int=1, shuffle: bool=True, random_state=None):
+        """
+        Initializes a tile sampler
+
+        :param volume: A volume whose patch grid has one segment per tile,
+such as a pooled volume or an aligned volume of pooled volumes
+        :param indexes: The indexes of the data samples to sample. By
+default, every data sample is sampled.
+        :param window_size: The number of tile groups whose data samples are
+shuffled together, or None to shuffle every data sample together
+        :param group_size: The number of adjacent tiles in each tile group
+        :param shuffle: Whether to shuffle the order, or else to visit the
+tiles and their data samples in index order
+        :param random_state: A Numpy random state or a seed. By default, the
+global Numpy random state is used.
+        """
+        if isinstance(volume, TorchVolume):
+            volume = volume.getVolume()
+        self.volume = volume
+
+        if window_size is not None and window_size < 1:
+            raise ValueError("window_size must be positive " +
+                             "instead it is {}".format(window_size))
+        if group_size < 1:
+            raise ValueError("group_size must be positive " +
+                             "instead it is {}".format(group_size))
+
+        self.window_size = window_size
+        self.group_size = group_size
+        self.shuffle = shuffle
+
+        if random_state is None:
+            self.random_state = np.random
+        elif isinstance(random_state, np.random.RandomState):
+            self.random_state = random_state
+        else:
+            self.random_state = np.random.RandomState(random_state)
+
+        self.setIndexes(indexes)
+
+    def setIndexes(self, indexes=None):
+        """
+        Sets the data samples to sample
+
+        :param indexes: The indexes of the data samples. By default, every
+data sample is sampled.
+        """
+        if indexes is None:
+            indexes = np.arange(len(self.volume))
+
+        self.indexes = np.asarray(indexes, dtype=np.int64).ravel()
+        segments = self.volume.getGrid().getSegment(self.indexes)
+        self.groups = self._tileGroups()[segments]
+
+    def _tileGroups(self) -> np.ndarray:
+        """
+        Numbers the group of each tile. The tiles are ordered along a Z-order
+curve through the positions of their first patches, and each run of
+group_size tiles along the curve is a group.
+        """
+        grid = self.volume.getGrid()
+        tile_count = grid.getSegmentCount()
+        if self.group_size == 1:
+            return np.arange(tile_count)
+
+        # Tiles without patches are placed last
+        positions = np.full((tile_count, 3), np.iinfo(np.int64).max)
+        segments = grid.getSegment(np.arange(len(grid)))
+        np.minimum.at(positions, segments, grid.getOrigins())
+
+        # Interleave the bits of the ranks of the positions along each axis
+        ranks = np.stack([np.unique(positions[:, axis], return_inverse=True)[1]
+                          for axis in range(3)], axis=1).astype(np.int64)
+        codes = np.zeros(tile_count, dtype=np.int64)
+        for bit in reversed(range(max(int(ranks.max()).bit_length(), 1))):
+            for axis in (2, 1, 0):
+                codes = (codes << 1) | ((ranks[:, axis] >> bit) & 1)
+        order = np.argsort(codes, kind="stable")
+
+        groups = np.empty(tile_count, dtype=np.int64)
+        groups[order] = np.arange(tile_count) // self.group_size
+
+        return groups
+
+    def getOrder(self) -> np.ndarray:
+        """
+        Draws the order of the data samples for an epoch
+
+        :return: An array of data sample indexes
+        """
+        groups, ranks = np.unique(self.groups, return_inverse=True)
+
+        if not self.shuffle:
+            return self.indexes[np.lexsort((self.indexes, ranks))]
+
+        # Rank the tile groups in a random order and split them into windows
+        group_order = self.random_state.permutation(len(groups))
+        windows = np.empty(len(groups), dtype=np.int64)
+        window_size = (self.window_size if self.window_size is not None
+                       else max(len(groups), 1))
+        windows[group_order] = np.arange(len(groups)) // window_size
+
+        keys = self.random_state.permutation(len(self.indexes))
+
+        return self.indexes[np.lexsort((keys, windows[ranks]))]
+
+    def getBatches(self, batch_size: int) -> np.ndarray:
+        """
+        Draws the order of the data samples for an epoch and splits it into
+batches, leaving out the remaining data samples
+
+        :param batch_size: The number of data samples in each batch
+        :return: An array of data sample indexes with shape (-1, batch_size)
+        """
+        order = self._plan(self.getOrder())
+        order = order[:len(order) - len(order) % batch_size]
+
+        return order.reshape((-1, batch_size))
+
+    def _plan(self, order: np.ndarray) -> np.ndarray:
+        """
+        Passes the order on to the pooled volumes that open tiles ahead of it
+        """
+        if isinstance(self.volume, AlignedVolume):
+            volumes = self.volume.getVolumes()
+        else:
+            volumes = [self.volume]
+
+        for volume in volumes:
+            if isinstance(volume, PooledVolume) and volume.lookahead > 0:
+                volume.setLookahead(volume.lookahead, order)
+
+        return order
+
+    def __iter__(self):
+        return iter(self._plan(self.getOrder()).tolist())
+
+    def __len__(self) -> int:
+        return len(self.indexes)
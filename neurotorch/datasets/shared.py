@@ -0,0 +1,327 @@
+from neurotorch.datasets.dataset import Array
+from neurotorch.datasets.datatypes import BoundingBox, Vector
+from multiprocessing import resource_tracker, shared_memory
+from threading import Lock
+import json
+import os
+import secrets
+import time
+import numpy as np
+
+# The segment header holds a ready flag and a JSON description of the array,
+# and the data starts on the next page
+HEADER_SIZE = 4096
+SHARED_MEMORY_DIRECTORY = "/dev/shm"
+
+
+def _openSegment(name: str, create: bool=False,
+                 size: int=0) -> shared_memory.SharedMemory:
+    """
+    Opens a named shared memory segment. Attached segments are not tracked,
+so that a process that exits does not remove a segment that other processes
+use.
+    """
+    if create:
+        return shared_memory.SharedMemory(name=name, create=True, size=size)
+
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Before Python 3.13, attaching registers the segment with the
+        # process's resource tracker, which removes it when the process exits
+        segment = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(segment._name, "shared_memory")
+        return segment
+
+
+def _unlinkSegment(segment: shared_memory.SharedMemory):
+    """
+    Removes a shared memory segment. A tracked segment is registered again
+first, since unlinking unregisters it and an attaching process that shares
+the resource tracker may already have unregistered it.
+    """
+    if getattr(segment, "_track", True):
+        resource_tracker.register(segment._name, "shared_memory")
+    segment.unlink()
+
+
+class SharedArray(Array):
+    """
+    An array stored in a named shared memory segment. Other processes attach
+to the segment by its name and map the same memory without copying it, and
+pickling a shared array sends only its name.
+    """
+    def __init__(self, array: np.ndarray=None, bounding_box: BoundingBox=None,
+                 name: str=None,
+                 iteration_size: BoundingBox=BoundingBox(Vector(0, 0, 0),
+                                                         Vector(128, 128, 32)),
+                 stride: Vector=Vector(64, 64, 16), timeout: float=60.0):
+        """
+        Copies an array into a new shared memory segment or attaches to an
+existing segment
+
+        :param array: A 3D Numpy array to copy into a new segment, or None to
+attach to the segment with the given name
+        :param bounding_box: The bounding box encompassing the volume of a
+new segment. Attached segments store their bounding box.
+        :param name: The name of the segment. By default, a new segment is
+given a unique name.
+        :param iteration_size: The bounding box of each data sample in the
+dataset iterable
+        :param stride: The stride displacement of each data sample in the
+dataset iterable
+        :param timeout: The number of seconds to wait for another process to
+finish writing an attached segment
+        """
+        if array is None and name is None:
+            raise ValueError("either array or name must be given")
+
+        if array is not None:
+            array = np.ascontiguousarray(array)
+            if bounding_box is None:
+                bounding_box = BoundingBox(Vector(0, 0, 0),
+                                           Vector(*array.shape[::-1]))
+
+            self.segment = _openSegment(name, create=True,
+                                        size=HEADER_SIZE + max(array.nbytes, 1))
+            header = json.dumps({"shape": array.shape,
+                                 "dtype": array.dtype.str,
+                                 "edge1": list(bounding_box.getEdges()[0]),
+                                 "edge2": list(bounding_box.getEdges()[1])})
+            self.segment.buf[1:1 + len(header)] = header.encode()
+
+            shared = self._view(array.shape, array.dtype)
+            shared[...] = array
+
+            # Other processes may read the segment once it is marked ready
+            self.segment.buf[0] = 1
+            self.owner = True
+
+        else:
+            deadline = time.monotonic() + timeout
+            while True:
+                try:
+                    self.segment = _openSegment(name)
+                    break
+                except ValueError:
+                    # The creating process has not sized the segment yet
+                    if time.monotonic() > deadline:
+                        raise IOError("shared memory segment " +
+                                      "{} was not written".format(name))
+                    time.sleep(0.001)
+
+            while self.segment.buf[0] != 1:
+                if time.monotonic() > deadline:
+                    self.segment.close()
+                    raise IOError("shared memory segment " +
+                                  "{} was not written".format(name))
+                time.sleep(0.001)
+
+            header = bytes(self.segment.buf[1:HEADER_SIZE]).rstrip(b"\0")
+            header = json.loads(header.decode())
+            bounding_box = BoundingBox(Vector(*header["edge1"]),
+                                       Vector(*header["edge2"]))
+            shared = self._view(tuple(header["shape"]),
+                                np.dtype(header["dtype"]))
+            self.owner = False
+
+        super().__init__(shared, bounding_box=bounding_box,
+                         iteration_size=iteration_size, stride=stride)
+
+    def _view(self, shape: tuple, dtype) -> np.ndarray:
+        return np.ndarray(shape, dtype=dtype, buffer=self.segment.buf,
+                          offset=HEADER_SIZE)
+
+    def getName(self) -> str:
+        return self.segment.name.lstrip("/")
+
+    def isOwner(self) -> bool:
+        return self.owner
+
+    def getResidentBytes(self) -> int:
+        """
+        Estimates the shared memory mapped by the array, which stays
+allocated while the array is mapped
+
+        :return: The number of bytes of the array, or zero once it is closed
+        """
+        if self.getArray() is None:
+            return 0
+
+        return self.getArray().nbytes
+
+    def close(self):
+        """
+        Unmaps the segment from the process. Data samples that still
+reference the segment keep it mapped until they are garbage collected.
+        """
+        self._setArray(None)
+        try:
+            self.segment.close()
+        except BufferError:
+            pass
+
+    def unlink(self):
+        """
+        Removes the segment once every process has unmapped it. Processes
+that are attached can keep using it.
+        """
+        _unlinkSegment(self.segment)
+
+    def __reduce__(self):
+        return (SharedArray, (None, None, self.getName(),
+                              self.getIterationSize(), self.getStride()))
+
+
+class SharedMemoryPool:
+    """
+    Shares decoded arrays between processes through named shared memory
+segments, so that the worker processes of a data loader map the same decoded
+tiles instead of each decoding its own copy. The first process that shares
+an array copies it into a segment and the other processes attach to the
+segment by its name. A pool is pickled by its name prefix, and the process
+that created the pool removes every segment of the pool when it is closed.
+    """
+    def __init__(self, prefix: str=None):
+        """
+        Initializes a shared memory pool
+
+        :param prefix: The prefix of the names of the pool's segments. By
+default, the prefix is unique to the pool.
+        """
+        if prefix is None:
+            prefix = "neurotorch_{}_{}_".format(os.getpid(),
+                                                 secrets.token_hex(4))
+
+        self.prefix = prefix
+        self.owner_pid = os.getpid()
+        self.arrays = {}
+        self.lock = Lock()
+
+    def getName(self, key) -> str:
+        return "{}{}".format(self.prefix, key)
+
+    def attach(self, key, iteration_size: BoundingBox, stride: Vector):
+        """
+        Attaches to the shared array of a key if any process has shared it
+
+        :param key: The key of the array, such as the index of a pooled volume
+        :param iteration_size: The bounding box of each data sample in the
+dataset iterable
+        :param stride: The stride displacement of each data sample in the
+dataset iterable
+        :return: The shared array or None if it has not been shared
+        """
+        with self.lock:
+            shared = self.arrays.get(key)
+        if shared is not None:
+            return shared
+
+        try:
+            shared = SharedArray(name=self.getName(key),
+                                 iteration_size=iteration_size,
+                                 stride=stride)
+        except FileNotFoundError:
+            return None
+
+        return self._keep(key, shared)
+
+    def share(self, key, array: Array) -> SharedArray:
+        """
+        Copies an array into shared memory, unless another process has
+already shared the array of the key, in which case it is attached to
+
+        :param key: The key of the array, such as the index of a pooled volume
+        :param array: The array to share
+        :return: The shared array
+        """
+        try:
+            shared = SharedArray(array.getArray(), array.getBoundingBox(),
+                                 name=self.getName(key),
+                                 iteration_size=array.getIterationSize(),
+                                 stride=array.getStride())
+        except FileExistsError:
+            shared = SharedArray(name=self.getName(key),
+                                 iteration_size=array.getIterationSize(),
+                                 stride=array.getStride())
+
+        return self._keep(key, shared)
+
+    def _keep(self, key, shared: SharedArray) -> SharedArray:
+        with self.lock:
+            existing = self.arrays.setdefault(key, shared)
+
+        if existing is not shared:
+            shared.close()
+
+        return existing
+
+    def release(self, key, unlink: bool=True):
+        """
+        Unmaps the shared array of a key from the process and, optionally,
+removes its segment, whose memory is freed once no process maps it. Processes
+that still map a removed segment keep using it, and the next process that
+reads the key shares it again.
+
+        :param key: The key of the array
+        :param unlink: Whether to remove the segment
+        """
+        with self.lock:
+            shared = self.arrays.pop(key, None)
+        if shared is None:
+            return
+
+        if unlink:
+            try:
+                shared.unlink()
+            except FileNotFoundError:
+                pass
+        shared.close()
+
+    def getNames(self) -> list:
+        """
+        Lists the names of the pool's segments from every process. Only the
+segments known to the current process are listed on platforms without
+/dev/shm.
+        """
+        if os.path.isdir(SHARED_MEMORY_DIRECTORY):
+            return sorted(name for name in os.listdir(SHARED_MEMORY_DIRECTORY)
+                          if name.startswith(self.prefix))
+
+        with self.lock:
+            return sorted(shared.getName() for shared in self.arrays.values())
+
+    def close(self):
+        """
+        Unmaps the pool's segments from the process and, in the process that
+created the pool, removes every segment of the pool
+        """
+        with self.lock:
+            arrays, self.arrays = self.arrays, {}
+
+        if os.getpid() == self.owner_pid:
+            for name in self.getNames():
+                try:
+                    segment = _openSegment(name)
+                except FileNotFoundError:
+                    continue
+                _unlinkSegment(segment)
+                segment.close()
+
+        for shared in arrays.values():
+            shared.close()
+
+    def __getstate__(self):
+        return {"prefix": self.prefix, "owner_pid": self.owner_pid}
+
+    def __setstate__(self, state):
+        self.prefix = state["prefix"]
+        self.owner_pid = state["owner_pid"]
+        self.arrays = {}
+        self.lock = Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
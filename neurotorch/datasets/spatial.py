@@ -0,0 +1,249 @@
+from neurotorch.datasets.datatypes import BoundingBox, BoundingBoxArray, Vector
+from itertools import product
+import numpy as np
+
+
+class GridIndex:
+    """
+    A spatial index of bounding boxes that buckets each box into the cells of
+a uniform grid. Queries return exactly the boxes that overlap the query box
+and boxes can be added without rebuilding the index.
+    """
+    def __init__(self, cell_size: Vector=None):
+        """
+        Initializes an empty index
+
+        :param cell_size: The size of each grid cell. By default, the size of
+the first added bounding box is used.
+        """
+        self.setCellSize(cell_size)
+        self.boxes = np.zeros((16, 2, 3), dtype=np.int64)
+        self.count = 0
+        self.cells = {}
+
+    def setCellSize(self, cell_size: Vector):
+        if cell_size is not None:
+            if not isinstance(cell_size, Vector):
+                raise ValueError("cell_size must have type Vector")
+            if any(size <= 0 for size in cell_size):
+                raise ValueError("cell_size must be positive instead it is " +
+                                 "{}".format(cell_size))
+            cell_size = tuple(cell_size.getComponents())
+
+        self.cell_size = cell_size
+
+    def getCellSize(self) -> Vector:
+        return Vector(*self.cell_size) if self.cell_size is not None else None
+
+    def _cellRange(self, bounding_box: BoundingBox):
+        """
+        Returns the ranges of grid cells covered by a bounding box
+
+        :param bounding_box: The bounding box
+        :return: A list of ranges of cell coordinates along each axis
+        """
+        edge1, edge2 = bounding_box.getEdges()
+        return [range(e1 // size, max(e2 - 1, e1) // size + 1)
+                for e1, e2, size in zip(edge1, edge2, self.cell_size)]
+
+    def add(self, bounding_box: BoundingBox) -> int:
+        """
+        Adds a bounding box to the index
+
+        :param bounding_box: The bounding box to add
+        :return: The index of the added bounding box
+        """
+        if not isinstance(bounding_box, BoundingBox):
+            raise ValueError("bounding_box must have type BoundingBox")
+
+        if self.cell_size is None:
+            self.setCellSize(Vector(*[max(size, 1) for size
+                                      in bounding_box.getSize()]))
+
+        if self.count == len(self.boxes):
+            self.boxes = np.concatenate((self.boxes,
+                                         np.zeros_like(self.boxes)))
+
+        index = self.count
+        self.boxes[index] = bounding_box.toArray()
+        self.count += 1
+
+        for cell in product(*self._cellRange(bounding_box)):
+            self.cells.setdefault(cell, []).append(index)
+
+        return index
+
+    def query(self, bounding_box: BoundingBox) -> list:
+        """
+        Finds the bounding boxes that overlap a bounding box. Boxes that only
+share a face with the query box do not overlap it.
+
+        :param bounding_box: The query bounding box
+        :return: A sorted list of the indexes of the overlapping boxes
+        """
+        if self.count == 0:
+            return []
+
+        candidates = set()
+        for cell in product(*self._cellRange(bounding_box)):
+            candidates.update(self.cells.get(cell, ()))
+
+        if not candidates:
+            return []
+
+        candidates = np.fromiter(candidates, dtype=np.int64,
+                                 count=len(candidates))
+        candidates.sort()
+
+        edge1, edge2 = bounding_box.toArray()
+        boxes = self.boxes[candidates]
+        overlapping = ((boxes[:, 0] < edge2).all(axis=1) &
+                       (boxes[:, 1] > edge1).all(axis=1))
+
+        return candidates[overlapping].tolist()
+
+    def getBoundingBoxes(self) -> BoundingBoxArray:
+        """
+        Returns the indexed bounding boxes
+
+        :return: The indexed bounding boxes in the order that they were added
+        """
+        return BoundingBoxArray(self.boxes[:self.count])
+
+    def __len__(self):
+        return self.count
+
+
+class OccupancyIndex:
+    """
+    A summed-volume table of the nonzero voxels of a volume, counted in
+blocks. The number of nonzero voxels in any bounding box aligned to the
+blocks is computed in constant time.
+    """
+    def __init__(self, bounding_box: BoundingBox, block_size: Vector,
+                 table: np.ndarray):
+        """
+        Initializes an index from a summed-volume table
+
+        :param bounding_box: The bounding box of the indexed volume
+        :param block_size: The size of each block
+        :param table: The cumulative sums of the nonzero voxel counts of the
+blocks in Numpy order, with a leading row of zeros along each axis
+        """
+        self.bounding_box = bounding_box
+        self.block_size = block_size
+        self.table = table
+
+    @classmethod
+    def build(cls, volume, bounding_box: BoundingBox, block_size: Vector,
+              read_size: Vector=Vector(1024, 1024, 64)):
+        """
+        Builds an index in a single pass over a volume
+
+        :param volume: The volume to index, which must implement getInto.
+The regions of a pooled volume that no pooled volume overlaps are found with
+its spatial index and left empty.
+        :param bounding_box: The bounding box of the volume to index
+        :param block_size: The size of each block, such as the greatest
+common divisor of the patch size and stride
+        :param read_size: The approximate size of each read from the volume,
+which is rounded up to a multiple of the block size
+        :return: The index of the volume
+        """
+        blocks = [-(-size // block) for size, block
+                  in zip(bounding_box.getSize(), block_size)]
+        read_blocks = [max(-(-read // block), 1) for read, block
+                       in zip(read_size, block_size)]
+        counts = np.zeros(blocks[::-1], dtype=np.int64)
+        spatial_index = getattr(volume, "spatial_index", None)
+
+        edge1 = bounding_box.getEdges()[0]
+        ranges = [range(0, count, step) for count, step
+                  in zip(blocks, read_blocks)]
+        for z, y, x in product(*ranges[::-1]):
+            start = Vector(x, y, z)
+            stop = Vector(*[min(s + step, count) for s, step, count
+                            in zip(start, read_blocks, blocks)])
+            region = BoundingBox(edge1 + start * block_size,
+                                 edge1 + stop * block_size)
+
+            # Gaps between pooled volumes are left empty
+            if spatial_index is not None and not spatial_index.query(region):
+                continue
+
+            array = np.zeros(region.getNumpyDim(), dtype=np.bool_)
+            volume.getInto(region, array)
+
+            nz, ny, nx = (stop - start).getNumpyDim()
+            bz, by, bx = block_size.getNumpyDim()
+            block_counts = array.reshape(nz, bz, ny, by, nx, bx).sum(axis=(1, 3, 5))
+            counts[z:z+nz, y:y+ny, x:x+nx] = block_counts
+
+        table = np.zeros([count + 1 for count in counts.shape], dtype=np.int64)
+        table[1:, 1:, 1:] = counts.cumsum(0).cumsum(1).cumsum(2)
+
+        return cls(bounding_box, block_size, table)
+
+    def getBoundingBox(self) -> BoundingBox:
+        return self.bounding_box
+
+    def getBlockSize(self) -> Vector:
+        return self.block_size
+
+    def counts(self, bounding_boxes: BoundingBoxArray) -> np.ndarray:
+        """
+        Counts the nonzero voxels in each of several bounding boxes. The
+counts are exact for bounding boxes aligned to the blocks and otherwise
+include the whole of every block that a bounding box overlaps.
+
+        :param bounding_boxes: The bounding boxes to count
+        :return: An array of the nonzero voxel counts
+        """
+        edge1, edge2 = BoundingBoxArray(bounding_boxes).getEdges()
+        origin = self.bounding_box.toArray()[0]
+        block_size = np.array(self.block_size.getComponents())
+        blocks = np.array(self.table.shape[::-1]) - 1
+
+        lower = np.clip((edge1 - origin) // block_size, 0, blocks)
+        upper = np.clip(-(-(edge2 - origin) // block_size), 0, blocks)
+        upper = np.maximum(upper, lower)
+
+        result = np.zeros(len(lower), dtype=np.int64)
+        for corner in product((0, 1), repeat=3):
+            index = np.where(corner, upper, lower)
+            sign = (-1) ** (3 - sum(corner))
+            result += sign * self.table[index[:, 2], index[:, 1], index[:, 0]]
+
+        return result
+
+    def count(self, bounding_box: BoundingBox) -> int:
+        """
+        Counts the nonzero voxels in a bounding box
+
+        :param bounding_box: The bounding box to count
+        :return: The nonzero voxel count
+        """
+        return int(self.counts(BoundingBoxArray([bounding_box]))[0])
+
+    def save(self, filename):
+        """
+        Saves the index to a Numpy .npz file
+
+        :param filename: The filename of the index
+        """
+        with open(filename, "wb") as f:
+            np.savez(f, bounding_box=self.bounding_box.toArray(),
+                     block_size=np.array(self.block_size.getComponents()),
+                     table=self.table)
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Loads an index from a Numpy .npz file
+
+        :param filename: The filename of the index
+        :return: The loaded index
+        """
+        with np.load(filename) as f:
+            return cls(BoundingBox.fromArray(f["bounding_box"]),
+                       Vector(*f["block_size"].tolist()), f["table"])
@@ -25,7 +25,8 @@ class Spec(ABC):
                 edges = volume_spec["bounding_box"]
                 bounding_box = BoundingBox(Vector(*edges[0]),
                                            Vector(*edges[1]))
-                volume = TiffVolume(filename, bounding_box)
+                volume = TiffVolume(filename, bounding_box,
+                                    lazy=volume_spec.get("lazy", False))
 
                 return volume
 
@@ -48,16 +49,20 @@ class Spec(ABC):
             error_string = "given volume_spec is corrupt"
             raise ValueError(error_string)
 
-    def create(self, spec, stack_size=33):
+    def create(self, spec, stack_size=33, cache_bytes=None, lookahead=0):
         """
         Creates a pooled volume from a volume dataset specification
 
         :param spec: An array of dictionaries specifying the volume's parameters
         :param stack_size: The maximum number of open volumes
+        :param cache_bytes: The maximum memory held by the open volumes
+        :param lookahead: The number of volumes to open ahead of iteration
 
         :return: The pooled volume of the volume dataset
         """
-        pooled_volume = PooledVolume(stack_size=stack_size)
+        pooled_volume = PooledVolume(stack_size=stack_size,
+                                     cache_bytes=cache_bytes,
+                                     lookahead=lookahead)
 
         for item in spec:
             volume = self.openVolume(item)
@@ -65,20 +70,30 @@ class Spec(ABC):
 
         return pooled_volume
 
-    def open(self, spec_filename):
+    def open(self, spec_filename, stack_size=33, cache_bytes=None,
+             lookahead=0):
         """
         Opens a pooled volume from a volume dataset specification file
 
         :param spec_filename: The filename of the volume dataset specification
+        :param stack_size: The maximum number of open volumes
+        :param cache_bytes: The maximum memory held by the open volumes
+        :param lookahead: The number of volumes to open ahead of iteration
         :return: The pooled volume of the volume dataset
         """
         spec = self.parse(spec_filename)
 
         cwd = os.getcwd()
         os.chdir(os.path.dirname(spec_filename))
-        pooled_volume = self.create(spec)
+        pooled_volume = self.create(spec, stack_size=stack_size,
+                                    cache_bytes=cache_bytes,
+                                    lookahead=lookahead)
         os.chdir(cwd)
 
+        # Keep the occupancy index next to the specification
+        occupancy_file = os.path.splitext(os.path.abspath(spec_filename))[0]
+        pooled_volume.setOccupancyFile(occupancy_file + ".occupancy.npz")
+
         return pooled_volume
 
     @abstractmethod
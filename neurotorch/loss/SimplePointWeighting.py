@@ -1,8 +1,235 @@
 import torch
+import torch.nn.functional as F
 from torch.nn import BCEWithLogitsLoss, Module
 import numpy as np
 from scipy.ndimage.measurements import label
 
+# Bit layout of a 3x3x3 neighborhood: bit z*9 + y*3 + x for the offset (z, y, x)
+_OFFSETS = [(z, y, x) for z in range(3) for y in range(3) for x in range(3)]
+_FACE_OFFSETS = [offset for offset in _OFFSETS
+                 if sorted(offset) == [0, 1, 1] or sorted(offset) == [1, 1, 2]]
+_FULL_MASK = (1 << 27) - 1
+_CENTER_MASK = 1 << 13
+
+
+def _axis_mask(axis, value):
+    """
+    Returns the bitmask of the neighborhood positions with a given coordinate
+
+    :param axis: The axis of the coordinate (0 for Z, 1 for Y, 2 for X)
+    :param value: The coordinate along the axis
+    """
+    return sum(1 << bit for bit, offset in enumerate(_OFFSETS)
+               if offset[axis] == value)
+
+
+# Positions that would wrap around when shifted along each axis
+_SHIFT_MASKS = [(~_axis_mask(axis, 2) & _FULL_MASK,
+                 ~_axis_mask(axis, 0) & _FULL_MASK,
+                 3**(2-axis)) for axis in range(3)]
+
+
+def _dilate_axis(mask, axis):
+    """
+    Dilates neighborhood bitmasks by one position along an axis
+
+    :param mask: An integer array of neighborhood bitmasks
+    :param axis: The axis of the dilation (0 for Z, 1 for Y, 2 for X)
+    """
+    upper, lower, step = _SHIFT_MASKS[axis]
+    return mask | ((mask & upper) << step) | ((mask & lower) >> step)
+
+
+def _dilate_18(mask):
+    """
+    Dilates neighborhood bitmasks with the 18-neighborhood structure
+    """
+    dilated_z = _dilate_axis(mask, 0)
+    return (_dilate_axis(_dilate_axis(mask, 1), 2) |
+            _dilate_axis(dilated_z, 1) | _dilate_axis(dilated_z, 2))
+
+
+def _dilate_26(mask):
+    """
+    Dilates neighborhood bitmasks with the 26-neighborhood structure
+    """
+    return _dilate_axis(_dilate_axis(_dilate_axis(mask, 0), 1), 2)
+
+
+def _is_single_component(active, dilate, early_exit=True):
+    """
+    Determines whether the active positions of each neighborhood bitmask form
+exactly one connected component
+
+    :param active: An int64 Numpy array or PyTorch tensor of neighborhood
+bitmasks
+    :param dilate: The dilation defining the connectivity of the positions
+    :param early_exit: Whether to stop the flood fill once it converges
+    :return: A boolean array that is true where there is one component
+    """
+    # Flood fill from the lowest active position of each neighborhood
+    component = active & -active
+    for _ in range(len(_OFFSETS)):
+        grown = dilate(component) & active
+        if early_exit and (grown == component).all():
+            break
+        component = grown
+
+    return (active != 0) & (component == active)
+
+
+def nonsimple_points(array):
+    """
+    Labels every non-simple point of a binary array at once. The result
+matches SimplePointBCEWithLogitsLoss._is_nonsimple_point evaluated on every
+voxel, but the connectivity of all 3x3x3 neighborhoods is counted in bulk
+with bitwise flood fills instead of labeling each neighborhood separately.
+
+    :param array: A binary Numpy array whose last three dimensions are
+(Z, Y, X). Any leading dimensions are treated as a batch of volumes.
+    :return: A boolean Numpy array that is true at the non-simple points
+    """
+    array = np.asarray(array, dtype=bool)
+    shape = array.shape
+    volumes = array.reshape((-1,) + shape[-3:])
+
+    # Label the 6-connected components of each volume separately
+    structure = np.zeros((3, 3, 3, 3), dtype=bool)
+    structure[1] = [[[0, 0, 0], [0, 1, 0], [0, 0, 0]],
+                    [[0, 1, 0], [1, 1, 1], [0, 1, 0]],
+                    [[0, 0, 0], [0, 1, 0], [0, 0, 0]]]
+    labeled_array, num_features = label(volumes, structure=structure)
+    padded_array = np.pad(labeled_array, ((0, 0), (1, 1), (1, 1), (1, 1)),
+                          'edge')
+
+    return nonsimple_labeled_points(padded_array).reshape(shape)
+
+
+def nonsimple_labeled_points(padded_array):
+    """
+    Labels the non-simple points of labeled volumes from the labels of their
+connected components. The volumes have a margin of one voxel on every side,
+which holds the labels of the neighbors of the voxels on their faces.
+
+    :param padded_array: An integer Numpy array of component labels whose
+last three dimensions are (Z, Y, X) and include the margin, with zero as the
+background
+    :return: A boolean Numpy array without the margin that is true at the
+non-simple points
+    """
+    # Encode which neighbors share the label of the center voxel
+    size = tuple(length - 2 for length in padded_array.shape[-3:])
+    labeled_array = padded_array[..., 1:-1, 1:-1, 1:-1]
+    foreground = labeled_array != 0
+    centers = labeled_array[foreground]
+    neighborhoods = np.zeros(centers.shape, dtype=np.int64)
+    for bit, (k, j, i) in enumerate(_OFFSETS):
+        neighbors = padded_array[..., k:k+size[0], j:j+size[1], i:i+size[2]]
+        neighborhoods |= (neighbors[foreground] == centers).astype(np.int64) << bit
+
+    # Counts the components of the cavity and of the foreground
+    cavity = neighborhoods ^ _FULL_MASK
+    component = neighborhoods & (_FULL_MASK ^ _CENTER_MASK)
+    simple = (_is_single_component(cavity, _dilate_18) &
+              _is_single_component(component, _dilate_26))
+
+    result = np.zeros(labeled_array.shape, dtype=bool)
+    result[foreground] = ~simple
+
+    return result
+
+
+def _label_components(foreground):
+    """
+    Labels the 6-connected components of a batch of binary volumes on the
+tensor's device. Labels are propagated by max-pooling over the 6-neighborhood,
+hooked onto the voxel that they point to and shortened by pointer jumping
+until they converge.
+
+    :param foreground: A boolean PyTorch tensor with shape (N, 1, Z, Y, X)
+    :return: A tensor of the same shape where each component holds the
+one-based flat index of one of its voxels and the background is zero
+    """
+    batch_size = foreground.size(0)
+    size = foreground.size()[2:]
+    num_voxels = size[0] * size[1] * size[2]
+
+    # Flat indexes must be exactly representable
+    dtype = torch.float32 if num_voxels < 2**24 else torch.float64
+    indexes = torch.arange(1, num_voxels + 1, dtype=dtype,
+                           device=foreground.device).view(1, 1, *size)
+    labels = torch.where(foreground, indexes.expand_as(foreground),
+                         torch.zeros(1, dtype=dtype,
+                                     device=foreground.device))
+
+    while True:
+        previous = labels
+
+        # Max-pools the labels over the 6-neighborhood with shifted slices,
+        # which is much faster than stacking anisotropic max_pool3d kernels
+        padded_labels = F.pad(labels, (1, 1, 1, 1, 1, 1))
+        pooled = labels.clone()
+        for k, j, i in _FACE_OFFSETS:
+            torch.max(pooled, padded_labels[:, :, k:k+size[0], j:j+size[1],
+                                            i:i+size[2]], out=pooled)
+        pooled = torch.where(foreground, pooled, labels)
+
+        # Hooks each improved label onto the voxel its old label points to
+        flat_labels = pooled.view(batch_size, num_voxels)
+        roots = (previous.view(batch_size, num_voxels) - 1).clamp(min=0).long()
+        batch_index, voxel_index = (flat_labels >
+                                    flat_labels.gather(1, roots)).nonzero().unbind(1)
+        flat_labels[batch_index, roots[batch_index, voxel_index]] = \
+            flat_labels[batch_index, voxel_index]
+
+        # Jumps to the label of the voxel that each label points to
+        pointers = (flat_labels - 1).clamp(min=0).long()
+        jumped = flat_labels.gather(1, pointers).view_as(pooled)
+        labels = torch.where(foreground, torch.max(pooled, jumped), pooled)
+
+        if torch.equal(labels, previous):
+            return labels
+
+
+def _nonsimple_points_tensor(foreground):
+    """
+    Labels every non-simple point of a batch of binary volumes with the same
+neighborhood encoding as nonsimple_points without leaving the tensor's device
+
+    :param foreground: A boolean PyTorch tensor with shape (N, 1, Z, Y, X)
+    :return: A boolean tensor that is true at the non-simple points
+    """
+    labels = _label_components(foreground)
+    size = labels.size()[2:]
+    padded_labels = F.pad(labels, (1, 1, 1, 1, 1, 1), mode='replicate')
+    padded_size = padded_labels.size()[2:]
+
+    # Flat indexes of the foreground voxels in the padded volumes
+    batch_index, _, z, y, x = foreground.nonzero().unbind(1)
+    strides = (padded_size[1] * padded_size[2], padded_size[2], 1)
+    corners = (batch_index * padded_size[0] * strides[0] +
+               z * strides[0] + y * strides[1] + x)
+
+    # Encode which neighbors share the label of the center voxel
+    padded_labels = padded_labels.view(-1)
+    centers = padded_labels[corners + strides[0] + strides[1] + 1]
+    neighborhoods = torch.zeros(centers.size(), dtype=torch.int64,
+                                device=labels.device)
+    for bit, (k, j, i) in enumerate(_OFFSETS):
+        offset = k * strides[0] + j * strides[1] + i
+        neighbors = padded_labels[corners + offset]
+        neighborhoods |= (neighbors == centers).long() << bit
+
+    cavity = neighborhoods ^ _FULL_MASK
+    component = neighborhoods & (_FULL_MASK ^ _CENTER_MASK)
+    simple = (_is_single_component(cavity, _dilate_18) &
+              _is_single_component(component, _dilate_26))
+
+    result = torch.zeros_like(foreground)
+    result[foreground] = ~simple
+
+    return result
+
 
 class SimplePointBCEWithLogitsLoss(Module):
     """
@@ -12,18 +239,29 @@ class SimplePointBCEWithLogitsLoss(Module):
         super().__init__()
         self.bce = BCEWithLogitsLoss()
 
-    def forward(self, prediction, label):
+    def forward(self, prediction, label, label_nonsimple_points=None):
+        """
+        Computes the weighted loss
+
+        :param prediction: The network prediction
+        :param label: The corresponding label
+        :param label_nonsimple_points: The precomputed non-simple points of
+the label, e.g. from a NonSimplePointCache. If None, they are computed from
+the label.
+        """
         weighted_prediction = self.simple_weight(prediction)
-        weighted_label = self.simple_weight(label)
+        weighted_label = self.simple_weight(label,
+                                            non_simple_points=label_nonsimple_points)
 
         cost = self.bce(weighted_prediction, weighted_label)
 
         return cost
 
-    def simple_weight(self, tensor, simple_weight=1, non_simple_weight=10):
-        non_simple_points = self.label_nonsimple_points(tensor)
-        simple_points = tensor.new_ones(tensor.size()).to(tensor.get_device()) - \
-                        non_simple_points
+    def simple_weight(self, tensor, simple_weight=1, non_simple_weight=10,
+                      non_simple_points=None):
+        if non_simple_points is None:
+            non_simple_points = self.label_nonsimple_points(tensor)
+        simple_points = 1 - non_simple_points
         inputs_weights = non_simple_weight * non_simple_points + \
                          simple_weight * simple_points
         result = inputs_weights * tensor
@@ -31,35 +269,19 @@ class SimplePointBCEWithLogitsLoss(Module):
 
     def label_nonsimple_points(self, tensor, threshold=0.5):
         """
-        Labels every non-simple point in a tensor
+        Labels every non-simple point in a tensor on the tensor's device. The
+last three dimensions are (Z, Y, X) and any leading dimensions are treated as
+a batch of volumes.
 
         :param tensor: A PyTorch tensor
         :param threshold: The threshold to binarize the tensor
         """
-        try:
-            device = tensor.get_device()
-        except RuntimeError:
-            raise RuntimeError("simple point weighting currently only works" +
-                               " for GPUs")
-        array = tensor.to("cpu")
-        array = array.data.numpy()
-        array = (array > threshold)
-        labeled_array, num_features = label(array)
-        size = labeled_array.shape
-        padded_array = np.pad(labeled_array, (1,), 'edge')
-        result = np.zeros(size)
-
-        for k in range(0, size[0]):
-            for j in range(0, size[1]):
-                for i in range(0, size[2]):
-                    if self._is_nonsimple_point(padded_array[k:k+3,
-                                                             j:j+3,
-                                                             i:i+3]):
-                        result[k, j, i] = 1
-
-        result = torch.from_numpy(result.astype(np.float32)).to(device)
+        with torch.no_grad():
+            size = tensor.size()
+            foreground = (tensor > threshold).view(-1, 1, *size[-3:])
+            result = _nonsimple_points_tensor(foreground)
 
-        return result
+        return result.view(size).to(tensor.dtype)
 
     def _is_nonsimple_point(self, neighborhood):
         """
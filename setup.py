@@ -4,6 +4,7 @@ setup(
     name="neurotorch",
     version="0.1.0",
     packages=find_packages(),
+    python_requires=">=3.9",
     setup_requires=["pytest-runner"],
     tests_require=["pytest"],
 )
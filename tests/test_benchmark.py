@@ -0,0 +1,216 @@
+from neurotorch.datasets.dataset import AlignedVolume, Array, Data, PooledVolume
+from neurotorch.datasets.datatypes import BoundingBox, Vector
+from neurotorch.datasets.filetypes import TiffVolume
+from neurotorch.datasets.shared import SharedMemoryPool
+from neurotorch.datasets.spatial import GridIndex
+from psutil import Process
+import multiprocessing
+import numpy as np
+import tifffile as tif
+import os
+import tempfile
+import unittest
+import timeit
+import time
+
+
+def _readTiles(tiff_files: list, pool: SharedMemoryPool, results, release):
+    # Each worker reads every tile, as the workers of a data loader do over an
+    # epoch. It runs in a spawned process, so it is defined at the module level.
+    tile_size = Vector(512, 512, 64)
+    pooled_volume = PooledVolume(stack_size=4, shared_pool=pool)
+    for x, tiff_file in enumerate(tiff_files):
+        edge1 = tile_size * Vector(x, 0, 0)
+        pooled_volume.add(TiffVolume(tiff_file,
+                                     BoundingBox(edge1, edge1 + tile_size)))
+
+    # Only the memory that reading the tiles adds is reported
+    initial_uss = Process().memory_full_info().uss
+    for x in range(len(tiff_files)):
+        edge1 = tile_size * Vector(x, 0, 0)
+        pooled_volume.get(BoundingBox(edge1 + Vector(0, 0, 16),
+                                      edge1 + Vector(128, 128, 48)))
+    results.put(Process().memory_full_info().uss - initial_uss)
+    release.wait()
+    pooled_volume.__exit__(None, None, None)
+
+
+@unittest.skipUnless(os.environ.get("NEUROTORCH_BENCHMARK"),
+                     "set NEUROTORCH_BENCHMARK=1 to run the benchmarks")
+class TestBenchmark(unittest.TestCase):
+    def time_operation(self, operation, number=20000):
+        return min(timeit.repeat(operation, number=number, repeat=3)) / number
+
+    def test_datatypes(self):
+        vector1, vector2 = Vector(1, 2, 3), Vector(4, 5, 6)
+        bounding_box1 = BoundingBox(Vector(0, 0, 0), Vector(128, 128, 32))
+        bounding_box2 = BoundingBox(Vector(64, 64, 16), Vector(192, 192, 48))
+
+        operations = [
+            ("Vector()", lambda: Vector(1, 2, 3)),
+            ("Vector._fromComponents", lambda: Vector._fromComponents((1, 2, 3))),
+            ("Vector + Vector", lambda: vector1 + vector2),
+            ("Vector * int", lambda: vector1 * 2),
+            ("Vector == Vector", lambda: vector1 == vector2),
+            ("hash(Vector)", lambda: hash(vector1)),
+            ("BoundingBox()", lambda: BoundingBox(vector1, vector2)),
+            ("BoundingBox._fromEdges",
+             lambda: BoundingBox._fromEdges(vector1, vector2)),
+            ("BoundingBox + Vector", lambda: bounding_box1 + vector1),
+            ("BoundingBox.intersect",
+             lambda: bounding_box1.intersect(bounding_box2)),
+            ("BoundingBox.isDisjoint",
+             lambda: bounding_box1.isDisjoint(bounding_box2)),
+            ("BoundingBox.getSize", lambda: bounding_box1.getSize()),
+            ("hash(BoundingBox)", lambda: hash(bounding_box1)),
+        ]
+
+        durations = {}
+        for name, operation in operations:
+            durations[name] = self.time_operation(operation)
+            print("{:24s} {:8.3f} us/op".format(name, durations[name] * 1e6))
+
+        self.assertLess(durations["Vector._fromComponents"], durations["Vector()"])
+
+    def test_spatial_index(self):
+        random_state = np.random.RandomState(0)
+        tile_size = Vector(2048, 1024, 100)
+        patch_size = Vector(128, 128, 32)
+
+        query_times = []
+        for tile_count in (10000, 100000):
+            # Lay the tiles out in a grid of 100 x 100 x N tiles
+            tiles = [BoundingBox(tile_size * Vector(x, y, z),
+                                 tile_size * Vector(x + 1, y + 1, z + 1))
+                     for z in range(tile_count // 10000)
+                     for y in range(100) for x in range(100)]
+
+            index = GridIndex()
+            start = time.perf_counter()
+            for tile in tiles:
+                index.add(tile)
+            build_time = time.perf_counter() - start
+
+            upper = [t * s - p for t, s, p in zip((100, 100, tile_count // 10000),
+                                                  tile_size, patch_size)]
+            queries = [BoundingBox(Vector(*edge1), Vector(*edge1) + patch_size)
+                       for edge1 in random_state.randint(0, upper, size=(1000, 3)).tolist()]
+            query_time = self.time_operation(lambda: [index.query(query)
+                                                      for query in queries],
+                                             number=1) / len(queries)
+
+            query_times.append(query_time)
+            print("{} tiles: build {:.3f} s, query {:.3f} us".format(tile_count,
+                                                                    build_time,
+                                                                    query_time * 1e6))
+
+        # Queries do not slow down with the number of tiles
+        self.assertLess(query_times[1], 2 * query_times[0])
+
+    def test_valid_data(self):
+        random_state = np.random.RandomState(0)
+        labels = (random_state.rand(64, 512, 512) > 0.99999).astype(np.uint16)
+        iteration_size = BoundingBox(Vector(0, 0, 0), Vector(128, 128, 32))
+
+        volume = Array(labels, iteration_size=iteration_size,
+                       stride=Vector(64, 64, 16))
+        start = time.perf_counter()
+        brute_force = [i for i in range(len(volume))
+                       if (volume[i].getArray() != 0).any()]
+        brute_force_time = time.perf_counter() - start
+
+        volume = Array(labels, iteration_size=iteration_size,
+                       stride=Vector(64, 64, 16))
+        aligned_volume = AlignedVolume([volume, volume])
+        start = time.perf_counter()
+        valid_data = aligned_volume.getValidData()
+        index_time = time.perf_counter() - start
+
+        self.assertEqual(brute_force, valid_data)
+        self.assertLess(index_time, brute_force_time)
+        print("getValidData over {} patches: brute force {:.3f} s, "
+              "occupancy index {:.3f} s".format(len(volume), brute_force_time,
+                                                index_time))
+
+    def test_pooled_volume_assembly(self):
+        random_state = np.random.RandomState(0)
+        tile_size = Vector(512, 512, 64)
+        patch_size = Vector(128, 128, 32)
+        source = random_state.randint(0, 2**16, size=(128, 1024, 1024)).astype(np.uint16)
+
+        pooled_volume = PooledVolume(stack_size=8)
+        for z, y, x in [(z, y, x) for z in range(2) for y in range(2) for x in range(2)]:
+            edge1 = tile_size * Vector(x, y, z)
+            x1, y1, z1 = edge1.getComponents()
+            pooled_volume.add(Array(source[z1:z1+64, y1:y1+512, x1:x1+512],
+                                    BoundingBox(edge1, edge1 + tile_size)))
+
+        def assemble(bounding_box):
+            # The assembly that the pool used before, for comparison
+            shape = bounding_box.getNumpyDim()
+            array = Array(np.zeros(shape).astype(np.uint16),
+                          bounding_box=bounding_box,
+                          iteration_size=BoundingBox(Vector(0, 0, 0),
+                                                     bounding_box.getSize()),
+                          stride=bounding_box.getSize())
+            for index in pooled_volume._queryBoundingBox(bounding_box):
+                sub_bounding_box = bounding_box.intersect(pooled_volume.volumes[index].getBoundingBox())
+                array.set(pooled_volume.volumes[index].get(sub_bounding_box))
+
+            return array.getArray()
+
+        # Patches that straddle 2, 4 and 8 tiles around the tile corner
+        for tile_count, offset in [(2, Vector(448, 128, 16)),
+                                   (4, Vector(448, 448, 16)),
+                                   (8, Vector(448, 448, 48))]:
+            bounding_box = BoundingBox(offset, offset + patch_size)
+            self.assertEqual(tile_count,
+                             len(pooled_volume._queryBoundingBox(bounding_box)))
+            self.assertTrue((assemble(bounding_box) ==
+                             pooled_volume.get(bounding_box).getArray()).all())
+
+            previous_time = self.time_operation(lambda: assemble(bounding_box),
+                                                number=20)
+            get_time = self.time_operation(lambda: pooled_volume.get(bounding_box),
+                                           number=20)
+            print("{} tiles: previous assembly {:.3f} ms, "
+                  "get {:.3f} ms".format(tile_count, previous_time * 1e3,
+                                         get_time * 1e3))
+            self.assertLess(get_time, previous_time * 1.25)
+
+    def test_shared_memory_workers(self):
+        random_state = np.random.RandomState(0)
+        source = random_state.randint(0, 2**16, size=(64, 512, 2048)).astype(np.uint16)
+        context = multiprocessing.get_context("spawn")
+
+        with tempfile.TemporaryDirectory() as directory:
+            tiff_files = []
+            for x in range(4):
+                tiff_files.append(os.path.join(directory, "{}.tif".format(x)))
+                tif.imwrite(tiff_files[-1], source[:, :, x*512:(x+1)*512])
+
+            def measure(num_workers, pool):
+                results, release = context.Queue(), context.Event()
+                workers = [context.Process(target=_readTiles,
+                                           args=(tiff_files, pool, results,
+                                                 release))
+                           for worker in range(num_workers)]
+                for worker in workers:
+                    worker.start()
+                # The workers hold their tiles until every worker has reported
+                uss = sum(results.get(timeout=120) for worker in workers)
+                release.set()
+                for worker in workers:
+                    worker.join()
+                return uss
+
+            for num_workers in [1, 2, 4]:
+                private_uss = measure(num_workers, None)
+                with SharedMemoryPool() as pool:
+                    shared_uss = measure(num_workers, pool)
+                print("{} workers: private tiles {:.0f} MB, "
+                      "shared tiles {:.0f} MB".format(num_workers,
+                                                      private_uss / 2**20,
+                                                      shared_uss / 2**20))
+                if num_workers > 1:
+                    self.assertLess(shared_uss, private_uss)
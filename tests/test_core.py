@@ -1,5 +1,7 @@
 import unittest
-from neurotorch.loss.SimplePointWeighting import SimplePointBCEWithLogitsLoss
+from neurotorch.loss.SimplePointWeighting import (SimplePointBCEWithLogitsLoss,
+                                                  nonsimple_points)
+from neurotorch.datasets.nonsimple import NonSimplePointCache
 from neurotorch.core.trainer import Trainer
 from neurotorch.nets.RSUNet import RSUNet
 from neurotorch.datasets.datatypes import (BoundingBox, Vector)
@@ -11,9 +13,12 @@ from neurotorch.training.checkpoint import CheckpointWriter
 import os.path
 import os
 import shutil
+import tempfile
 import pytest
 import tifffile as tif
 import numpy as np
+import torch
+from scipy.ndimage.measurements import label
 from neurotorch.core.predictor import Predictor
 import time
 
@@ -157,3 +162,109 @@ class TestTrainer(unittest.TestCase):
         tif.imsave(os.path.join(IMAGE_PATH,
                                 "test_prediction.tif"),
                    output_volume.getArray().astype(np.float32))
+
+
+class TestSimplePointWeighting(unittest.TestCase):
+    def label_reference(self, array):
+        loss = SimplePointBCEWithLogitsLoss()
+        labeled_array, num_features = label(array)
+        size = labeled_array.shape
+        padded_array = np.pad(labeled_array, (1,), 'edge')
+        result = np.zeros(size, dtype=bool)
+
+        for k in range(0, size[0]):
+            for j in range(0, size[1]):
+                for i in range(0, size[2]):
+                    result[k, j, i] = loss._is_nonsimple_point(padded_array[k:k+3,
+                                                                            j:j+3,
+                                                                            i:i+3])
+
+        return result
+
+    def test_nonsimple_points(self):
+        random_state = np.random.RandomState(0)
+        for density in (0.1, 0.5, 0.9):
+            array = random_state.rand(6, 7, 8) < density
+            self.assertTrue((nonsimple_points(array) ==
+                             self.label_reference(array)).all(),
+                            "Vectorized simple points do not match the " +
+                            "reference at density {}".format(density))
+
+        # Leading dimensions are labeled as independent volumes
+        batch = random_state.rand(3, 1, 5, 6, 7) < 0.5
+        result = nonsimple_points(batch)
+        for i in range(batch.shape[0]):
+            self.assertTrue((result[i, 0] ==
+                             self.label_reference(batch[i, 0])).all(),
+                            "Batched simple points do not match the reference")
+
+    def test_device_nonsimple_points(self):
+        loss = SimplePointBCEWithLogitsLoss()
+        random_state = np.random.RandomState(1)
+        for density in (0.05, 0.3, 0.8):
+            array = random_state.rand(4, 1, 8, 9, 10) < density
+            tensor = torch.from_numpy(array.astype(np.float32))
+            result = loss.label_nonsimple_points(tensor)
+
+            self.assertEqual(tensor.device, result.device)
+            self.assertTrue((result.numpy().astype(bool) ==
+                             nonsimple_points(array)).all(),
+                            "Tensor simple points do not match the " +
+                            "vectorized simple points at density " +
+                            "{}".format(density))
+
+        # The loss runs on CPU tensors
+        prediction = torch.randn(2, 1, 8, 16, 16, requires_grad=True)
+        labels = (torch.rand(2, 1, 8, 16, 16) > 0.5).float()
+        loss(prediction, labels).backward()
+        self.assertIsNotNone(prediction.grad)
+
+    def test_nonsimple_point_cache(self):
+        random_state = np.random.RandomState(2)
+        # Soft labels, which are binarized with the loss's threshold
+        labels = Array((random_state.rand(20, 48, 48) * 0.8).astype(np.float32),
+                       iteration_size=BoundingBox(Vector(0, 0, 0),
+                                                  Vector(32, 32, 10)),
+                       stride=Vector(16, 16, 5))
+
+        with tempfile.TemporaryDirectory() as directory:
+            cache = NonSimplePointCache(labels,
+                                        os.path.join(directory, "labels"))
+            self.assertFalse(cache.isBuilt())
+            cache.build(num_workers=2, block_size=3)
+            self.assertTrue(cache.isBuilt())
+            self.assertFalse(NonSimplePointCache(labels,
+                                                 os.path.join(directory, "labels"),
+                                                 threshold=0.25).isBuilt())
+
+            # The cache holds the non-simple points of the whole volume
+            expected = nonsimple_points(labels.getArray() > 0.5)
+            self.assertEqual(expected.shape,
+                             np.load(os.path.join(directory, "labels.npy"),
+                                     mmap_mode='r').shape)
+
+            with cache:
+                self.assertEqual(len(labels), len(cache))
+                for i in range(len(labels)):
+                    x1, y1, z1 = labels._indexToBoundingBox(i).getEdges()[0].getComponents()
+                    self.assertTrue((cache[i].getArray() ==
+                                     expected[z1:z1+10, y1:y1+32, x1:x1+32]).all(),
+                                    "Cached non-simple points do not " +
+                                    "match patch {}".format(i))
+
+                # Bounding boxes off the patch grid are sliced from the cache
+                data = cache.get(BoundingBox(Vector(3, 5, 7), Vector(40, 50, 20)))
+                self.assertTrue((data.getArray()[:, :43] ==
+                                 expected[7:20, 5:48, 3:40]).all())
+                self.assertTrue((data.getArray()[:, 43:] == 0).all())
+
+                # The loss reads the label weights from the cache
+                loss = SimplePointBCEWithLogitsLoss()
+                bounding_box = labels.getBoundingBox()
+                label = torch.from_numpy(np.array(labels.get(bounding_box).getArray()))[None, None]
+                cached = torch.from_numpy(cache.get(bounding_box).getArray()
+                                          .astype(np.float32))[None, None]
+                prediction = torch.randn(label.size())
+                self.assertAlmostEqual(loss(prediction, label).item(),
+                                       loss(prediction, label, cached).item(),
+                                       places=5)
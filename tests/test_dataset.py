@@ -1,20 +1,99 @@
-from neurotorch.datasets.dataset import (AlignedVolume, Array, PooledVolume)
-from neurotorch.datasets.filetypes import (TiffVolume, Hdf5Volume)
+from neurotorch.datasets.dataset import (AccumulatorArray, AlignedVolume,
+                                         Array, Data, PooledVolume,
+                                         PrefetchIterator, TorchVolume,
+                                         copy_counter)
+from neurotorch.datasets.filetypes import (TiffVolume, Hdf5Volume,
+                                           MemmapArray, ChunkedVolume)
 from neurotorch.datasets.specification import JsonSpec
+from neurotorch.datasets import dataset
 import numpy as np
 import unittest
 import tifffile as tif
+import h5py
 import os.path
 import pytest
 from os import getpid
 from psutil import Process
-from neurotorch.datasets.datatypes import BoundingBox, Vector
+from neurotorch.datasets.datatypes import (BoundingBox, BoundingBoxArray,
+                                           PatchGrid, Vector)
+from neurotorch.datasets.spatial import GridIndex, OccupancyIndex
+from neurotorch.datasets.sampler import TileSampler
+from neurotorch.datasets.shared import SharedArray, SharedMemoryPool
+from neurotorch.datasets.pyramid import (PyramidBuilder, PyramidVolume,
+                                         downsample)
+import tempfile
+import multiprocessing
+from itertools import product
+from concurrent.futures import ThreadPoolExecutor
 import time
+import pickle
+import subprocess
+import sys
+import threading
 
 IMAGE_PATH = "./tests/images/"
 
 
+def _sharedTiffVolume(tiff_files: list, pool: SharedMemoryPool,
+                      stack_size: int=5) -> PooledVolume:
+    iteration_size = BoundingBox(Vector(0, 0, 0), Vector(16, 16, 8))
+    pooled_volume = PooledVolume(stack_size=stack_size,
+                                 iteration_size=iteration_size,
+                                 stride=Vector(8, 8, 4), shared_pool=pool)
+    for tiff_file, z1 in zip(tiff_files, (0, 8)):
+        pooled_volume.add(TiffVolume(tiff_file,
+                                     BoundingBox(Vector(0, 0, z1),
+                                                 Vector(32, 32, z1+8)),
+                                     iteration_size=iteration_size,
+                                     stride=Vector(8, 8, 4)))
+
+    return pooled_volume
+
+
+def _readSharedTiffVolume(tiff_files: list, pool: SharedMemoryPool,
+                          bounding_box: BoundingBox, queue):
+    # Runs in a spawned process, so it is defined at the module level
+    pooled_volume = _sharedTiffVolume(tiff_files, pool)
+    output = pooled_volume.get(bounding_box)
+    shared = pooled_volume.volumes[1].getArray()
+    shared.getArray()[-1, -1, -1] = 7
+    queue.put((output.getArray(), shared.isOwner()))
+    pooled_volume.__exit__(None, None, None)
+
+
 class TestDataset(unittest.TestCase):
+    def _tiledPool(self, shape: tuple, tile_shape: tuple, source=None,
+                   stride: Vector=Vector(8, 8, 4), array_type=Array,
+                   **kwargs):
+        """
+        Tiles a source volume with arrays in a pooled volume, in Z, Y, X order
+
+        :param shape: The shape of the source volume in Numpy order
+        :param tile_shape: The shape of each tile in Numpy order
+        :param source: The source volume. By default, it counts up from zero.
+        :param stride: The stride of the pooled volume and its tiles
+        :param array_type: The Array subclass of the tiles
+        :param kwargs: The keyword arguments of the pooled volume
+        :return: The source volume and the pooled volume
+        """
+        if source is None:
+            source = np.arange(np.prod(shape), dtype=np.uint16).reshape(shape)
+        iteration_size = BoundingBox(Vector(0, 0, 0), Vector(16, 16, 8))
+
+        pooled_volume = PooledVolume(iteration_size=iteration_size,
+                                     stride=stride, **kwargs)
+        tz, ty, tx = tile_shape
+        for z1, y1, x1 in product(range(0, shape[0], tz),
+                                  range(0, shape[1], ty),
+                                  range(0, shape[2], tx)):
+            pooled_volume.add(array_type(source[z1:z1+tz, y1:y1+ty, x1:x1+tx],
+                                         BoundingBox(Vector(x1, y1, z1),
+                                                     Vector(x1+tx, y1+ty, z1+tz)),
+                                         iteration_size=iteration_size,
+                                         stride=stride))
+
+        return source, pooled_volume
+
     def test_torch_dataset(self):
         input_dataset = TiffVolume(os.path.join(IMAGE_PATH,
                                                 "inputs.tif"),
@@ -108,6 +187,1057 @@ class TestDataset(unittest.TestCase):
                         msg=("volume loading error: volume memory usage is " +
                              "not less than the initial memory usage"))
 
+    def test_array_views(self):
+        source = np.arange(64*64*32, dtype=np.uint16).reshape(32, 64, 64)
+        array = Array(source, iteration_size=BoundingBox(Vector(0, 0, 0),
+                                                         Vector(16, 16, 8)),
+                      stride=Vector(16, 16, 8))
+        copy_counter.reset()
+
+        # Interior samples are read-only views of the volume
+        interior = array.get(BoundingBox(Vector(8, 8, 4), Vector(24, 24, 12)))
+        self.assertTrue(np.shares_memory(interior.getArray(), source))
+        self.assertFalse(interior.getArray().flags.writeable)
+        self.assertEqual(0, copy_counter.getBytes())
+
+        # Writing copies the sample and leaves the volume unchanged
+        interior.getWritableArray()[:] = 0
+        self.assertFalse(np.shares_memory(interior.getArray(), source))
+        self.assertEqual(source[4:12, 8:24, 8:24].nbytes, copy_counter.getBytes())
+        self.assertTrue((source[4:12, 8:24, 8:24] != 0).any())
+
+        # Border samples are zero-padded copies
+        border = array.get(BoundingBox(Vector(-4, 60, 0), Vector(12, 76, 8)))
+        self.assertTrue(border.getArray().flags.writeable)
+        self.assertTrue((border.getArray()[:, :, :4] == 0).all())
+        self.assertTrue((border.getArray()[:, 4:, :] == 0).all())
+        self.assertTrue((border.getArray()[:, :4, 4:] ==
+                         source[0:8, 60:64, 0:12]).all())
+        self.assertEqual(2, copy_counter.getCopies())
+
+        copied = array.get(BoundingBox(Vector(8, 8, 4), Vector(24, 24, 12)),
+                           copy=True)
+        self.assertFalse(np.shares_memory(copied.getArray(), source))
+        self.assertEqual(3, copy_counter.getCopies())
+
+    def test_get_into(self):
+        random_state = np.random.RandomState(0)
+        source = random_state.randint(0, 1000, size=(16, 32, 32)).astype(np.uint16)
+        array = Array(source, iteration_size=BoundingBox(Vector(0, 0, 0),
+                                                         Vector(16, 16, 8)),
+                      stride=Vector(16, 16, 8))
+
+        # Padding in place matches np.pad, including pads wider than the volume
+        for mode in ("constant", "reflect", "edge"):
+            for edge1, edge2 in [((-5, 3, 2), (11, 19, 10)),
+                                 ((20, -40, -3), (44, 4, 13))]:
+                bounding_box = BoundingBox(Vector(*edge1), Vector(*edge2))
+                out = np.full(bounding_box.getNumpyDim(), 7, dtype=np.float32)
+                array.getInto(bounding_box, out, mode=mode)
+
+                sub_bounding_box = bounding_box.intersect(array.getBoundingBox())
+                before = (sub_bounding_box.getEdges()[0] -
+                          bounding_box.getEdges()[0]).getNumpyDim()
+                after = (bounding_box.getEdges()[1] -
+                         sub_bounding_box.getEdges()[1]).getNumpyDim()
+                expected = np.pad(array.getArray(sub_bounding_box),
+                                  tuple(zip(before, after)), mode=mode)
+                self.assertTrue((expected == out).all(), mode)
+
+        with self.assertRaises(ValueError):
+            array.getInto(BoundingBox(Vector(0, 0, 0), Vector(8, 8, 8)),
+                          np.empty((8, 8, 4)))
+
+        # Pooled volumes write directly into the slot of a batch array
+        pooled_volume = PooledVolume(stack_size=1,
+                                     iteration_size=BoundingBox(Vector(0, 0, 0),
+                                                                Vector(16, 16, 8)),
+                                     stride=Vector(16, 16, 8))
+        pooled_volume.add(Array(source[:8], iteration_size=BoundingBox(Vector(0, 0, 0),
+                                                                       Vector(16, 16, 8)),
+                                stride=Vector(16, 16, 8)))
+        pooled_volume.add(Array(source[8:],
+                                BoundingBox(Vector(0, 0, 8), Vector(32, 32, 16)),
+                                iteration_size=BoundingBox(Vector(0, 0, 0),
+                                                           Vector(16, 16, 8)),
+                                stride=Vector(16, 16, 8)))
+        batch = np.empty((2, 1, 8, 16, 16), dtype=np.float32)
+        bounding_box = BoundingBox(Vector(8, 8, 4), Vector(24, 24, 12))
+        pooled_volume.getInto(bounding_box, batch[1, 0])
+        self.assertTrue((batch[1, 0] == array.get(bounding_box).getArray()).all())
+
+        bounding_box = BoundingBox(Vector(24, 24, 12), Vector(40, 40, 20))
+        for mode in ("constant", "edge"):
+            pooled_volume.getInto(bounding_box, batch[0, 0], mode=mode)
+            expected = np.empty_like(batch[0, 0])
+            array.getInto(bounding_box, expected, mode=mode)
+            self.assertTrue((batch[0, 0] == expected).all(), mode)
+
+        # Batches of aligned volumes are read into reused buffers
+        torch_volume = TorchVolume(AlignedVolume([array, pooled_volume]))
+        buffers = torch_volume.createBuffers(4)
+        self.assertEqual([(4, 1, 8, 16, 16)] * 2,
+                         [buffer.shape for buffer in buffers])
+        batch = torch_volume.getBatchInto([1, 2], buffers)
+        self.assertEqual((2, 1, 8, 16, 16), batch[0].shape)
+        self.assertTrue(np.shares_memory(batch[0], buffers[0]))
+        self.assertTrue((batch[0][1, 0] == array[2].getArray()).all())
+        self.assertTrue((batch[1][0, 0] == array[1].getArray()).all())
+
+    def test_accumulator_array(self):
+        random_state = np.random.RandomState(0)
+        source = random_state.rand(16, 32, 32).astype(np.float32)
+        bounding_box = BoundingBox(Vector(0, 0, 0), Vector(32, 32, 16))
+        iteration_size = BoundingBox(Vector(0, 0, 0), Vector(16, 16, 8))
+        array = Array(source, iteration_size=iteration_size,
+                      stride=Vector(8, 8, 4))
+
+        for window in ("gaussian", "cosine"):
+            accumulator = AccumulatorArray(bounding_box, window=window,
+                                           iteration_size=iteration_size,
+                                           stride=Vector(8, 8, 4))
+            for data in array:
+                accumulator.blend(data)
+
+            # Patches crossing the border are clipped to the volume
+            accumulator.blend(array.get(BoundingBox(Vector(-8, -8, -4),
+                                                    Vector(8, 8, 4))))
+
+            accumulator.finalize(block_size=3)
+            self.assertTrue(accumulator.isFinalized())
+            self.assertTrue(np.allclose(source, accumulator.getArray(),
+                                        atol=1e-5), window)
+
+            with self.assertRaises(ValueError):
+                accumulator.blend(array[0])
+
+        # Voxels without blended data remain zero
+        accumulator = AccumulatorArray(bounding_box,
+                                       iteration_size=iteration_size,
+                                       stride=Vector(8, 8, 4))
+        accumulator.blend(array[0])
+        accumulator.finalize()
+        self.assertTrue((accumulator.getArray()[8:] == 0).all())
+        self.assertTrue(np.allclose(source[:8, :16, :16],
+                                    accumulator.getArray()[:8, :16, :16]))
+
+        window = accumulator.getWindow((8, 16, 16))
+        self.assertAlmostEqual(1, window.max(), places=5)
+        self.assertTrue(np.allclose(window, window[::-1, ::-1, ::-1]))
+
+    def test_memmap_array(self):
+        random_state = np.random.RandomState(0)
+        source = random_state.rand(16, 32, 32).astype(np.float32)
+        bounding_box = BoundingBox(Vector(32, 0, 0), Vector(64, 32, 16))
+        iteration_size = BoundingBox(Vector(0, 0, 0), Vector(16, 16, 8))
+
+        with tempfile.TemporaryDirectory() as directory:
+            npy_file = os.path.join(directory, "outputs.npy")
+            with MemmapArray(npy_file, bounding_box,
+                             iteration_size=iteration_size,
+                             stride=Vector(16, 16, 8)) as array:
+                array.advise("sequential")
+                array.advise("willneed", BoundingBox(Vector(32, 0, 4),
+                                                     Vector(48, 16, 12)))
+                array.set(Data(source, bounding_box))
+                array.blend(Data(np.ones((8, 16, 16), dtype=np.float32),
+                                 BoundingBox(Vector(32, 0, 0),
+                                             Vector(48, 16, 8))))
+
+            # Reopening maps the existing file without copying it
+            array = MemmapArray(npy_file, bounding_box, mode="r",
+                                iteration_size=iteration_size,
+                                stride=Vector(16, 16, 8))
+            self.assertIsInstance(array.getArray(), np.memmap)
+            self.assertEqual(8, len(array))
+            expected = source.copy()
+            expected[:8, :16, :16] = 1
+            self.assertTrue((array.get(bounding_box).getArray() ==
+                             expected).all())
+            self.assertTrue((np.load(npy_file) == expected).all())
+            with self.assertRaises(ValueError):
+                array.set(Data(source, bounding_box))
+
+            with self.assertRaises(ValueError):
+                MemmapArray(npy_file, BoundingBox(Vector(0, 0, 0),
+                                                  Vector(16, 16, 16)))
+            with self.assertRaises(ValueError):
+                MemmapArray(os.path.join(directory, "missing.npy"))
+            del array
+
+    def test_chunked_volume(self):
+        random_state = np.random.RandomState(0)
+        bounding_box = BoundingBox(Vector(10, 0, 0), Vector(50, 30, 20))
+        iteration_size = BoundingBox(Vector(0, 0, 0), Vector(16, 16, 8))
+        expected = np.zeros(bounding_box.getNumpyDim(), dtype=np.uint16)
+
+        with tempfile.TemporaryDirectory() as directory:
+            with ChunkedVolume(directory, bounding_box,
+                               chunk_size=Vector(16, 16, 8), cache_size=4,
+                               iteration_size=iteration_size,
+                               stride=Vector(8, 8, 4)) as volume:
+                # Chunks that were never written are zero
+                self.assertTrue((volume.get(bounding_box).getArray() == 0).all())
+
+                # Partial writes update only the part of each chunk covered
+                for edge1 in [(10, 0, 0), (23, 5, 3), (40, 20, 12)]:
+                    data_bounding_box = BoundingBox(Vector(*edge1),
+                                                    Vector(*edge1) + Vector(10, 10, 8))
+                    array = random_state.randint(0, 1000, size=(8, 10, 10))
+                    volume.set(Data(array.astype(np.uint16), data_bounding_box))
+
+                    x1, y1, z1 = (data_bounding_box.getEdges()[0] -
+                                  bounding_box.getEdges()[0]).getComponents()
+                    expected[z1:z1+8, y1:y1+10, x1:x1+10] = array
+
+                self.assertTrue((volume.get(bounding_box).getArray() ==
+                                 expected).all())
+                self.assertLessEqual(len(volume.cache), 4)
+
+            # Reopening the volume reads its shape and format from the header
+            with ChunkedVolume(directory, iteration_size=iteration_size,
+                               stride=Vector(8, 8, 4)) as volume:
+                self.assertEqual(bounding_box, volume.getBoundingBox())
+                reference = Array(expected, bounding_box,
+                                  iteration_size=iteration_size,
+                                  stride=Vector(8, 8, 4))
+                self.assertEqual(len(reference), len(volume))
+                for i in range(len(volume)):
+                    self.assertTrue((volume[i].getArray() ==
+                                     reference[i].getArray()).all())
+
+                out = np.empty((12, 12, 12), dtype=np.float32)
+                volume.getInto(BoundingBox(Vector(44, 24, 14), Vector(56, 36, 26)),
+                               out, mode="edge")
+                self.assertTrue((out == np.pad(expected[14:, 24:, 34:],
+                                               ((0, 6), (0, 6), (0, 6)),
+                                               mode="edge")).all())
+
+                volume.blend(Data(np.full((4, 4, 4), 500, dtype=np.uint16),
+                                  BoundingBox(Vector(10, 0, 0), Vector(14, 4, 4))))
+                self.assertTrue((volume.get(BoundingBox(Vector(10, 0, 0),
+                                                        Vector(14, 4, 4))).getArray() ==
+                                 np.maximum(expected[:4, :4, :4], 500)).all())
+
+                # A write that covers a whole chunk does not keep the caller's
+                # buffer
+                chunk_bounding_box = BoundingBox(Vector(26, 0, 8),
+                                                 Vector(42, 16, 16))
+                buffer = np.ones((8, 16, 16), dtype=np.uint16)
+                volume.set(Data(buffer, chunk_bounding_box))
+                buffer[...] = 9
+                self.assertTrue((volume.get(chunk_bounding_box).getArray() ==
+                                 1).all())
+
+                # Concurrent partial writes to a chunk are all kept
+                def writeVoxel(x):
+                    volume.set(Data(np.full((1, 1, 1), x, dtype=np.uint16),
+                                    BoundingBox(Vector(10 + x, 0, 0),
+                                                Vector(11 + x, 1, 1))))
+
+                with ThreadPoolExecutor(max_workers=8) as executor:
+                    list(executor.map(writeVoxel, range(16)))
+                self.assertEqual(list(range(16)),
+                                 volume.get(BoundingBox(Vector(10, 0, 0),
+                                                        Vector(26, 1, 1))).getArray().ravel().tolist())
+                self.assertEqual([], [f for f in os.listdir(directory)
+                                      if f.endswith(".tmp")])
+
+            with self.assertRaises(ValueError):
+                ChunkedVolume(directory, BoundingBox(Vector(0, 0, 0),
+                                                     Vector(40, 30, 20)))
+            with self.assertRaises(ValueError):
+                ChunkedVolume(os.path.join(directory, "new"), bounding_box,
+                              compression="gzip")
+
+    def test_pyramid(self):
+        random_state = np.random.RandomState(0)
+        source = random_state.randint(0, 1000, size=(19, 29, 37)).astype(np.uint16)
+        bounding_box = BoundingBox(Vector(6, 4, 2), Vector(43, 33, 21))
+        iteration_size = BoundingBox(Vector(0, 0, 0), Vector(16, 16, 8))
+        array = Array(source, bounding_box, iteration_size=iteration_size,
+                      stride=Vector(8, 8, 4))
+
+        labels = np.array([[[1, 1], [2, 3]], [[2, 2], [3, 4]]])
+        self.assertEqual(2, downsample(labels, (2, 2, 2), "mode")[0, 0, 0])
+        self.assertEqual(4, downsample(labels, (2, 2, 2), "max")[0, 0, 0])
+        self.assertEqual(2, downsample(labels, (2, 2, 2), "mean")[0, 0, 0])
+
+        with tempfile.TemporaryDirectory() as directory:
+            builder = PyramidBuilder(array, directory, levels=2,
+                                     chunk_size=Vector(4, 4, 4),
+                                     block_size=Vector(8, 8, 4))
+            with builder.build(iteration_size=iteration_size,
+                               stride=Vector(8, 8, 4)) as pyramid:
+                self.assertEqual(3, pyramid.getLevelCount())
+
+                # Each level is the mean of edge-padded blocks of the last
+                expected = source
+                edge1 = np.array([2, 4, 6])
+                for level in range(1, 3):
+                    edge2 = edge1 + expected.shape
+                    padded = np.pad(expected,
+                                    tuple(zip(edge1 % 2, -edge2 % 2)),
+                                    mode="edge")
+                    expected = downsample(padded, (2, 2, 2), "mean")
+                    edge1 = edge1 // 2
+
+                    level_bounding_box = pyramid.scaleBoundingBox(bounding_box,
+                                                                  level)
+                    self.assertEqual(tuple(edge1[::-1]),
+                                     tuple(level_bounding_box.getEdges()[0]))
+                    self.assertTrue((pyramid.get(level_bounding_box,
+                                                 level=level).getArray() ==
+                                     expected).all())
+
+                self.assertTrue((pyramid[0].getArray() ==
+                                 array[0].getArray()).all())
+                self.assertEqual(len(array), len(pyramid))
+
+            # Reopening the pyramid reads its levels from the directory
+            pyramid = PyramidVolume(array, directory,
+                                    iteration_size=iteration_size,
+                                    stride=Vector(8, 8, 4))
+            self.assertTrue((pyramid.get(pyramid.scaleBoundingBox(bounding_box, 2),
+                                         level=2).getArray() == expected).all())
+            with self.assertRaises(ValueError):
+                pyramid.getLevel(3)
+
+        # Blocks are read from the source concurrently
+        barrier = threading.Barrier(2, timeout=10)
+
+        class BarrierArray(Array):
+            def getInto(self, bounding_box, out, mode="constant"):
+                barrier.wait()
+                return super().getInto(bounding_box, out, mode=mode)
+
+        source_array = BarrierArray(source[:8, :16, :32],
+                                    iteration_size=iteration_size,
+                                    stride=Vector(8, 8, 4))
+        with tempfile.TemporaryDirectory() as directory:
+            PyramidBuilder(source_array, directory, levels=1,
+                           chunk_size=Vector(4, 4, 4),
+                           block_size=Vector(8, 8, 4),
+                           num_workers=2).build(iteration_size=iteration_size,
+                                                stride=Vector(8, 8, 4))
+
+    def test_occupancy_index(self):
+        random_state = np.random.RandomState(0)
+        labels = np.zeros((32, 64, 64), dtype=np.uint16)
+        for z, y, x in random_state.randint(0, [32, 64, 64], size=(6, 3)):
+            labels[z, y, x] = 1
+        iteration_size = BoundingBox(Vector(0, 0, 0), Vector(16, 16, 8))
+
+        def bruteForce(volume):
+            return [i for i in range(len(volume))
+                    if (volume[i].getArray() != 0).any()]
+
+        inputs = Array(np.zeros_like(labels), iteration_size=iteration_size,
+                       stride=Vector(8, 8, 4))
+        label_array = Array(labels, iteration_size=iteration_size,
+                            stride=Vector(8, 8, 4))
+        aligned_volume = AlignedVolume([inputs, label_array])
+        index = aligned_volume.getOccupancyIndex()
+        self.assertEqual(Vector(8, 8, 4), index.getBlockSize())
+        self.assertEqual(bruteForce(label_array), aligned_volume.getValidData())
+        self.assertEqual(int((labels != 0).sum()),
+                         index.count(BoundingBox(Vector(-8, -8, -4),
+                                                 Vector(72, 72, 36))))
+
+        # Pooled volumes with a gap between them, persisted to a file
+        with tempfile.TemporaryDirectory() as directory:
+            occupancy_file = os.path.join(directory, "spec.occupancy.npz")
+            pooled_volume = PooledVolume(iteration_size=iteration_size,
+                                         stride=Vector(8, 8, 4))
+            for z1, z2 in [(0, 12), (20, 32)]:
+                pooled_volume.add(Array(labels[z1:z2],
+                                        BoundingBox(Vector(0, 0, z1),
+                                                    Vector(64, 64, z2)),
+                                        iteration_size=iteration_size,
+                                        stride=Vector(8, 8, 4)))
+            pooled_volume.setOccupancyFile(occupancy_file)
+            valid_data = pooled_volume.getValidData()
+            self.assertEqual(bruteForce(pooled_volume), valid_data)
+            self.assertTrue(os.path.isfile(occupancy_file))
+
+            loaded = OccupancyIndex.load(occupancy_file)
+            self.assertTrue((loaded.table ==
+                             pooled_volume.getOccupancyIndex().table).all())
+
+            pooled_volume.setOccupancyFile(occupancy_file)
+            self.assertEqual(valid_data, pooled_volume.getValidData())
+
+        # Patches aligned only to small blocks are checked patch by patch
+        # rather than building a large index
+        fine_array = Array(labels, iteration_size=iteration_size,
+                           stride=Vector(3, 3, 3))
+        fine_volume = AlignedVolume([fine_array, fine_array])
+        maximum_blocks = dataset.OCCUPANCY_MAX_BLOCKS
+        dataset.OCCUPANCY_MAX_BLOCKS = 1024
+        try:
+            self.assertIsNone(fine_volume.getOccupancyIndex())
+            self.assertEqual(bruteForce(fine_array), fine_volume.getValidData())
+        finally:
+            dataset.OCCUPANCY_MAX_BLOCKS = maximum_blocks
+
+        # Read errors are not mistaken for empty regions
+        class BrokenArray(Array):
+            def getInto(self, bounding_box, out, mode="constant"):
+                raise IOError("the volume cannot be read")
+
+        broken_array = BrokenArray(labels, iteration_size=iteration_size,
+                                   stride=Vector(8, 8, 4))
+        with self.assertRaises(IOError):
+            AlignedVolume([broken_array, broken_array]).getValidData()
+
+    def test_prefetch_iterator(self):
+        lock = threading.Lock()
+        state = {"outstanding": 0, "maximum": 0}
+
+        def read(key):
+            with lock:
+                state["outstanding"] += 1
+                state["maximum"] = max(state["maximum"], state["outstanding"])
+            time.sleep(0.001 * (key % 3))
+            return key * 2
+
+        def consume(key):
+            with lock:
+                state["outstanding"] -= 1
+            return key
+
+        # Items are returned in order with at most queue_size read ahead
+        with PrefetchIterator(read, range(50), num_workers=4,
+                              queue_size=3) as iterator:
+            self.assertEqual(list(range(0, 100, 2)),
+                             [consume(item) for item in iterator])
+        self.assertLessEqual(state["maximum"], 4)
+
+        # A failed read stops the iterator and is raised to the consumer
+        def fail(key):
+            if key == 5:
+                raise IOError("read failed")
+            return key
+
+        iterator = PrefetchIterator(fail, range(100), num_workers=2,
+                                    queue_size=4)
+        with self.assertRaises(IOError):
+            list(iterator)
+        self.assertEqual(0, len(iterator.futures))
+        self.assertTrue(iterator.executor._shutdown)
+
+        # Volumes and batches of volumes can be read ahead
+        source, pooled_volume = self._tiledPool((16, 32, 32), (8, 32, 32),
+                                                stack_size=1)
+        iteration_size = BoundingBox(Vector(0, 0, 0), Vector(16, 16, 8))
+        array = Array(source, iteration_size=iteration_size,
+                      stride=Vector(8, 8, 4))
+
+        with pooled_volume.prefetch(num_workers=3, queue_size=2) as iterator:
+            data_list = list(iterator)
+        self.assertEqual(len(pooled_volume), len(data_list))
+        for i, data in enumerate(data_list):
+            self.assertTrue((pooled_volume[i].getArray() ==
+                             data.getArray()).all())
+
+        torch_volume = TorchVolume(AlignedVolume([array, pooled_volume]))
+        batches = [[0, 1, 2], [5, 4, 3], [6, 7]]
+        expected = [[batch.copy() for batch in torch_volume.getBatchInto(indexes,
+                                                                         torch_volume.createBuffers(3))]
+                    for indexes in batches]
+        for expected_batch, batch in zip(expected,
+                                         torch_volume.iterateBatches(batches,
+                                                                     num_workers=2,
+                                                                     queue_size=1)):
+            self.assertEqual(len(expected_batch), len(batch))
+            for expected_array, array in zip(expected_batch, batch):
+                self.assertTrue((expected_array == array).all())
+
+    def test_lazy_tiff_volume(self):
+        random_state = np.random.RandomState(0)
+        source = random_state.randint(0, 1000, size=(20, 48, 40)).astype(np.uint16)
+        bounding_box = BoundingBox(Vector(0, 0, 0), Vector(40, 48, 20))
+        iteration_size = BoundingBox(Vector(0, 0, 0), Vector(16, 16, 8))
+
+        with tempfile.TemporaryDirectory() as directory:
+            contiguous_file = os.path.join(directory, "contiguous.tif")
+            compressed_file = os.path.join(directory, "compressed.tif")
+            tif.imwrite(contiguous_file, source)
+            tif.imwrite(compressed_file, source, compression="zlib")
+
+            # Uncompressed stacks are memory-mapped
+            with TiffVolume(contiguous_file, bounding_box, lazy=True,
+                            iteration_size=iteration_size,
+                            stride=Vector(8, 8, 4)) as volume:
+                self.assertIsInstance(volume.getArray().getArray(), np.memmap)
+                for i in range(len(volume)):
+                    expected = Array(source, iteration_size=iteration_size,
+                                     stride=Vector(8, 8, 4))[i]
+                    self.assertTrue((volume[i].getArray() ==
+                                     expected.getArray()).all())
+
+            # Compressed stacks decode only the pages that are requested
+            with TiffVolume(compressed_file, bounding_box, lazy=True,
+                            cache_size=4, iteration_size=iteration_size,
+                            stride=Vector(8, 8, 4)) as volume:
+                self.assertIsNone(volume.getArray())
+                data = volume.get(BoundingBox(Vector(4, 8, 2),
+                                              Vector(20, 24, 5)))
+                self.assertEqual([2, 3, 4], sorted(volume.page_cache))
+                self.assertTrue((data.getArray() == source[2:5, 8:24, 4:20]).all())
+
+                data = volume.get(BoundingBox(Vector(32, 40, 14),
+                                              Vector(48, 56, 22)))
+                self.assertEqual(4, len(volume.page_cache))
+                self.assertTrue((data.getArray() ==
+                                 np.pad(source[14:, 40:, 32:],
+                                        ((0, 2), (0, 8), (0, 8)))).all())
+
+                # Threads share the file handle to read different pages
+                def readPage(z):
+                    return volume.get(BoundingBox(Vector(0, 0, z),
+                                                  Vector(40, 48, z+1))).getArray()
+
+                with ThreadPoolExecutor(max_workers=4) as executor:
+                    pages = list(executor.map(readPage, range(20)))
+                self.assertTrue((np.concatenate(pages) == source).all())
+
+                with self.assertRaises(ValueError):
+                    volume.set(data)
+            self.assertEqual(0, len(volume.page_cache))
+
+            # By default, the pages of two data samples are kept
+            with TiffVolume(compressed_file, bounding_box, lazy=True,
+                            iteration_size=iteration_size,
+                            stride=Vector(8, 8, 4)) as volume:
+                volume.get(bounding_box)
+                self.assertEqual(16, volume.getCacheSize())
+                self.assertEqual(16, len(volume.page_cache))
+
+    def test_tiff_directory_volume(self):
+        random_state = np.random.RandomState(0)
+        source = random_state.randint(0, 1000, size=(12, 24, 20)).astype(np.uint16)
+        bounding_box = BoundingBox(Vector(0, 0, 0), Vector(20, 24, 12))
+        iteration_size = BoundingBox(Vector(0, 0, 0), Vector(16, 16, 8))
+
+        with tempfile.TemporaryDirectory() as directory:
+            # Slices sort by number rather than alphabetically
+            for z in range(12):
+                tif.imwrite(os.path.join(directory, "slice_{}.tif".format(z)),
+                            source[z])
+            with open(os.path.join(directory, "notes.txt"), "w") as f:
+                f.write("not a slice")
+
+            with TiffVolume(directory, bounding_box, num_workers=3,
+                            iteration_size=iteration_size,
+                            stride=Vector(4, 8, 4)) as volume:
+                self.assertTrue((volume.getArray().getArray() == source).all())
+
+            with TiffVolume(directory, bounding_box, lazy=True,
+                            iteration_size=iteration_size,
+                            stride=Vector(4, 8, 4)) as volume:
+                data = volume.get(BoundingBox(Vector(2, 4, 9), Vector(18, 20, 11)))
+                self.assertEqual([9, 10], sorted(volume.page_cache))
+                self.assertTrue((data.getArray() == source[9:11, 4:20, 2:18]).all())
+
+                # The decoding threads are reused across reads
+                executor = volume.executor
+                volume.get(BoundingBox(Vector(2, 4, 1), Vector(18, 20, 4)))
+                self.assertIs(executor, volume.executor)
+            self.assertIsNone(volume.executor)
+
+            empty_directory = os.path.join(directory, "empty")
+            os.mkdir(empty_directory)
+            with self.assertRaises(IOError):
+                with TiffVolume(empty_directory, bounding_box,
+                                iteration_size=iteration_size,
+                                stride=Vector(4, 8, 4)):
+                    pass
+
+    def test_streaming_hdf5_volume(self):
+        random_state = np.random.RandomState(0)
+        source = random_state.randint(0, 1000, size=(20, 48, 40)).astype(np.uint16)
+        iteration_size = BoundingBox(Vector(0, 0, 0), Vector(16, 16, 8))
+
+        with tempfile.TemporaryDirectory() as directory:
+            hdf5_file = os.path.join(directory, "inputs.h5")
+            with h5py.File(hdf5_file, "w") as f:
+                f.create_dataset("input-1", data=source[:10], chunks=(4, 16, 16))
+                f.create_dataset("input-2", data=source[10:], chunks=(4, 16, 16))
+
+            pooled_volume = PooledVolume(stack_size=1,
+                                         iteration_size=iteration_size,
+                                         stride=Vector(8, 8, 4))
+            for name, z1, z2 in [("input-1", 0, 10), ("input-2", 10, 20)]:
+                pooled_volume.add(Hdf5Volume(hdf5_file, name,
+                                             BoundingBox(Vector(0, 0, z1),
+                                                         Vector(40, 48, z2)),
+                                             iteration_size=iteration_size,
+                                             stride=Vector(8, 8, 4),
+                                             streaming=True,
+                                             rdcc_nbytes=2**20,
+                                             rdcc_nslots=521))
+
+            # Samples spanning both datasets are read from each hyperslab
+            output = pooled_volume.get(BoundingBox(Vector(4, 8, 6),
+                                                   Vector(36, 40, 14)))
+            self.assertTrue((output.getArray() == source[6:14, 8:40, 4:36]).all())
+
+            with Hdf5Volume(hdf5_file, "input-2",
+                            BoundingBox(Vector(0, 0, 10), Vector(40, 48, 20)),
+                            iteration_size=iteration_size,
+                            stride=Vector(8, 8, 4), streaming=True,
+                            rdcc_nbytes=2**20) as volume:
+                self.assertIsNone(volume.getArray())
+                self.assertEqual(2**20, volume.hdf5_handle.id.get_access_plist().get_cache()[2])
+                out = np.zeros((8, 16, 16), dtype=np.float32)
+                volume.getInto(BoundingBox(Vector(32, 40, 16), Vector(48, 56, 24)),
+                               out, mode="edge")
+                self.assertTrue((out == np.pad(source[16:, 40:, 32:],
+                                               ((0, 4), (0, 8), (0, 8)),
+                                               mode="edge")).all())
+
+            with Hdf5Volume(hdf5_file, "input-1",
+                            BoundingBox(Vector(0, 0, 0), Vector(40, 48, 10)),
+                            iteration_size=iteration_size,
+                            stride=Vector(8, 8, 4)) as volume:
+                self.assertTrue((volume[0].getArray() == source[:8, :16, :16]).all())
+
+    def test_writable_hdf5_volume(self):
+        random_state = np.random.RandomState(0)
+        bounding_box = BoundingBox(Vector(0, 0, 0), Vector(40, 36, 18))
+        iteration_size = BoundingBox(Vector(0, 0, 0), Vector(16, 16, 8))
+        stride = Vector(8, 8, 4)
+        expected = np.zeros(bounding_box.getNumpyDim(), dtype=np.float32)
+
+        with tempfile.TemporaryDirectory() as directory:
+            hdf5_file = os.path.join(directory, "outputs.h5")
+            with Hdf5Volume(hdf5_file, "output", bounding_box,
+                            iteration_size=iteration_size, stride=stride,
+                            mode="w") as volume:
+                self.assertEqual(Vector(8, 8, 4), volume.getChunkSize())
+                for index, bounding_box in enumerate(volume.getGrid()):
+                    data = random_state.rand(*bounding_box.getNumpyDim()).astype(np.float32)
+                    volume.blend(Data(data, bounding_box))
+
+                    x1, y1, z1 = bounding_box.getEdges()[0].getComponents()
+                    target = expected[z1:z1+8, y1:y1+16, x1:x1+16]
+                    np.maximum(target, data[:target.shape[0], :target.shape[1],
+                                            :target.shape[2]], out=target)
+
+                    # Buffered chunks are read back before they are written
+                    if index == 0:
+                        self.assertTrue(volume.chunk_buffers)
+                        self.assertTrue((volume[0].getArray() ==
+                                         expected[:8, :16, :16]).all())
+
+                # Each chunk was written once its last patch was blended
+                self.assertEqual({}, volume.chunk_buffers)
+
+            with h5py.File(hdf5_file, "r") as f:
+                self.assertEqual((4, 8, 8), f["output"].chunks)
+                self.assertEqual("gzip", f["output"].compression)
+                self.assertTrue((f["output"][()] == expected).all())
+
+            with self.assertRaises(ValueError):
+                Hdf5Volume(hdf5_file, "output", bounding_box, mode="a")
+
+    def test_pooled_volume_cache(self):
+        tile_bytes = 8*32*32 * np.dtype(np.uint16).itemsize
+        opened_bytes = []
+
+        class RecordingArray(Array):
+            def __enter__(self):
+                opened_bytes.append(pooled_volume.getCacheBytes())
+                return self
+
+        # The cache holds two and a half tiles
+        source, pooled_volume = self._tiledPool((32, 32, 32), (8, 32, 32),
+                                                array_type=RecordingArray,
+                                                stack_size=None,
+                                                cache_bytes=tile_bytes * 5 // 2)
+
+        def read(z1):
+            bounding_box = BoundingBox(Vector(0, 0, z1), Vector(16, 16, z1+8))
+            output = pooled_volume.get(bounding_box)
+            self.assertTrue((output.getArray() == source[z1:z1+8, :16, :16]).all())
+
+        # A tile that is touched constantly stays open
+        for z1 in [0, 8, 0, 16, 0, 24, 0]:
+            read(z1)
+        self.assertEqual(list(pooled_volume.stack), [3, 0])
+        stats = pooled_volume.getCacheStats()
+        self.assertEqual({"hits": 3, "misses": 4, "evictions": 2, "flushes": 0,
+                          "volumes": 2, "bytes": 2 * tile_bytes},
+                         {key: stats[key] for key in ["hits", "misses",
+                                                      "evictions", "flushes",
+                                                      "volumes", "bytes"]})
+
+        # Samples that straddle tiles count every tile they touch
+        read(4)
+        self.assertEqual(list(pooled_volume.stack), [0, 1])
+        self.assertEqual(3, pooled_volume.getCacheStats()["evictions"])
+
+        # Room is made for each tile before it is opened
+        self.assertEqual(5, len(opened_bytes))
+        self.assertLessEqual(max(opened_bytes) + tile_bytes, tile_bytes * 5 // 2)
+
+        pooled_volume.__exit__(None, None, None)
+        self.assertEqual(0, pooled_volume.getCacheStats()["volumes"])
+
+    def test_pooled_volume_assembly(self):
+        random_state = np.random.RandomState(0)
+        iteration_size = BoundingBox(Vector(0, 0, 0), Vector(16, 16, 8))
+
+        # The volume is tiled by 2 x 2 x 2 tiles
+        source, pooled_volume = self._tiledPool((32, 64, 64), (16, 32, 32),
+                                                random_state.rand(32, 64, 64).astype(np.float32),
+                                                stack_size=8)
+
+        # Float tiles are not truncated
+        output = pooled_volume.get(BoundingBox(Vector(20, 24, 10),
+                                               Vector(44, 40, 22)))
+        self.assertEqual(np.float32, output.getArray().dtype)
+        self.assertTrue((output.getArray() == source[10:22, 24:40, 20:44]).all())
+        self.assertEqual(8, pooled_volume.getCacheStats()["misses"])
+        self.assertFalse(pooled_volume.volumes_overlap)
+
+        # The parts of tiles held in memory are read on the calling thread
+        readers = set()
+
+        class ReaderArray(Array):
+            def getInto(self, bounding_box, out, mode="constant"):
+                readers.add(threading.get_ident())
+                return super().getInto(bounding_box, out, mode=mode)
+
+        _, reader_volume = self._tiledPool((32, 64, 64), (16, 32, 32),
+                                           array_type=ReaderArray,
+                                           stack_size=8)
+        reader_volume.get(BoundingBox(Vector(20, 24, 10), Vector(44, 40, 22)))
+        self.assertEqual({threading.get_ident()}, readers)
+
+        # Tiles of different dtypes are assembled in a common dtype
+        mixed_volume = PooledVolume(iteration_size=iteration_size,
+                                    stride=Vector(8, 8, 4))
+        for z1, dtype in [(0, np.uint8), (16, np.uint16)]:
+            mixed_volume.add(Array(np.full((16, 32, 32), 200 + z1, dtype=dtype),
+                                   BoundingBox(Vector(0, 0, z1),
+                                               Vector(32, 32, z1+16)),
+                                   iteration_size=iteration_size,
+                                   stride=Vector(8, 8, 4)))
+        output = mixed_volume.get(BoundingBox(Vector(0, 0, 12),
+                                              Vector(16, 16, 20)))
+        self.assertEqual(np.uint16, output.getArray().dtype)
+        self.assertEqual([200, 216], np.unique(output.getArray()).tolist())
+
+        # Overlapping tiles are not counted twice toward the coverage
+        overlapping_volume = PooledVolume(iteration_size=iteration_size,
+                                          stride=Vector(8, 8, 4))
+        for x1 in (0, 4):
+            overlapping_volume.add(Array(np.full((8, 16, 16), 3, dtype=np.uint16),
+                                         BoundingBox(Vector(x1, 8, 0),
+                                                     Vector(x1+16, 24, 8)),
+                                         iteration_size=iteration_size,
+                                         stride=Vector(8, 8, 4)))
+        self.assertTrue(overlapping_volume.volumes_overlap)
+        output = overlapping_volume.get(BoundingBox(Vector(0, 0, 0),
+                                                    Vector(16, 16, 8)))
+        self.assertTrue((output.getArray()[:, :8] == 0).all())
+        self.assertTrue((output.getArray()[:, 8:] == 3).all())
+
+        # Concurrent reads keep the tiles that they read from open
+        pooled_volume.setStack(stack_size=2)
+        bounding_boxes = [pooled_volume._indexToBoundingBox(i)
+                          for i in range(0, len(pooled_volume), 7)]
+
+        def read(bounding_box):
+            x1, y1, z1 = bounding_box.getEdges()[0].getComponents()
+            x2, y2, z2 = bounding_box.getEdges()[1].getComponents()
+            output = pooled_volume.get(bounding_box).getArray()
+
+            return (output == source[z1:z2, y1:y2, x1:x2]).all()
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            self.assertTrue(all(executor.map(read, bounding_boxes)))
+        self.assertEqual({}, pooled_volume.pins)
+        self.assertLessEqual(len(pooled_volume.stack), 2)
+
+    def test_pooled_volume_write(self):
+        random_state = np.random.RandomState(0)
+        iteration_size = BoundingBox(Vector(0, 0, 0), Vector(16, 16, 8))
+        expected = np.zeros((16, 32, 64), dtype=np.float32)
+
+        with tempfile.TemporaryDirectory() as directory:
+            # The volume is tiled by two TIFF files side by side
+            tiff_files = [os.path.join(directory, "{}.tif".format(x1))
+                          for x1 in (0, 32)]
+            pooled_volume = PooledVolume(stack_size=1,
+                                         iteration_size=iteration_size,
+                                         stride=Vector(8, 8, 4),
+                                         num_workers=1)
+            for tiff_file, x1, compression in zip(tiff_files, (0, 32),
+                                                  (None, "zlib")):
+                tif.imwrite(tiff_file, np.zeros((16, 32, 32), dtype=np.float32),
+                            compression=compression, resolution=(2, 4),
+                            description="tile {}".format(x1))
+                pooled_volume.add(TiffVolume(tiff_file,
+                                             BoundingBox(Vector(x1, 0, 0),
+                                                         Vector(x1+32, 32, 16)),
+                                             iteration_size=iteration_size,
+                                             stride=Vector(8, 8, 4)))
+
+            # Blends that straddle both tiles are split between them
+            for bounding_box in [BoundingBox(Vector(24, 0, 0), Vector(40, 16, 8)),
+                                 BoundingBox(Vector(20, 8, 4), Vector(36, 24, 12))]:
+                data = random_state.rand(*bounding_box.getNumpyDim()).astype(np.float32)
+                pooled_volume.blend(Data(data, bounding_box))
+
+                x1, y1, z1 = bounding_box.getEdges()[0].getComponents()
+                x2, y2, z2 = bounding_box.getEdges()[1].getComponents()
+                target = expected[z1:z2, y1:y2, x1:x2]
+                np.maximum(target, data, out=target)
+
+            # Evicted tiles were written back and are read again from disk
+            self.assertEqual(3, pooled_volume.getCacheStats()["flushes"])
+            self.assertEqual({1}, pooled_volume.dirty)
+            output = pooled_volume.get(BoundingBox(Vector(0, 0, 0),
+                                                   Vector(64, 32, 16)))
+            self.assertTrue((output.getArray() == expected).all())
+
+            pooled_volume.set(Data(np.ones((8, 8, 16), dtype=np.float32),
+                                   BoundingBox(Vector(56, 0, 0),
+                                               Vector(72, 8, 8))))
+            expected[:8, :8, 56:] = 1
+            pooled_volume.__exit__(None, None, None)
+
+            self.assertEqual(5, pooled_volume.getCacheStats()["flushes"])
+            self.assertEqual(set(), pooled_volume.dirty)
+            self.assertTrue((np.concatenate([tif.imread(tiff_file)
+                                             for tiff_file in tiff_files],
+                                            axis=2) == expected).all())
+
+            # Tiles keep their compression and metadata when written back
+            for tiff_file, x1, compression in zip(tiff_files, (0, 32),
+                                                  (1, 8)):
+                with tif.TiffFile(tiff_file) as f:
+                    self.assertEqual(compression, f.pages[0].compression)
+                    self.assertEqual("tile {}".format(x1), f.pages[0].description)
+                    self.assertEqual((2, 4), f.pages[0].resolution)
+                    self.assertEqual(16, len(f.pages))
+
+        # Writing back an evicted tile does not block reads of other tiles
+        flushing, release = threading.Event(), threading.Event()
+
+        class BlockingArray(Array):
+            def flush(self):
+                flushing.set()
+                release.wait(timeout=60)
+
+        _, pooled_volume = self._tiledPool((16, 32, 96), (16, 32, 32),
+                                           array_type=BlockingArray,
+                                           stack_size=1, num_workers=1)
+        pooled_volume.set(Data(np.ones((8, 16, 16), dtype=np.float32),
+                               BoundingBox(Vector(0, 0, 0), Vector(16, 16, 8))))
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            evicting = executor.submit(pooled_volume.get,
+                                       BoundingBox(Vector(32, 0, 0),
+                                                   Vector(48, 16, 8)))
+            self.assertTrue(flushing.wait(timeout=60))
+            reading = executor.submit(pooled_volume.get,
+                                      BoundingBox(Vector(64, 0, 0),
+                                                  Vector(80, 16, 8)))
+            self.assertEqual((8, 16, 16), reading.result(timeout=60).getArray().shape)
+            self.assertFalse(evicting.done())
+            release.set()
+            evicting.result(timeout=60)
+        self.assertEqual(1, pooled_volume.getCacheStats()["flushes"])
+
+    def test_pooled_volume_lookahead(self):
+        opened = [threading.Event() for tile in range(6)]
+
+        class GatedArray(Array):
+            # Signals that the tile was opened, so that each read can wait
+            # for the tile that was opened ahead of it
+            def __enter__(self):
+                opened[self.tile].set()
+                return self
+
+        source, pooled_volume = self._tiledPool((48, 32, 32), (8, 32, 32),
+                                                stride=Vector(16, 16, 8),
+                                                array_type=GatedArray,
+                                                stack_size=3, lookahead=2)
+        for tile, array in enumerate(pooled_volume.volumes):
+            array.tile = tile
+
+        # Every tile after the first is opened ahead of its first read
+        for i in range(len(pooled_volume)):
+            if i > 0:
+                self.assertTrue(opened[i // 4].wait(timeout=60))
+            bounding_box = pooled_volume._indexToBoundingBox(i)
+            x1, y1, z1 = bounding_box.getEdges()[0].getComponents()
+            self.assertTrue((pooled_volume[i].getArray() ==
+                             source[z1:z1+8, y1:y1+16, x1:x1+16]).all())
+
+        stats = pooled_volume.getCacheStats()
+        self.assertEqual(1, stats["misses"])
+        self.assertEqual(5, stats["prefetches"])
+        self.assertEqual(23, stats["hits"])
+        self.assertLessEqual(stats["volumes"], 3)
+
+        # A plan in another order opens the tiles in that order
+        indexes = [i for z in [5, 2, 4, 0, 3, 1] for i in range(4*z, 4*z+4)]
+        pooled_volume.__exit__(None, None, None)
+        pooled_volume.setStack(stack_size=3)
+        pooled_volume.setLookahead(2, indexes)
+        for event in opened:
+            event.clear()
+        for position, i in enumerate(indexes):
+            if position > 0:
+                self.assertTrue(opened[i // 4].wait(timeout=60))
+            pooled_volume[i]
+        stats = pooled_volume.getCacheStats()
+        self.assertEqual(1, stats["misses"])
+        self.assertEqual(5, stats["prefetches"])
+
+    def test_tile_sampler(self):
+        source, pooled_volume = self._tiledPool((64, 32, 32), (8, 32, 32),
+                                                stack_size=2, lookahead=1)
+        segments = pooled_volume.getGrid().getSegment(np.arange(len(pooled_volume)))
+
+        # Each window of two tiles is sampled before the next window
+        sampler = TileSampler(pooled_volume, window_size=2, random_state=0)
+        order = list(sampler)
+        self.assertEqual(list(range(len(pooled_volume))), sorted(order))
+        windows = segments[order].reshape(4, -1)
+        self.assertTrue(all(len(np.unique(window)) == 2 for window in windows))
+        self.assertEqual(8, len(np.unique(windows)))
+        self.assertNotEqual(sorted(order), order)
+        self.assertEqual(order, pooled_volume.lookahead_indexes.tolist())
+
+        # Groups of tiles are kept together and the windows can be turned off
+        sampler = TileSampler(pooled_volume, window_size=1, group_size=4,
+                              random_state=0)
+        self.assertTrue(all(len(np.unique(window // 4)) == 1
+                            for window in segments[list(sampler)].reshape(2, -1)))
+        sampler = TileSampler(pooled_volume, window_size=None, random_state=0)
+        self.assertGreater(len(np.unique(segments[list(sampler)][:9])), 2)
+
+        # Tiles are grouped by position rather than by the order they were
+        # added in
+        positions = [(1, 0), (3, 1), (0, 1), (2, 0), (1, 1), (0, 0), (3, 0), (2, 1)]
+        scrambled_volume = PooledVolume(iteration_size=pooled_volume.getIterationSize(),
+                                        stride=Vector(8, 8, 4))
+        for x, y in positions:
+            scrambled_volume.add(Array(np.zeros((8, 32, 32), dtype=np.uint16),
+                                       BoundingBox(Vector(32*x, 32*y, 0),
+                                                   Vector(32*x+32, 32*y+32, 8)),
+                                       iteration_size=pooled_volume.getIterationSize(),
+                                       stride=Vector(8, 8, 4)))
+        groups = TileSampler(scrambled_volume, group_size=4)._tileGroups()
+        self.assertEqual([{(0, 0), (1, 0), (0, 1), (1, 1)},
+                          {(2, 0), (3, 0), (2, 1), (3, 1)}],
+                         [{position for position, group in zip(positions, groups)
+                           if group == g} for g in range(2)])
+
+        # Subsets of data samples are visited tile by tile without shuffling
+        indexes = np.arange(len(pooled_volume))[::-3]
+        sampler = TileSampler(TorchVolume(pooled_volume), indexes,
+                              window_size=1, shuffle=False)
+        self.assertEqual(sorted(indexes.tolist()), list(sampler))
+        self.assertEqual((6, 4), sampler.getBatches(4).shape)
+
+        # A smaller window misses fewer tiles, which is counted without
+        # opening tiles ahead of time
+        pooled_volume.setLookahead(0)
+        misses = []
+        for window_size in [1, None]:
+            pooled_volume.__exit__(None, None, None)
+            pooled_volume.setStack(stack_size=2)
+            for index in TileSampler(pooled_volume, window_size=window_size,
+                                     random_state=0):
+                pooled_volume[index]
+            misses.append(pooled_volume.getCacheStats()["misses"])
+        self.assertLess(misses[0], misses[1])
+
+        with self.assertRaises(ValueError):
+            TileSampler(pooled_volume, window_size=0)
+
+    def test_shared_memory_pool(self):
+        source = np.arange(16*32*32, dtype=np.uint16).reshape(16, 32, 32)
+
+        with tempfile.TemporaryDirectory() as directory:
+            tiff_files = [os.path.join(directory, "{}.tif".format(z1))
+                          for z1 in (0, 8)]
+            for tiff_file, z1 in zip(tiff_files, (0, 8)):
+                tif.imwrite(tiff_file, source[z1:z1+8])
+
+            bounding_box = BoundingBox(Vector(8, 8, 4), Vector(24, 24, 12))
+            with SharedMemoryPool() as pool:
+                pooled_volume = _sharedTiffVolume(tiff_files, pool)
+                output = pooled_volume.get(bounding_box)
+                self.assertTrue((output.getArray() == source[4:12, 8:24, 8:24]).all())
+                self.assertEqual(2, len(pool.getNames()))
+                self.assertTrue(pooled_volume.volumes[0].getArray().isOwner())
+                self.assertEqual(2 * 8*32*32*2, pooled_volume.getCacheBytes())
+
+                # Another process attaches to the decoded tiles by name
+                context = multiprocessing.get_context("spawn")
+                queue = context.Queue()
+                process = context.Process(target=_readSharedTiffVolume,
+                                          args=(tiff_files, pool,
+                                                bounding_box, queue))
+                process.start()
+                output, is_owner = queue.get(timeout=60)
+                process.join()
+                self.assertTrue((output == source[4:12, 8:24, 8:24]).all())
+                self.assertFalse(is_owner)
+                self.assertEqual(2, len(pool.getNames()))
+                self.assertEqual(7, pooled_volume.volumes[1].getArray().getArray()[-1, -1, -1])
+
+                # A process with its own resource tracker that attaches to a
+                # tile and exits leaves the segment in place
+                subprocess.run([sys.executable, "-c",
+                                "import sys\n"
+                                "from neurotorch.datasets.datatypes import BoundingBox, Vector\n"
+                                "from neurotorch.datasets.shared import SharedArray\n"
+                                "SharedArray(name=sys.argv[1],\n"
+                                "            iteration_size=BoundingBox(Vector(0, 0, 0), Vector(1, 1, 1)),\n"
+                                "            stride=Vector(1, 1, 1)).close()",
+                                pool.getName(0)], check=True,
+                               cwd=os.path.dirname(os.path.dirname(os.path.dirname(dataset.__file__))))
+                self.assertEqual(2, len(pool.getNames()))
+                self.assertEqual(0, pooled_volume.get(BoundingBox(Vector(0, 0, 0),
+                                                                  Vector(1, 1, 1))).getArray())
+
+                # Pools and shared arrays are pickled by name
+                other_volume = _sharedTiffVolume(tiff_files,
+                                                 pickle.loads(pickle.dumps(pool)))
+                other_volume.get(bounding_box)
+                shared = pickle.loads(pickle.dumps(pool.arrays[0]))
+                shared.getArray()[0, 0, 0] = 1000
+                self.assertEqual(1000, other_volume.get(BoundingBox(Vector(0, 0, 0),
+                                                                    Vector(1, 1, 1))).getArray())
+                shared.close()
+                other_volume.__exit__(None, None, None)
+                self.assertEqual(2, len(pool.getNames()))
+
+                # Evicted tiles are unmapped and their segments removed
+                pooled_volume.__exit__(None, None, None)
+                pooled_volume = _sharedTiffVolume(tiff_files, pool, stack_size=1)
+                for z1 in (0, 8):
+                    pooled_volume.get(BoundingBox(Vector(0, 0, z1),
+                                                  Vector(8, 8, z1+4)))
+                self.assertEqual([pool.getName(1)], pool.getNames())
+                self.assertEqual([1], list(pool.arrays))
+                self.assertEqual(8*32*32*2, pooled_volume.getCacheBytes())
+                pooled_volume.__exit__(None, None, None)
+
+                with self.assertRaises(ValueError):
+                    SharedArray()
+
+            self.assertEqual([], pool.getNames())
+
     def test_pooled_volume(self):
         pooled_volume = PooledVolume(stack_size=5)
         pooled_volume.add(TiffVolume(os.path.join(IMAGE_PATH,
@@ -159,3 +1289,170 @@ class TestDataset(unittest.TestCase):
                                                  "test_pooled_volume.tif"))
                          == output.getArray()).all,
                         "JsonSpec output does not match test case")
+
+
+class TestDatatypes(unittest.TestCase):
+    def random_boxes(self, random_state, count):
+        edge1 = random_state.randint(0, 50, size=(count, 3))
+        edge2 = edge1 + random_state.randint(1, 30, size=(count, 3))
+        return BoundingBoxArray(np.stack((edge1, edge2), axis=1))
+
+    def test_bounding_box_array(self):
+        random_state = np.random.RandomState(0)
+        boxes = self.random_boxes(random_state, 200)
+        others = self.random_boxes(random_state, 200)
+        query = BoundingBox(Vector(10, 10, 10), Vector(40, 30, 20))
+
+        # Conversions round trip
+        self.assertEqual(200, len(boxes))
+        self.assertTrue((BoundingBoxArray(boxes.toBoundingBoxes()).getArray()
+                         == boxes.getArray()).all())
+        self.assertEqual(boxes[7], BoundingBox.fromArray(boxes[7].toArray()))
+        self.assertEqual(20, len(boxes[10:30]))
+
+        # Vectorized operations match the scalar operations
+        disjoint = boxes.isDisjoint(others)
+        subset = boxes.isSubset(query)
+        size = boxes.getSize()
+        translated = boxes + Vector(1, 2, 3)
+        for i, (box, other) in enumerate(zip(boxes, others)):
+            self.assertEqual(box.isDisjoint(other), disjoint[i])
+            self.assertEqual(all(query.getEdges()[0][axis] <= box.getEdges()[0][axis] and
+                                 box.getEdges()[1][axis] <= query.getEdges()[1][axis]
+                                 for axis in range(3)), subset[i])
+            self.assertEqual(box.getSize(), Vector(*size[i].tolist()))
+            self.assertEqual(box + Vector(1, 2, 3), translated[i])
+
+        self.assertEqual([True, False],
+                         BoundingBoxArray(np.array([[[12, 12, 12], [20, 20, 20]],
+                                                    [[12, 12, 12], [50, 20, 20]]])).isSubset(query).tolist())
+        self.assertEqual((0, 2, 2), BoundingBoxArray(np.zeros((0, 2, 2))).getArray().shape)
+        self.assertEqual((0, 2, 3), BoundingBoxArray([]).getArray().shape)
+
+        overlapping = boxes[~boxes.isDisjoint(query)]
+        intersection = overlapping.intersect(query)
+        for i, box in enumerate(overlapping):
+            self.assertEqual(box.intersect(query), intersection[i])
+
+        with self.assertRaises(ValueError):
+            boxes.intersect(others)
+
+    def test_immutable_datatypes(self):
+        vector = Vector(1, 2, 3)
+        bounding_box = BoundingBox(Vector(0, 0, 0), Vector(4, 5, 6))
+
+        with self.assertRaises(AttributeError):
+            vector.components = (4, 5, 6)
+        with self.assertRaises(AttributeError):
+            bounding_box.edge1 = vector
+        with self.assertRaises(AttributeError):
+            vector.other = 1
+
+        # Equal vectors and bounding boxes are interchangeable dict keys
+        lookup = {vector: 1, bounding_box: 2}
+        self.assertEqual(1, lookup[Vector(1, 2, 3)])
+        self.assertEqual(2, lookup[BoundingBox(Vector(0, 0, 0),
+                                               Vector(4, 5, 6))])
+        self.assertEqual(2, lookup[bounding_box + Vector(1, 1, 1)
+                                   - Vector(1, 1, 1)])
+
+        # Other types compare unequal, even those with the same hash
+        lookup[(1, 2, 3)] = 3
+        self.assertEqual(3, len(lookup))
+        self.assertEqual(1, lookup[vector])
+        self.assertEqual(3, lookup[(1, 2, 3)])
+        self.assertNotEqual(vector, (1, 2, 3))
+        self.assertNotEqual(bounding_box, vector)
+        self.assertFalse(bounding_box == None)
+
+        self.assertEqual(vector, pickle.loads(pickle.dumps(vector)))
+        self.assertEqual(bounding_box,
+                         pickle.loads(pickle.dumps(bounding_box)))
+
+        with self.assertRaises(ValueError):
+            Vector(1, "2", 3)
+        with self.assertRaises(ValueError):
+            BoundingBox(Vector(0, 0), Vector(1, 1, 1))
+
+    def test_patch_grid(self):
+        iteration_size = BoundingBox(Vector(0, 0, 0), Vector(16, 8, 4))
+        stride = Vector(8, 4, 2)
+        array = np.arange(20*30*40).reshape(20, 30, 40)
+        volume = Array(array, bounding_box=BoundingBox(Vector(100, 0, 50),
+                                                       Vector(140, 30, 70)),
+                       iteration_size=iteration_size, stride=stride)
+
+        # Patches are displaced from the volume's edge with Z varying fastest
+        element_count = (4, 6, 9)
+        self.assertEqual(4*6*9, len(volume))
+        for idx in (0, 1, 9, 100, len(volume) - 1):
+            element = np.unravel_index(idx, element_count)
+            edge1 = Vector(100, 0, 50) + stride * Vector(*element)
+            self.assertEqual(BoundingBox(edge1, edge1 + Vector(16, 8, 4)),
+                             volume._indexToBoundingBox(idx))
+            z, y, x = [e * s for e, s in zip(element[::-1], (2, 4, 8))]
+            self.assertTrue((volume[idx].getArray() ==
+                             array[z:z+4, y:y+8, x:x+16]).all())
+
+        # Pooled volumes share the grid of their volumes
+        other = Array(array, bounding_box=BoundingBox(Vector(0, 0, 0),
+                                                      Vector(40, 30, 20)),
+                      iteration_size=BoundingBox(Vector(0, 0, 0),
+                                                 Vector(20, 10, 10)),
+                      stride=Vector(20, 10, 10))
+        pooled_volume = PooledVolume([volume, other])
+        grid = pooled_volume.getGrid()
+        self.assertEqual(len(volume) + len(other), len(pooled_volume))
+        self.assertEqual(other._indexToBoundingBox(5),
+                         pooled_volume._indexToBoundingBox(len(volume) + 5))
+        self.assertEqual(1, grid.getSegment(len(volume)))
+        self.assertTrue((grid.getSegment(np.array([0, len(volume) - 1,
+                                                   len(volume)])) ==
+                         [0, 0, 1]).all())
+
+        # Slicing returns the bounding boxes of the patches
+        boxes = grid[len(volume) - 2:len(volume) + 2]
+        self.assertEqual(4, len(boxes))
+        self.assertEqual(pooled_volume._indexToBoundingBox(len(volume) + 1),
+                         boxes[3])
+
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "grid.npz")
+            grid.save(filename)
+            loaded_grid = PatchGrid.load(filename)
+            self.assertTrue((loaded_grid.getBoundingBoxes().getArray() ==
+                             grid.getBoundingBoxes().getArray()).all())
+
+        # Iteration settings of the pool are set on its volumes
+        pooled_volume.setIteration(BoundingBox(Vector(0, 0, 0),
+                                               Vector(20, 10, 10)),
+                                   Vector(20, 10, 10))
+        self.assertEqual(len(other), len(volume))
+        self.assertEqual(BoundingBox(Vector(120, 20, 60), Vector(140, 30, 70)),
+                         pooled_volume._indexToBoundingBox(len(volume) - 1))
+        self.assertEqual(2 * len(other), len(pooled_volume))
+
+    def test_grid_index(self):
+        random_state = np.random.RandomState(3)
+        index = GridIndex(cell_size=Vector(32, 32, 8))
+        boxes = self.random_boxes(random_state, 300)
+        for box in boxes:
+            index.add(box)
+
+        # Queries return exactly the boxes that overlap with positive volume
+        for query in self.random_boxes(random_state, 100):
+            edge1, edge2 = query.toArray()
+            expected = np.nonzero(((boxes.getArray()[:, 0] < edge2).all(axis=1)
+                                   & (boxes.getArray()[:, 1] > edge1).all(axis=1)))[0]
+            self.assertEqual(expected.tolist(), index.query(query))
+
+        # Boxes sharing only a face do not overlap
+        index = GridIndex()
+        index.add(BoundingBox(Vector(0, 0, 0), Vector(10, 10, 10)))
+        index.add(BoundingBox(Vector(0, 0, 10), Vector(10, 10, 20)))
+        self.assertEqual([0], index.query(BoundingBox(Vector(2, 2, 2),
+                                                      Vector(5, 5, 10))))
+        self.assertEqual([0, 1], index.query(BoundingBox(Vector(2, 2, 5),
+                                                         Vector(5, 5, 15))))
+        self.assertEqual([], index.query(BoundingBox(Vector(20, 0, 0),
+                                                     Vector(30, 5, 5))))